@@ -0,0 +1,168 @@
+import os
+import csv
+import sys
+import gzip
+import argparse
+
+from typing import IO, Iterator
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from config import AdminConfig
+from src.databases.bulk import TABLES, copy_to, copy_from, iter_rows, \
+    insert_values
+from src.databases.psycopg2 import close_connection_pool
+
+
+def _open(path: Path, mode: str) -> IO[bytes]:
+    """Открывает файл, сжимая его gzip, если имя заканчивается на .gz"""
+
+    if path.suffix == ".gz":
+        return gzip.open(path, mode, compresslevel=AdminConfig.COMPRESS_LEVEL)
+
+    return open(path, mode)
+
+
+def _export_table(table: str, directory: Path, compress: bool) -> str:
+    path = directory / f"{table}.csv{'.gz' if compress else ''}"
+
+    with _open(path, "wb") as output:
+        rows = copy_to(table, output)
+
+    return f"{table}: {rows} rows -> {path}"
+
+
+def export_command(args: argparse.Namespace) -> None:
+    """Выгружает таблицы параллельно, каждую своим подключением из пула"""
+
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=AdminConfig.POOL_SIZE) as pool:
+        results = pool.map(
+            lambda x: _export_table(x, args.output, args.gzip),
+            args.tables
+        )
+
+        for result in results:
+            print(result)
+
+
+def import_command(args: argparse.Namespace) -> None:
+    """Загружает таблицу из csv, сделанного export"""
+
+    with _open(args.source, "rb") as source:
+        rows, inserted = copy_from(args.table, source)
+
+    print(
+        f"{args.table}: {inserted} rows <- {args.source}, "
+        f"{rows - inserted} already present"
+    )
+
+
+def _walk_files(directory: Path) -> Iterator[Path]:
+    """Обходит дерево без рекурсии и без загрузки списка целиком"""
+
+    stack = [directory]
+
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    yield Path(entry.path)
+
+
+def _legacy_rows(directory: Path, owner_id: int) -> Iterator[tuple]:
+    extension_length = TABLES["files"].c.extension.type.length
+
+    for path in _walk_files(directory):
+        name, extension = path.name.split(".")[0], "".join(path.suffixes)[1:]
+
+        if not name or not extension or len(extension) > extension_length:
+            print(f"skipped {path}", file=sys.stderr)
+            continue
+
+        yield owner_id, name, extension, path.stat().st_size, str(path.parent)
+
+
+def import_legacy_command(args: argparse.Namespace) -> None:
+    """
+        Записывает файлы старого хранилища в каталог пачками одной
+            транзакцией, повторный запуск пропускает уже записанные
+
+        Контрольные суммы не считаются, их заполнит фоновая проверка
+    """
+
+    rows, inserted = insert_values(
+        "files",
+        ["owner_id", "name", "extension", "size", "path"],
+        _legacy_rows(args.directory, args.owner_id)
+    )
+
+    print(
+        f"files: {inserted} rows <- {args.directory}, "
+        f"{rows - inserted} already present"
+    )
+
+
+def report_command(args: argparse.Namespace) -> None:
+    """Выводит в csv количество и объем файлов каждого пользователя"""
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["owner_id", "email", "files_count", "total_size"])
+
+    rows = iter_rows(
+        "SELECT users.id, users.email, count(files.id), "
+        "coalesce(sum(files.size), 0) "
+        "FROM users LEFT JOIN files "
+        "ON files.owner_id = users.id AND files.deleted_at IS NULL "
+        "GROUP BY users.id ORDER BY users.id"
+    )
+
+    for row in rows:
+        writer.writerow(row.values())
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Массовые операции с каталогом в обход api"
+    )
+    commands = parser.add_subparsers(required=True)
+
+    export_parser = commands.add_parser("export", help="Выгрузить таблицы в csv")
+    export_parser.add_argument(
+        "--tables", nargs="+", choices=list(TABLES), default=list(TABLES)
+    )
+    export_parser.add_argument("--output", type=Path, required=True)
+    export_parser.add_argument("--gzip", action="store_true")
+    export_parser.set_defaults(handler=export_command)
+
+    import_parser = commands.add_parser("import", help="Загрузить таблицу из csv")
+    import_parser.add_argument("table", choices=list(TABLES))
+    import_parser.add_argument("source", type=Path)
+    import_parser.set_defaults(handler=import_command)
+
+    legacy_parser = commands.add_parser(
+        "import-legacy", help="Записать в каталог файлы старого хранилища"
+    )
+    legacy_parser.add_argument("directory", type=Path)
+    legacy_parser.add_argument("--owner-id", type=int, required=True)
+    legacy_parser.set_defaults(handler=import_legacy_command)
+
+    report_parser = commands.add_parser(
+        "report", help="Объем файлов пользователей"
+    )
+    report_parser.set_defaults(handler=report_command)
+
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = get_parser().parse_args()
+
+    try:
+        arguments.handler(arguments)
+
+    finally:
+        close_connection_pool()
@@ -0,0 +1,135 @@
+"""
+    Микро-бенчмарк сериализации списка файлов для /files/my
+
+    Сравнивает старый путь (ORM объекты -> FileSchema.model_validate
+        -> валидация response_model в FastAPI -> json) с быстрым
+        (кортежи колонок -> словари -> orjson)
+
+    Запуск: python -m benchmarks.files_listing [--sizes 10000 100000 1000000]
+"""
+import gc
+import time
+import argparse
+import tracemalloc
+
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from fastapi.routing import serialize_response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.utils import create_model_field
+
+from src.files.models import FilesORM
+from src.files.schemas import FileSchema
+from src.files.services import FileService
+
+
+COLUMNS = tuple(x.key for x in FileService.LISTING_COLUMNS)
+RESPONSE_FIELD = create_model_field(
+    name="Response_get_my_files",
+    type_=list[Optional[FileSchema]],
+    mode="serialization"
+)
+
+
+def make_rows(count: int) -> list[tuple]:
+    """
+        Генерирует строки в том виде, в каком их отдает драйвер
+
+        Порядок значений берется из FileService.LISTING_COLUMNS,
+            поэтому новая колонка в выборке без значения здесь
+            уронит бенчмарк, а не тихо исказит замеры
+    """
+
+    now = datetime.now(timezone.utc)
+    rows = []
+
+    for x in range(count):
+        values = {
+            "id": x,
+            "owner_id": 1,
+            "name": f"file_{x}",
+            "extension": "txt",
+            "size": x * 10,
+            "path": "/data/storage",
+            "folder_id": None if x % 2 else x // 2,
+            "created_at": now,
+            "updated_at": None if x % 2 else now,
+            "comment": None if x % 3 else "comment",
+            "checksum": f"{x:064x}",
+            "version": 1 + x % 5,
+            "volume": "main"
+        }
+        rows.append(tuple(values[column] for column in COLUMNS))
+
+    return rows
+
+
+async def orm_path(rows: list[tuple]) -> bytes:
+    """Старый путь: ORM объекты, model_validate и валидация ответа"""
+
+    files = [FilesORM(**dict(zip(COLUMNS, row))) for row in rows]
+    schemas = [FileSchema.model_validate(x) for x in files]
+
+    content = await serialize_response(
+        field=RESPONSE_FIELD,
+        response_content=schemas
+    )
+
+    return JSONResponse(content).body
+
+
+async def fast_path(rows: list[tuple]) -> bytes:
+    """Быстрый путь: словари из кортежей и orjson"""
+
+    return ORJSONResponse([dict(zip(COLUMNS, row)) for row in rows]).body
+
+
+async def measure(
+        method: Callable,
+        rows: list[tuple]
+) -> tuple[float, float]:
+    """
+        Возвращает процессорное время в секундах и пик памяти в мегабайтах
+
+        Время и память меряются отдельными прогонами,
+            так как tracemalloc сильно замедляет выполнение
+    """
+
+    gc.collect()
+    started = time.process_time()
+    await method(rows)
+    elapsed = time.process_time() - started
+
+    gc.collect()
+    tracemalloc.start()
+    await method(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / 1024 / 1024
+
+
+async def main(sizes: list[int]) -> None:
+    print(f"{'rows':>9} | {'path':>4} | {'cpu, s':>8} | {'peak, MB':>9}")
+
+    for size in sizes:
+        rows = make_rows(size)
+
+        for name, method in (("orm", orm_path), ("fast", fast_path)):
+            elapsed, peak = await measure(method, rows)
+            print(f"{size:>9} | {name:>4} | {elapsed:>8.2f} | {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[10_000, 100_000, 1_000_000]
+    )
+
+    asyncio.run(main(parser.parse_args().sizes))
@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 from pathlib import Path
 from distutils.util import strtobool
@@ -15,6 +16,40 @@ class Config:
 
     DEBUG = strtobool(os.getenv("DEBUG"))  # Режим отладки
 
+    RECONCILE_ON_START = strtobool(os.getenv("RECONCILE_ON_START") or "False")  # Сверять хранилище с базой при запуске
+    ORPHANS_OWNER_ID = int(os.getenv("ORPHANS_OWNER_ID")) \
+        if os.getenv("ORPHANS_OWNER_ID") else None  # Владелец найденных в хранилище файлов
+
+
+class VolumeConfig:
+    """Настройки размещения файлов по нескольким дискам"""
+
+    # Корни хранилища в виде name=path:weight через запятую, вес необязателен.
+    # По умолчанию один том default в BASE_DIRECTORY
+    ROOTS = {
+        name: (Path(path), float(weight or 1))
+        for name, path, weight in (
+            re.fullmatch(r"(\w+)=([^:]+)(?::([\d.]+))?", x.strip()).groups()
+            for x in (os.getenv("STORAGE_ROOTS") or "").split(",")
+            if x.strip()
+        )
+    } or {"default": (Config.BASE_DIRECTORY, 1.0)}
+    MIN_FREE_MB = int(os.getenv("STORAGE_MIN_FREE_MB") or 1024)  # Неприкосновенный запас на томе, МБ
+    USAGE_TTL = float(os.getenv("STORAGE_USAGE_TTL") or 5)  # Сколько секунд доверять замеру места
+    REBALANCE_THRESHOLD = float(os.getenv("REBALANCE_THRESHOLD") or 0.1)  # Разница заполненности для переноса
+    REBALANCE_RATE_MB = float(os.getenv("REBALANCE_RATE_MB") or 20)  # Ограничение переноса, МБ/с
+    REBALANCE_BATCH_SIZE = int(os.getenv("REBALANCE_BATCH_SIZE") or 20)  # Файлов за один шаг
+    REBALANCE_INTERVAL = int(os.getenv("REBALANCE_INTERVAL") or 600)  # Пауза при сбалансированных томах, сек
+
+
+class ReplicationConfig:
+    """Настройки копий файлов на других томах"""
+
+    FACTOR = int(os.getenv("REPLICATION_FACTOR") or 1)  # Копий файла вместе с основной, 1 - без копий
+    BATCH_SIZE = int(os.getenv("REPLICATION_BATCH_SIZE") or 100)  # Файлов и копий за один шаг
+    RATE_MB = float(os.getenv("REPLICATION_RATE_MB") or 50)  # Ограничение копирования, МБ/с
+    INTERVAL = int(os.getenv("REPLICATION_INTERVAL") or 60)  # Пауза между проходами, сек
+
 
 class PostgreSQLConfig:
     """Настройки PostgreSQL"""
@@ -28,6 +63,11 @@ class PostgreSQLConfig:
     SQLALCHEMY_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}" \
                      f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+    POOL_SIZE = int(os.getenv("PSQL_POOL_SIZE") or 10)  # Постоянных подключений в пуле
+    MAX_OVERFLOW = int(os.getenv("PSQL_MAX_OVERFLOW") or 10)  # Временных подключений сверх пула
+    WARMUP_CONNECTIONS = int(os.getenv("PSQL_WARMUP_CONNECTIONS") or 5)  # Открыть при запуске
+    AUTONOMOUS_POOL_SIZE = int(os.getenv("PSQL_AUTONOMOUS_POOL_SIZE") or 5)  # Подключений для записей вне транзакции запроса
+
 
 class RedisConfig:
     """Настройки Redis"""
@@ -36,6 +76,150 @@ class RedisConfig:
     PORT = os.getenv("REDIS_PORT") or "6379"
     URL = f"redis://{HOST}:{PORT}"
 
+    MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS") or 50)  # Размер пула соединений
+    WARMUP_CONNECTIONS = int(os.getenv("REDIS_WARMUP_CONNECTIONS") or 5)  # Открыть при запуске
+
+
+class FileEventsConfig:
+    """Настройки ленты изменений файлов"""
+
+    STREAM_MAXLEN = int(os.getenv("FILE_EVENTS_MAXLEN") or 1000)  # Событий в потоке пользователя
+    STREAM_TTL = int(os.getenv("FILE_EVENTS_TTL") or 7 * 24 * 3600)  # Срок жизни потока без событий, сек
+    HEARTBEAT = int(os.getenv("FILE_EVENTS_HEARTBEAT") or 15)  # Пауза между пустыми сообщениями, сек
+    BLOCK_MS = int(os.getenv("FILE_EVENTS_BLOCK_MS") or 1000)  # Ожидание XREAD, мс
+    READ_COUNT = int(os.getenv("FILE_EVENTS_READ_COUNT") or 1000)  # Событий потока за одно чтение
+    QUEUE_SIZE = int(os.getenv("FILE_EVENTS_QUEUE_SIZE") or 100)  # Неотправленных событий подписчика
+
+
+class FileChangesConfig:
+    """Настройки журнала изменений файлов для /files/changes"""
+
+    RETENTION_DAYS = int(os.getenv("FILE_CHANGES_RETENTION_DAYS") or 30)  # Сколько хранить изменения
+    BATCH_SIZE = int(os.getenv("FILE_CHANGES_BATCH_SIZE") or 1000)  # Изменений за один шаг очистки
+    INTERVAL = int(os.getenv("FILE_CHANGES_INTERVAL") or 3600)  # Пауза между проходами очистки, сек
+
+
+class DeltaSyncConfig:
+    """Настройки дельта-синхронизации файлов"""
+
+    BLOCK_SIZE = int(os.getenv("DELTA_BLOCK_SIZE") or 64 * 1024)  # Размер блока по умолчанию
+    MIN_BLOCK_SIZE = 1024  # Минимальный размер блока
+    MAX_BLOCK_SIZE = 16 * 1024 * 1024  # Максимальный размер блока
+    WORKERS = int(os.getenv("DELTA_WORKERS") or os.cpu_count() or 1)  # Процессы для подсчета сигнатур
+    CACHE_SIZE = int(os.getenv("DELTA_CACHE_SIZE") or 64)  # Сколько наборов сигнатур держать в памяти
+
+
+class VersioningConfig:
+    """Настройки хранения версий файлов"""
+
+    CHUNK_SIZE = int(os.getenv("VERSION_CHUNK_SIZE") or 1024 * 1024)  # Размер куска версии
+    MAX_VERSIONS = int(os.getenv("VERSION_MAX_COUNT") or 30)  # Сколько предыдущих версий хранить
+    MAX_AGE_DAYS = int(os.getenv("VERSION_MAX_AGE_DAYS") or 0)  # Сколько дней хранить версии, 0 - без ограничения
+    BATCH_SIZE = int(os.getenv("VERSION_CLEANUP_BATCH_SIZE") or 100)  # Версий и кусков за шаг очистки
+    INTERVAL = int(os.getenv("VERSION_CLEANUP_INTERVAL") or 3600)  # Пауза между проходами очистки, сек
+    CHUNK_GRACE = int(os.getenv("VERSION_CHUNK_GRACE") or 3600)  # Возраст куска без записи в базе для удаления, сек
+
+
+class FileCacheConfig:
+    """Настройки кэша содержимого небольших файлов"""
+
+    MAX_FILE_SIZE = int(os.getenv("FILE_CACHE_MAX_FILE_SIZE") or 256 * 1024)  # Наибольший кэшируемый файл, байт
+    MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES") or 64 * 1024 * 1024)  # Объем кэша на процесс, 0 - отключен
+
+
+class ThumbnailConfig:
+    """Настройки миниатюр и превью файлов"""
+
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE") or 256)  # Наибольшая сторона миниатюры, px
+    PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE") or 1024)  # Наибольшая сторона превью, px
+    WORKERS = int(os.getenv("THUMBNAIL_WORKERS") or 2)  # Процессы для генерации
+    QUEUE_SIZE = int(os.getenv("THUMBNAIL_QUEUE_SIZE") or 100)  # Ожидающих генерации файлов, сверх - при запросе
+    MAX_SOURCE_SIZE = int(os.getenv("THUMBNAIL_MAX_SOURCE_MB") or 100) * 1024 * 1024  # Наибольший исходный файл
+    QUALITY = int(os.getenv("THUMBNAIL_QUALITY") or 85)  # Качество JPEG
+    MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE") or 7 * 24 * 3600)  # Cache-Control max-age, сек
+
+
+class SignedUrlConfig:
+    """Настройки подписанных ссылок на скачивание"""
+
+    # Ключи подписи в виде kid:secret через запятую, первым указывается текущий,
+    # остальные принимаются при проверке до окончания ротации
+    KEYS = dict(
+        x.split(":", 1)
+        for x in (os.getenv("SIGNED_URL_KEYS") or "").split(",")
+        if x
+    )
+    CURRENT_KID = next(iter(KEYS), None)  # Ключ, которым подписываются новые ссылки
+    TTL = int(os.getenv("SIGNED_URL_TTL") or 3600)  # Срок жизни ссылки по умолчанию, сек
+    MAX_TTL = int(os.getenv("SIGNED_URL_MAX_TTL") or 7 * 24 * 3600)  # Максимальный срок жизни, сек
+    CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE") or 10000)  # Файлов в кэше путей
+    CACHE_TTL = int(os.getenv("SIGNED_URL_CACHE_TTL") or 60)  # Время жизни записи кэша, сек
+
+
+class TrashConfig:
+    """Настройки корзины"""
+
+    RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS") or 30)  # Сколько хранить удаленные файлы
+    PURGE_BATCH_SIZE = int(os.getenv("TRASH_PURGE_BATCH_SIZE") or 100)  # Файлов за один шаг очистки
+    PURGE_RATE = int(os.getenv("TRASH_PURGE_RATE") or 50)  # Удалений файлов в секунду
+    PURGE_INTERVAL = int(os.getenv("TRASH_PURGE_INTERVAL") or 3600)  # Пауза между проходами, сек
+
+
+class ExportConfig:
+    """Настройки выгрузки каталога файлов"""
+
+    BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE") or 1000)  # Строк за одно чтение курсора
+    COMPRESS_LEVEL = 6  # Уровень сжатия gzip
+
+
+class ScrubberConfig:
+    """Настройки фоновой проверки целостности файлов"""
+
+    ENABLED = strtobool(os.getenv("SCRUBBER_ENABLED") or "False")  # Запускать ли проверку
+    RATE_MB = float(os.getenv("SCRUBBER_RATE_MB") or 20)  # Ограничение чтения, МБ/с
+    BATCH_SIZE = int(os.getenv("SCRUBBER_BATCH_SIZE") or 100)  # Файлов за один шаг
+    WORKERS = int(os.getenv("SCRUBBER_WORKERS") or 2)  # Потоки для хэширования
+    INTERVAL = int(os.getenv("SCRUBBER_INTERVAL") or 3600)  # Пауза между проходами, сек
+
+
+class LockConfig:
+    """Настройки распределенных блокировок и выбора ведущего"""
+
+    LOCK_TTL_MS = int(os.getenv("LOCK_TTL_MS") or 30000)  # Время жизни блокировки пути
+    LOCK_TIMEOUT = float(os.getenv("LOCK_TIMEOUT") or 10)  # Сколько ждать блокировку, сек
+    LEADER_TTL_MS = int(os.getenv("LEADER_TTL_MS") or 15000)  # Время жизни лидерства
+    FENCE_RETENTION = int(os.getenv("LOCK_FENCE_RETENTION") or 24 * 3600)  # Сколько хранить токен пути без изменений, сек
+    FENCE_BATCH_SIZE = 1000  # Токенов за один шаг очистки
+    FENCE_CLEANUP_INTERVAL = 3600  # Пауза между проходами очистки, сек
+
+
+class AnalyticsConfig:
+    """Настройки сводной статистики хранилища"""
+
+    REFRESH_INTERVAL = int(os.getenv("ANALYTICS_REFRESH_INTERVAL") or 900)  # Пересчет, сек
+    MAX_ROWS = 1000  # Максимум строк в ответе
+
+
+class AdminConfig:
+    """Настройки утилиты массовых операций admin.py"""
+
+    POOL_SIZE = int(os.getenv("ADMIN_POOL_SIZE") or 4)  # Подключений к базе
+    BATCH_SIZE = int(os.getenv("ADMIN_BATCH_SIZE") or 10000)  # Строк в пачке вставки
+    ITER_SIZE = int(os.getenv("ADMIN_ITER_SIZE") or 10000)  # Строк за одну выборку курсора
+    COPY_BUFFER_SIZE = 1024 * 1024  # Размер буфера COPY
+    COMPRESS_LEVEL = 6  # Уровень сжатия gzip
+
+
+class ProfilingConfig:
+    """Настройки журнала медленных запросов и профилирования"""
+
+    SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS") or 1000)  # Порог медленного запроса
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # Значение заголовка X-Profile для профилирования
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE") or 0)  # Доля профилируемых запросов
+    PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY") or "/tmp/storage_manager_profiles"  # Куда сохранять профили
+    STATEMENT_LENGTH = 500  # Сколько символов SQL запроса записывать
+    SLOWEST_STATEMENTS = 10  # Сколько самых долгих запросов записывать
+
 
 class FastApiConfig:
     """Настройки FastApi"""
@@ -43,3 +227,5 @@ class FastApiConfig:
     TITLE = Config.NAME  # Название api
     VERSION = "0.0.1"  # Версия api
     DESCRIPTION = f"API для работы с {Config.NAME}"  # Описание api
+
+    READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT") or 2)  # Ожидание ответа зависимостей в /readyz, сек
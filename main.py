@@ -1,24 +1,123 @@
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from config import Config, FastApiConfig
-from src.auth.handlers import auth_router
-from src.files.handlers import files_router
-from src.users.handlers import users_router
+from config import Config, FastApiConfig, PostgreSQLConfig, RedisConfig, \
+    ReplicationConfig, ScrubberConfig, VolumeConfig
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+        Открывает и прогревает пулы подключений, восстанавливает
+            незавершенные операции и запускает фоновые задачи.
+            Пока это не сделано, /readyz отвечает 503
+    """
+
+    from src.coordination import LeaderElection, PathLock
+    from src.databases.sqlalchemy import warm_up_engine, dispose_engine
+    from src.databases.aioredis import warm_up_redis, close_redis_client
+    from src.files.journal import OperationJournal
+    from src.files.events import FileEventsService
+    from src.files.changes import FileChangesService
+    from src.files.trash import TrashService
+    from src.files.versions import VersionService
+    from src.analytics.services import StorageAnalyticsService
+
+    app.state.ready = False
+
+    await warm_up_engine(PostgreSQLConfig.WARMUP_CONNECTIONS)
+    await warm_up_redis(RedisConfig.WARMUP_CONNECTIONS)
+    await OperationJournal.recover()
+
+    leader = LeaderElection(Config.NAME)
+
+    if Config.RECONCILE_ON_START:
+        from src.files.services import FileService
+
+        leader.add_task(FileService.files_initialization)
+
+    if ScrubberConfig.ENABLED:
+        from src.files.scrubber import FileScrubber
+
+        leader.add_task(FileScrubber.run)
+
+    if len(VolumeConfig.ROOTS) > 1:
+        from src.files.volumes import VolumeService
+
+        leader.add_task(VolumeService.run)
+
+    if ReplicationConfig.FACTOR > 1 and len(VolumeConfig.ROOTS) > 1:
+        from src.files.replication import ReplicationService
+
+        leader.add_task(ReplicationService.run)
+
+    leader.add_task(PathLock.run)
+    leader.add_task(FileChangesService.run)
+    leader.add_task(TrashService.run)
+    leader.add_task(VersionService.run)
+    leader.add_task(StorageAnalyticsService.run)
+    leader.start()
+    app.state.ready = True
+
+    try:
+        yield
+
+    finally:
+        app.state.ready = False
+
+        await leader.stop()
+        await FileEventsService.stop()
+        await close_redis_client()
+        await dispose_engine()
+
+
+def create_app() -> FastAPI:
+    """
+        Создает приложение, модули обработчиков импортируются только здесь
+
+        Обработчики тянут за собой все сервисы файлов, поэтому после
+            create_app модули фоновых задач уже загружены, и lifespan
+            импортирует их только чтобы выбрать запускаемые задачи.
+            Тяжелые зависимости (Pillow) загружают только процессы пулов
+    """
+
+    from src.auth.handlers import auth_router
+    from src.files.handlers import files_router
+    from src.folders.handlers import folders_router
+    from src.users.handlers import users_router
+    from src.analytics.handlers import analytics_router
+    from src.metrics import metrics_router
+    from src.health import health_router
+    from src.profiling import ProfilingMiddleware
+
+    app = FastAPI(
+        title=FastApiConfig.TITLE,
+        description=FastApiConfig.DESCRIPTION,
+        version=FastApiConfig.VERSION,
+        debug=Config.DEBUG,
+        lifespan=lifespan
+    )
 
+    app.include_router(
+        auth_router,
+        prefix="/auth",
+        tags=["Auth"],
+        include_in_schema=Config.DEBUG
+    )
 
-app = FastAPI(
-    title=FastApiConfig.TITLE,
-    description=FastApiConfig.DESCRIPTION,
-    version=FastApiConfig.VERSION,
-    debug=Config.DEBUG
-)
+    app.include_router(files_router, prefix="/files", tags=["Files"])
+    app.include_router(folders_router, prefix="/folders", tags=["Folders"])
+    app.include_router(users_router, prefix="/users", tags=["Users"])
+    app.include_router(
+        analytics_router,
+        prefix="/analytics",
+        tags=["Analytics"]
+    )
+    app.include_router(metrics_router, include_in_schema=False)
+    app.include_router(health_router, include_in_schema=False)
 
-app.include_router(
-    auth_router,
-    prefix="/auth",
-    tags=["Auth"],
-    include_in_schema=Config.DEBUG
-)
+    app.add_middleware(ProfilingMiddleware)
 
-app.include_router(files_router, prefix="/files", tags=["Files"])
-app.include_router(users_router, prefix="/users", tags=["Users"])
+    return app
@@ -2,10 +2,13 @@ from sqlalchemy import create_engine
 
 from config import Config, PostgreSQLConfig
 from src.databases.sqlalchemy import Base
+from main import create_app
 
 
 if __name__ == "__main__":
     if Config.DEBUG:
+        create_app()  # Импортирует модели всех модулей
+
         URL = PostgreSQLConfig.SQLALCHEMY_URL.replace("asyncpg", "psycopg2")
 
         engine = create_engine(URL)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AnalyticsConfig
+
+from .schemas import StorageRollupSchema
+from .services import StorageAnalyticsService, GroupBy
+from ..auth.services import get_admin_id
+from ..databases.sqlalchemy import get_db
+
+
+analytics_router = APIRouter()
+
+
+@analytics_router.get("/storage", response_model=list[StorageRollupSchema])
+async def get_storage_rollups(
+        admin_id: int = Depends(get_admin_id),
+        group_by: list[GroupBy] = Query(
+            ["owner_id"],
+            description="Поля группировки"
+        ),
+        owner_id: int | None = Query(None, description="Только этот пользователь"),
+        limit: int = Query(100, ge=1, le=AnalyticsConfig.MAX_ROWS),
+        db: AsyncSession = Depends(get_db)
+) -> list[StorageRollupSchema]:
+    """Возвращает сводную статистику хранилища, доступно администраторам"""
+
+    return await StorageAnalyticsService.get_rollups(
+        group_by, owner_id, limit, db
+    )
@@ -0,0 +1,60 @@
+from sqlalchemy import DDL, event, table, column, BigInteger, String, \
+    TIMESTAMP
+
+from ..databases.sqlalchemy import metadata
+
+
+# Границы возрастных групп файлов: название и интервал от момента пересчета
+AGE_BUCKETS = (
+    ("1d", "1 day"),
+    ("7d", "7 days"),
+    ("30d", "30 days"),
+    ("365d", "365 days"),
+)
+OLDER_BUCKET = "older"
+
+_age_bucket = "CASE " + " ".join(
+    f"WHEN created_at > now() - interval '{interval}' THEN '{name}'"
+    for name, interval in AGE_BUCKETS
+) + f" ELSE '{OLDER_BUCKET}' END"
+
+event.listen(
+    metadata,
+    "after_create",
+    DDL(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS storage_rollups AS "
+        "SELECT owner_id, extension, "
+        f"{_age_bucket} AS age_bucket, "
+        "count(*) AS files_count, "
+        "sum(size)::bigint AS total_size, "
+        "now() AS refreshed_at "
+        "FROM files "
+        "WHERE deleted_at IS NULL "
+        "GROUP BY 1, 2, 3"
+    )
+)
+event.listen(
+    metadata,
+    "after_create",
+    DDL(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_storage_rollups "
+        "ON storage_rollups (owner_id, extension, age_bucket)"
+    )
+)
+event.listen(
+    metadata,
+    "before_drop",
+    DDL("DROP MATERIALIZED VIEW IF EXISTS storage_rollups")
+)
+
+# Материализованное представление не входит в metadata как таблица,
+# чтобы create_all не создавал его обычной таблицей
+storage_rollups = table(
+    "storage_rollups",
+    column("owner_id", BigInteger),
+    column("extension", String),
+    column("age_bucket", String),
+    column("files_count", BigInteger),
+    column("total_size", BigInteger),
+    column("refreshed_at", TIMESTAMP(timezone=True)),
+)
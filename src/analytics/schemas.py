@@ -0,0 +1,22 @@
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class StorageRollupSchema(BaseModel):
+    """Итог по группе, поля вне группировки равны None"""
+
+    owner_id: int | None = None  # Пользователь
+    extension: str | None = None  # Расширение файлов
+    age_bucket: str | None = None  # Возрастная группа: 1d, 7d, 30d, 365d, older
+    files_count: int  # Количество файлов
+    total_size: int  # Суммарный размер файлов в байтах
+
+
+class StorageUsageSchema(BaseModel):
+    """Использование хранилища пользователем"""
+
+    files_count: int  # Количество файлов
+    total_size: int  # Суммарный размер файлов в байтах
+    refreshed_at: datetime | None  # Когда были пересчитаны данные
+    by_extension: list[StorageRollupSchema]  # По расширениям
+    by_age: list[StorageRollupSchema]  # По возрастным группам
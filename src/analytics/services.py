@@ -0,0 +1,134 @@
+import time
+import asyncio
+import traceback
+
+from typing import Literal
+
+from sqlalchemy import select, text
+from sqlalchemy.sql import func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AnalyticsConfig
+
+from .models import storage_rollups
+from .schemas import StorageRollupSchema, StorageUsageSchema
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Summary
+
+
+GroupBy = Literal["owner_id", "extension", "age_bucket"]
+
+refresh_duration = Summary(
+    "storage_rollups_refresh_seconds",
+    "Время пересчета сводной статистики хранилища"
+)
+
+
+class StorageAnalyticsService:
+    """
+        Сводная статистика хранилища по пользователям,
+            расширениям и возрасту файлов
+
+        Данные берутся из материализованного представления storage_rollups,
+            которое ведущий экземпляр пересчитывает по расписанию, поэтому
+            отчеты не читают таблицу files
+    """
+
+    @staticmethod
+    async def refresh() -> None:
+        """Пересчитывает представление, не блокируя чтение из него"""
+
+        started = time.monotonic()
+        db = session_factory()
+
+        try:
+            await db.execute(
+                text("REFRESH MATERIALIZED VIEW CONCURRENTLY storage_rollups")
+            )
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        refresh_duration.observe(time.monotonic() - started)
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Пересчитывает представление с интервалом
+
+            Запускается только на ведущем экземпляре
+        """
+
+        while True:
+            try:
+                await cls.refresh()
+
+            except Exception:
+                traceback.print_exc()
+
+            await asyncio.sleep(AnalyticsConfig.REFRESH_INTERVAL)
+
+    @staticmethod
+    async def get_rollups(
+            group_by: list[GroupBy],
+            owner_id: int | None,
+            limit: int,
+            db: AsyncSession
+    ) -> list[StorageRollupSchema]:
+        """Возвращает итоги по выбранным группам, начиная с самых объемных"""
+
+        columns = [storage_rollups.c[x] for x in dict.fromkeys(group_by)]
+        total_size = func.sum(storage_rollups.c.total_size)
+
+        query = (
+            select(
+                *columns,
+                func.sum(storage_rollups.c.files_count).label("files_count"),
+                total_size.label("total_size")
+            )
+            .group_by(*columns)
+            .order_by(total_size.desc())
+            .limit(limit)
+        )
+
+        if owner_id is not None:
+            query = query.where(storage_rollups.c.owner_id == owner_id)
+
+        rows = await db.execute(query)
+
+        return [StorageRollupSchema(**x._mapping) for x in rows]
+
+    @classmethod
+    async def get_user_usage(
+            cls,
+            user_id: int,
+            db: AsyncSession
+    ) -> StorageUsageSchema:
+        """Возвращает использование хранилища пользователем"""
+
+        totals = await db.execute(
+            select(
+                func.coalesce(func.sum(storage_rollups.c.files_count), 0),
+                func.coalesce(func.sum(storage_rollups.c.total_size), 0),
+                func.max(storage_rollups.c.refreshed_at)
+            )
+            .where(storage_rollups.c.owner_id == user_id)
+        )
+        files_count, total_size, refreshed_at = totals.one()
+
+        return StorageUsageSchema(
+            files_count=files_count,
+            total_size=total_size,
+            refreshed_at=refreshed_at,
+            by_extension=await cls.get_rollups(
+                ["extension"], user_id, AnalyticsConfig.MAX_ROWS, db
+            ),
+            by_age=await cls.get_rollups(
+                ["age_bucket"], user_id, AnalyticsConfig.MAX_ROWS, db
+            )
+        )
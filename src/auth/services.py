@@ -12,6 +12,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..users.models import UsersORM
 from ..databases.aioredis import get_redis_cursor
+from ..databases.sqlalchemy import get_db
 
 
 oauth2_schema = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -109,3 +110,23 @@ async def check_auth(
 ) -> None:
     """Проверяет аутентификацию"""
     pass
+
+
+async def get_admin_id(
+        user_id: int = Depends(get_user_id),
+        db: AsyncSession = Depends(get_db)
+) -> int:
+    """
+        Возвращает идентификатор пользователя, если он администратор,
+            иначе возникает сообщение 403 FORBIDDEN
+    """
+
+    is_admin = await db.scalar(
+        select(UsersORM.is_admin)
+        .where(UsersORM.id == user_id)
+    )
+
+    if not is_admin:
+        raise HTTPException(status_code=403)
+
+    return user_id
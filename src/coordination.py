@@ -0,0 +1,457 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import hashlib
+import traceback
+
+from typing import Callable, Awaitable
+from datetime import timedelta
+
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from sqlalchemy import Column, BigInteger, String, TIMESTAMP, select, delete
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import LockConfig
+
+from .databases.aioredis import get_redis_client
+from .databases.sqlalchemy import Base, session_factory
+from .metrics import Counter, Gauge, Summary
+
+
+# Продлевает ключ, только если он все еще принадлежит владельцу
+EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Удаляет ключ, только если он все еще принадлежит владельцу
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Выдает токен ограждения пути: больше предыдущего и не меньше времени
+# redis в микросекундах, поэтому он растет и после истечения ключа
+FENCE_SCRIPT = """
+local now = redis.call("time")
+local floor = tonumber(now[1]) * 1000000 + tonumber(now[2])
+local token = redis.call("incr", KEYS[1])
+if token < floor then
+    token = floor
+    redis.call("set", KEYS[1], string.format("%.0f", token))
+end
+redis.call("pexpire", KEYS[1], ARGV[1])
+return token
+"""
+
+lock_wait = Summary("path_lock_wait_seconds", "Время ожидания блокировки пути")
+lock_timeouts = Counter("path_lock_timeouts_total", "Не дождались блокировки пути")
+lock_lost = Counter("path_lock_lost_total", "Блокировка потеряна во время операции")
+lock_fenced = Counter("path_lock_fenced_total", "Фиксация отклонена устаревшим токеном")
+is_leader = Gauge("leader_is_leader", "Является ли процесс ведущим")
+
+
+class PathFencesORM(Base):
+    __tablename__ = "path_fences"
+
+    key = Column(String(40), primary_key=True)  # sha1 пути, как в ключе блокировки
+    token = Column(BigInteger, nullable=False)  # Последний зафиксированный токен ограждения
+    updated_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False
+    )
+
+
+class PathLock:
+    """
+        Распределенная блокировка путей в хранилище через redis
+
+        Значение ключа - случайный токен владельца. Продлить или снять
+            блокировку может только он, поэтому владелец, чья аренда истекла
+            (например, после паузы процесса), не снимет чужую. Пока
+            блокировка удерживается, она продлевается в фоне. Перед фиксацией
+            транзакции проверяется, что продление не сорвалось и с последнего
+            успешного прошло меньше LOCK_TTL_MS, иначе транзакция откатывается
+
+        Вместе с блокировкой выдается токен ограждения, который растет с
+            каждым захватом пути. Фиксация записывает токены в path_fences
+            той же транзакцией, и только если они больше записанных там, иначе
+            транзакция откатывается. Поэтому владелец, замерший после проверки
+            дольше LOCK_TTL_MS, не зафиксирует изменения поверх следующего.
+            Строка path_fences блокируется до фиксации, так что изменения
+            владельцев одного пути фиксируются в порядке их токенов
+
+        Несколько путей блокируются в отсортированном порядке,
+            чтобы встречные операции не ждали друг друга бесконечно
+    """
+
+    def __init__(self, *paths: str, timeout: float | None = None) -> None:
+        self.paths = sorted(set(paths))
+        self.timeout = LockConfig.LOCK_TIMEOUT if timeout is None else timeout
+        self.tokens: dict[str, str] = {}
+        self.fences: dict[str, int] = {}
+        self._keepalive: asyncio.Task | None = None
+        self._extended_at: float | None = None  # Начало последнего продления всех путей
+        self._lost = False
+        self._committed = False
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    @classmethod
+    def _key(cls, path: str) -> str:
+        return f"lock:path:{cls._hash(path)}"
+
+    async def _acquire(self, path: str) -> None:
+        """Ждет освобождения пути и занимает его"""
+
+        redis = get_redis_client()
+        key = self._key(path)
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+        delay = 0.01
+
+        while True:
+            attempt = time.monotonic()
+
+            if await redis.set(key, token, nx=True, px=LockConfig.LOCK_TTL_MS):
+                break
+
+            if time.monotonic() - started >= self.timeout:
+                lock_timeouts.inc()
+                raise HTTPException(status_code=423, detail="file is locked")
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        lock_wait.observe(time.monotonic() - started)
+        self.tokens[path] = token
+        self.fences[path] = await redis.eval(
+            FENCE_SCRIPT, 1, f"{key}:fence", LockConfig.LOCK_TTL_MS
+        )
+
+        if self._extended_at is None:
+            self._extended_at = attempt
+
+    async def _extend(self) -> None:
+        """
+            Продлевает блокировки, пока они удерживаются
+
+            Ошибка redis не считается потерей сразу: продление повторится,
+                а ensure откажет, если аренда успеет истечь
+        """
+
+        redis = get_redis_client()
+
+        while True:
+            await asyncio.sleep(LockConfig.LOCK_TTL_MS / 3000)
+
+            if not self.tokens:
+                continue
+
+            started = time.monotonic()
+
+            try:
+                for path, token in list(self.tokens.items()):
+                    extended = await redis.eval(
+                        EXTEND_SCRIPT, 1, self._key(path),
+                        token, LockConfig.LOCK_TTL_MS
+                    )
+
+                    if not extended:
+                        self._lost = True
+                        lock_lost.inc()
+                        return
+
+            except RedisError:
+                traceback.print_exc()
+                continue
+
+            self._extended_at = started
+
+    async def _stop_keepalive(self) -> None:
+        if self._keepalive is None:
+            return
+
+        self._keepalive.cancel()
+
+        try:
+            await self._keepalive
+        except asyncio.CancelledError:
+            pass
+
+        self._keepalive = None
+
+    async def _release(self) -> None:
+        redis = get_redis_client()
+
+        for path, token in self.tokens.items():
+            try:
+                await redis.eval(RELEASE_SCRIPT, 1, self._key(path), token)
+            except RedisError:
+                traceback.print_exc()
+
+        self.tokens.clear()
+        self.fences.clear()
+
+    def ensure(self) -> None:
+        """
+            Проверяет, что блокировки все еще удерживаются
+
+            Вызывается перед фиксацией транзакции, чтобы изменения
+                владельца, потерявшего блокировку, не попали в базу
+        """
+
+        if self._lost or (
+            self._extended_at is not None and
+            time.monotonic() - self._extended_at >= LockConfig.LOCK_TTL_MS / 1000
+        ):
+            raise HTTPException(
+                status_code=409,
+                detail="lock was lost, the operation is rolled back"
+            )
+
+    async def _fence(self, db: AsyncSession) -> None:
+        """
+            Записывает токены путей в транзакцию и откатывает ее,
+                если по какому-то пути уже зафиксирован токен не меньше
+        """
+
+        for path in self.paths:
+            token = self.fences[path]
+            statement = insert(PathFencesORM).values(
+                key=self._hash(path), token=token
+            )
+            accepted = await db.scalar(
+                statement
+                .on_conflict_do_update(
+                    index_elements=[PathFencesORM.key],
+                    set_={"token": token, "updated_at": func.now()},
+                    where=PathFencesORM.token < token
+                )
+                .returning(PathFencesORM.token)
+            )
+
+            if accepted is None:
+                lock_fenced.inc()
+                await db.rollback()
+                raise HTTPException(
+                    status_code=409,
+                    detail="lock was lost, the operation is rolled back"
+                )
+
+    async def commit(self, db: AsyncSession) -> None:
+        """Фиксирует транзакцию, пока пути еще заблокированы"""
+
+        self.ensure()
+        await self._fence(db)
+        await db.commit()
+        self._committed = True
+
+    @staticmethod
+    async def prune_fences() -> int:
+        """
+            Удаляет пачку токенов путей, не менявшихся дольше
+                LockConfig.FENCE_RETENTION, и возвращает ее размер
+
+            Новый токен не меньше текущего времени redis, поэтому после
+                удаления строки ограждение теряет только владелец,
+                замерший дольше этого срока
+        """
+
+        db = session_factory()
+
+        try:
+            keys = await db.scalars(
+                select(PathFencesORM.key)
+                .where(
+                    PathFencesORM.updated_at <
+                    func.now() - timedelta(seconds=LockConfig.FENCE_RETENTION)
+                )
+                .limit(LockConfig.FENCE_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            keys = keys.all()
+
+            if keys:
+                await db.execute(
+                    delete(PathFencesORM)
+                    .where(PathFencesORM.key.in_(keys))
+                )
+                await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        return len(keys)
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Очищает устаревшие токены путей
+
+            Запускается только на ведущем экземпляре
+        """
+
+        while True:
+            try:
+                pruned = await cls.prune_fences()
+
+            except Exception:
+                traceback.print_exc()
+                pruned = 0
+
+            if not pruned:
+                await asyncio.sleep(LockConfig.FENCE_CLEANUP_INTERVAL)
+
+    async def __aenter__(self) -> "PathLock":
+        # Продление запускается сразу, чтобы занятые пути не истекли,
+        # пока ждем остальные
+        self._keepalive = asyncio.create_task(self._extend())
+
+        try:
+            for path in self.paths:
+                await self._acquire(path)
+
+        except BaseException:
+            await self._stop_keepalive()
+            await self._release()
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self._stop_keepalive()
+        await self._release()
+
+        # После commit изменения уже в базе, сообщать об откате нельзя
+        if exc_type is None and not self._committed:
+            self.ensure()
+
+
+class LeaderElection:
+    """
+        Выбор одного ведущего экземпляра среди всех процессов и хостов
+
+        Задачи, добавленные через add_task, выполняются только на ведущем
+            и отменяются, если он перестал им быть
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.key = f"leader:{name}"
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.is_leader = False
+
+        self._factories: list[Callable[[], Awaitable[None]]] = []
+        self._tasks: list[asyncio.Task] = []
+        self._loop_task: asyncio.Task | None = None
+
+    def add_task(self, factory: Callable[[], Awaitable[None]]) -> None:
+        """Добавляет корутину, которая выполняется только на ведущем"""
+
+        self._factories.append(factory)
+
+    @staticmethod
+    async def _guard(factory: Callable[[], Awaitable[None]]) -> None:
+        """Выполняет задачу ведущего, не давая ошибке пропасть молча"""
+
+        try:
+            await factory()
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            traceback.print_exc()
+
+    def _elect(self) -> None:
+        self.is_leader = True
+        is_leader.set(1, name=self.name)
+        self._tasks = [
+            asyncio.create_task(self._guard(x)) for x in self._factories
+        ]
+
+    async def _demote(self) -> None:
+        if not self.is_leader:
+            return
+
+        self.is_leader = False
+        is_leader.set(0, name=self.name)
+
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self) -> None:
+        redis = get_redis_client()
+        ttl = LockConfig.LEADER_TTL_MS
+
+        try:
+            while True:
+                try:
+                    if self.is_leader:
+                        if not await redis.eval(
+                            EXTEND_SCRIPT, 1, self.key, self.identity, ttl
+                        ):
+                            await self._demote()
+
+                    elif await redis.set(self.key, self.identity, nx=True, px=ttl):
+                        self._elect()
+
+                except RedisError:
+                    traceback.print_exc()
+                    await self._demote()
+
+                await asyncio.sleep(ttl / 3000)
+
+        finally:
+            was_leader = self.is_leader
+            await self._demote()
+
+            if was_leader:
+                try:
+                    await redis.eval(
+                        RELEASE_SCRIPT, 1, self.key, self.identity
+                    )
+                except RedisError:
+                    pass
+
+    def start(self) -> None:
+        """Начинает участвовать в выборах"""
+
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Выходит из выборов, отменяя задачи ведущего"""
+
+        if self._loop_task is None:
+            return
+
+        self._loop_task.cancel()
+
+        try:
+            await self._loop_task
+        except asyncio.CancelledError:
+            pass
+
+        self._loop_task = None
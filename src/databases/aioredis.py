@@ -1,19 +1,70 @@
+import time
+import asyncio
+
 from typing import AsyncIterable
 from redis.asyncio import Redis
 
 from config import RedisConfig
 
+from ..profiling import trace_redis
+
+
+class TracedRedis(Redis):
+    """Клиент redis, учитывающий время команд в журнале медленных запросов"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+
+        try:
+            return await super().execute_command(*args, **options)
+
+        finally:
+            trace_redis(str(args[0]), time.perf_counter() - started)
+
+
+_redis_client: Redis | None = None
+
+
+def get_redis_client() -> Redis:
+    """Возвращает общее подключение к redis с пулом соединений процесса"""
+
+    global _redis_client
+
+    if _redis_client is None:
+        _redis_client = TracedRedis.from_url(
+            url=RedisConfig.URL,
+            encoding="utf-8",
+            decode_responses=True,
+            max_connections=RedisConfig.MAX_CONNECTIONS
+        )
+
+    return _redis_client
+
+
+async def warm_up_redis(connections: int) -> None:
+    """Заранее открывает соединения пула"""
+
+    redis = get_redis_client()
+
+    await asyncio.gather(*(redis.ping() for _ in range(connections)))
+
+
+async def close_redis_client() -> None:
+    """Закрывает общее подключение и его пул"""
+
+    global _redis_client
+
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
+
 
 async def get_redis_cursor() -> AsyncIterable[Redis]:
-    """Возвращает подключение к redis"""
-
-    cursor = Redis.from_url(
-        url=RedisConfig.URL,
-        encoding="utf-8",
-        decode_responses=True
-    )
-    try:
-        yield cursor
-
-    finally:
-        await cursor.close()
+    """
+        Возвращает подключение к redis
+
+        Соединения берутся из общего пула процесса, а не открываются
+            заново на каждый запрос
+    """
+
+    yield get_redis_client()
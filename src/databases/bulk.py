@@ -0,0 +1,222 @@
+import uuid
+
+from typing import IO, Iterable, Iterator, Any
+
+from psycopg2 import sql
+from psycopg2.extras import DictCursor, execute_values
+
+from config import AdminConfig
+
+from .psycopg2 import pooled_connection
+from ..users.models import UsersORM
+from ..files.models import FilesORM
+
+
+# Таблицы, которые можно выгружать и загружать целиком
+TABLES = {
+    "users": UsersORM.__table__,
+    "files": FilesORM.__table__
+}
+
+
+def _columns(table: str) -> list[str]:
+    if table not in TABLES:
+        raise ValueError(f"unknown table {table}")
+
+    return [x.name for x in TABLES[table].columns]
+
+
+def _stage(cursor, table: str, columns: list[str]) -> sql.Identifier:
+    """Создает временную таблицу с колонками таблицы, удаляемую при фиксации"""
+
+    staging = sql.Identifier(f"staging_{table}")
+
+    cursor.execute(
+        sql.SQL(
+            "CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+            "SELECT {columns} FROM {table} WITH NO DATA"
+        ).format(
+            staging=staging,
+            table=sql.Identifier(table),
+            columns=sql.SQL(", ").join(map(sql.Identifier, columns))
+        )
+    )
+
+    return staging
+
+
+def _merge(cursor, table: str, columns: list[str], staging: sql.Identifier) -> int:
+    """
+        Переносит строки из временной таблицы, пропуская конфликтующие
+            с уникальными индексами. Возвращает количество вставленных
+
+        Владельцам, получившим файлы, в той же транзакции увеличивается
+            версия списка файлов, и журнал изменений считается очищенным
+            до нее: /files/my перестает отвечать 304 по старому ETag,
+            а /files/changes с более ранней версией отвечает reset вместо
+            записи изменения на каждый загруженный файл
+    """
+
+    columns = sql.SQL(", ").join(map(sql.Identifier, columns))
+    query = sql.SQL(
+        "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+        "ON CONFLICT DO NOTHING"
+    ).format(table=sql.Identifier(table), columns=columns, staging=staging)
+
+    if table != "files":
+        cursor.execute(query)
+
+        return cursor.rowcount
+
+    cursor.execute(
+        sql.SQL(
+            "WITH inserted AS ({query} RETURNING owner_id), "
+            "owners AS ("
+            "UPDATE users SET files_version = files_version + 1, "
+            "files_changes_pruned = files_version + 1 "
+            "WHERE id IN (SELECT owner_id FROM inserted)"
+            ") "
+            "SELECT count(*) FROM inserted"
+        ).format(query=query)
+    )
+
+    return cursor.fetchone()[0]
+
+
+def copy_to(table: str, output: IO[bytes]) -> int:
+    """
+        Выгружает таблицу в csv с заголовком через COPY TO STDOUT
+
+        Строки идут потоком прямо из сервера в файл без разбора
+            на стороне python. Возвращает количество строк
+    """
+
+    columns = sql.SQL(", ").join(map(sql.Identifier, _columns(table)))
+    query = sql.SQL(
+        "COPY (SELECT {columns} FROM {table} ORDER BY id) "
+        "TO STDOUT WITH (FORMAT csv, HEADER true)"
+    ).format(columns=columns, table=sql.Identifier(table))
+
+    with pooled_connection() as connection, connection.cursor() as cursor:
+        cursor.copy_expert(query, output, size=AdminConfig.COPY_BUFFER_SIZE)
+
+        return cursor.rowcount
+
+
+def copy_from(table: str, source: IO[bytes]) -> tuple[int, int]:
+    """
+        Загружает csv с заголовком в таблицу через COPY FROM STDIN
+
+        Строки копируются во временную таблицу и переносятся одной
+            транзакцией, уже существующие пропускаются, поэтому прерванную
+            загрузку можно просто повторить. После нее счетчик
+            идентификаторов сдвигается за максимальный id.
+            Возвращает количество прочитанных и вставленных строк
+    """
+
+    header = source.readline().decode().strip().split(",")
+    unknown = set(header) - set(_columns(table))
+
+    if unknown:
+        raise ValueError(f"unknown columns {', '.join(sorted(unknown))}")
+
+    with pooled_connection() as connection, connection.cursor() as cursor:
+        staging = _stage(cursor, table, header)
+        query = sql.SQL(
+            "COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)"
+        ).format(
+            staging=staging,
+            columns=sql.SQL(", ").join(map(sql.Identifier, header))
+        )
+
+        cursor.copy_expert(query, source, size=AdminConfig.COPY_BUFFER_SIZE)
+        rows = cursor.rowcount
+        inserted = _merge(cursor, table, header, staging)
+
+        cursor.execute(
+            sql.SQL(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM {table}"
+            ).format(table=sql.Identifier(table)),
+            (table,)
+        )
+
+    return rows, inserted
+
+
+def iter_rows(
+        query: str | sql.Composable,
+        params: tuple | dict | None = None
+) -> Iterator[dict]:
+    """
+        Выполняет запрос именованным курсором на стороне сервера
+
+        Строки подгружаются пачками по AdminConfig.ITER_SIZE,
+            поэтому в памяти не держится весь результат
+    """
+
+    with pooled_connection() as connection:
+        with connection.cursor(
+            name=f"admin_{uuid.uuid4().hex}",
+            cursor_factory=DictCursor
+        ) as cursor:
+            cursor.itersize = AdminConfig.ITER_SIZE
+            cursor.execute(query, params)
+
+            for row in cursor:
+                yield dict(row)
+
+
+def _batches(
+        rows: Iterable[tuple],
+        size: int
+) -> Iterator[list[tuple]]:
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def insert_values(
+        table: str,
+        columns: list[str],
+        rows: Iterable[tuple[Any, ...]]
+) -> tuple[int, int]:
+    """
+        Вставляет строки пачками через execute_values
+
+        Пачки пишутся во временную таблицу одного подключения и
+            переносятся в таблицу одной транзакцией, уже существующие
+            строки пропускаются. Конфликт не оставляет загрузку
+            наполовину, а повтор после сбоя досоздает недостающее.
+            Возвращает количество прочитанных и вставленных строк
+    """
+
+    unknown = set(columns) - set(_columns(table))
+
+    if unknown:
+        raise ValueError(f"unknown columns {', '.join(sorted(unknown))}")
+
+    staged = 0
+
+    with pooled_connection() as connection, connection.cursor() as cursor:
+        staging = _stage(cursor, table, columns)
+        query = sql.SQL("INSERT INTO {staging} ({columns}) VALUES %s").format(
+            staging=staging,
+            columns=sql.SQL(", ").join(map(sql.Identifier, columns))
+        )
+
+        for batch in _batches(rows, AdminConfig.BATCH_SIZE):
+            execute_values(cursor, query, batch, page_size=len(batch))
+            staged += len(batch)
+
+        inserted = _merge(cursor, table, columns, staging)
+
+    return staged, inserted
@@ -1,22 +1,26 @@
-from decimal import Decimal
-from typing import Optional, Callable, Generator
+import threading
+
+from typing import Optional, Callable, Generator, Iterator
+from contextlib import contextmanager
 
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import DictCursor
+from psycopg2.extensions import new_type, register_type, DECIMAL
 from psycopg2._psycopg import connection as Connection
 
-from config import PostgreSQLConfig
-
+from config import PostgreSQLConfig, AdminConfig
 
-def _formats_data_types(row: dict) -> dict:
-    """Форматирует типы данных"""
-    # decimal to int
 
-    for key, value in row.items():
-        if isinstance(value, Decimal):
-            row[key] = float(value)
+# numeric приводится к float при разборе ответа, а не перебором строк
+NUMERIC_AS_FLOAT = new_type(
+    DECIMAL.values,
+    "NUMERIC_AS_FLOAT",
+    lambda value, cursor: float(value) if value is not None else None
+)
 
-    return row
+_pool: ThreadedConnectionPool | None = None
+_pool_lock = threading.Lock()
 
 
 def _fetch_one_wrapper(method) -> Callable:
@@ -26,7 +30,7 @@ def _fetch_one_wrapper(method) -> Callable:
         row = method(*args, **kwargs)
 
         if row is not None:
-            row = _formats_data_types(dict(row))
+            row = dict(row)
 
         return row
 
@@ -38,40 +42,109 @@ def _fetch_all_wrapper(method) -> Callable:
 
     def wrapper(*args, **kwargs) -> list[Optional[dict]]:
         rows = method(*args, **kwargs)
-        rows = [_formats_data_types(dict(row)) for row in rows]
+        rows = [dict(row) for row in rows]
 
         return rows
 
     return wrapper
 
 
-def get_postgresql_connection() -> tuple[Connection, DictCursor]:
-    """Подключение к postgresql"""
-
-    connection = psycopg2.connect(
-        user=PostgreSQLConfig.DB_USER,
-        password=PostgreSQLConfig.DB_PASSWORD,
-        host=PostgreSQLConfig.DB_HOST,
-        port=PostgreSQLConfig.DB_PORT,
-        database=PostgreSQLConfig.DB_NAME
-    )
-    connection.autocommit = True
+def _connection_params() -> dict:
+    return {
+        "user": PostgreSQLConfig.DB_USER,
+        "password": PostgreSQLConfig.DB_PASSWORD,
+        "host": PostgreSQLConfig.DB_HOST,
+        "port": PostgreSQLConfig.DB_PORT,
+        "database": PostgreSQLConfig.DB_NAME
+    }
+
+
+def get_connection_pool() -> ThreadedConnectionPool:
+    """Возвращает пул подключений процесса, создавая его при первом обращении"""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                minconn=1,
+                maxconn=AdminConfig.POOL_SIZE,
+                **_connection_params()
+            )
+
+    return _pool
+
+
+def close_connection_pool() -> None:
+    """Закрывает все подключения пула"""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def pooled_connection() -> Iterator[Connection]:
+    """
+        Берет подключение из пула на время одной транзакции
+
+        Транзакция фиксируется при успешном выходе и откатывается
+            при ошибке, после чего подключение возвращается в пул
+    """
 
+    pool = get_connection_pool()
+    connection = pool.getconn()
+    register_type(NUMERIC_AS_FLOAT, connection)
+
+    try:
+        yield connection
+        connection.commit()
+
+    except BaseException:
+        connection.rollback()
+        raise
+
+    finally:
+        pool.putconn(connection)
+
+
+def _dict_cursor(connection: Connection) -> DictCursor:
     cursor = connection.cursor(cursor_factory=DictCursor)
     cursor.fetchone = _fetch_one_wrapper(cursor.fetchone)
     cursor.fetchall = _fetch_all_wrapper(cursor.fetchall)
 
-    return connection, cursor
+    return cursor
+
+
+def get_postgresql_connection() -> tuple[Connection, DictCursor]:
+    """Отдельное подключение к postgresql в режиме autocommit"""
+
+    connection = psycopg2.connect(**_connection_params())
+    connection.autocommit = True
+    register_type(NUMERIC_AS_FLOAT, connection)
+
+    return connection, _dict_cursor(connection)
 
 
 def get_psql_cursor() -> Generator[DictCursor, None, None]:
-    """Генератор курсоров PostgreSQL"""
+    """
+        Генератор курсоров PostgreSQL
 
-    psql_connect, psql_cursor = get_postgresql_connection()
+        Подключение берется из пула и, как раньше отдельное подключение,
+            работает в режиме autocommit: каждый запрос курсора фиксируется
+            сразу. Перед возвратом в пул режим восстанавливается
+    """
 
-    try:
-        yield psql_cursor
+    with pooled_connection() as connection:
+        connection.autocommit = True
+        psql_cursor = _dict_cursor(connection)
 
-    finally:
-        psql_cursor.close()
-        psql_connect.close()
+        try:
+            yield psql_cursor
+
+        finally:
+            psql_cursor.close()
+            connection.autocommit = False
@@ -1,26 +1,120 @@
+import asyncio
+
 from typing import AsyncIterator
 
-from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import MetaData, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, \
+    AsyncEngine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 from config import Config, PostgreSQLConfig
 
 
-engine = create_async_engine(
-    PostgreSQLConfig.SQLALCHEMY_URL,
-    echo=Config.DEBUG
-)
+UNIQUE_VIOLATION = "23505"  # SQLSTATE нарушения уникального индекса
+FOREIGN_KEY_VIOLATION = "23503"  # SQLSTATE нарушения внешнего ключа
+
 metadata = MetaData()
 
 Base = declarative_base(metadata=metadata)
 
+_engine: AsyncEngine | None = None
+_session_maker: sessionmaker | None = None
+_autonomous_engine: AsyncEngine | None = None
+
+
+def get_engine() -> AsyncEngine:
+    """Возвращает движок, создавая пул подключений при первом обращении"""
+
+    global _engine, _session_maker
+
+    if _engine is None:
+        _engine = create_async_engine(
+            PostgreSQLConfig.SQLALCHEMY_URL,
+            echo=Config.DEBUG,
+            pool_size=PostgreSQLConfig.POOL_SIZE,
+            max_overflow=PostgreSQLConfig.MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+        _session_maker = sessionmaker(
+            bind=_engine,
+            class_=AsyncSession
+        )
+
+    return _engine
+
+
+def get_autonomous_engine() -> AsyncEngine:
+    """
+        Возвращает движок для коротких записей, которые фиксируются
+            независимо от транзакции запроса
+
+        У него свой пул: запрос, уже занявший подключение основного пула,
+            не ждет второе из того же пула, а подключения этого пула
+            возвращаются сразу после фиксации записи
+    """
+
+    global _autonomous_engine
+
+    if _autonomous_engine is None:
+        _autonomous_engine = create_async_engine(
+            PostgreSQLConfig.SQLALCHEMY_URL,
+            echo=Config.DEBUG,
+            pool_size=PostgreSQLConfig.AUTONOMOUS_POOL_SIZE,
+            max_overflow=0,
+            pool_pre_ping=True
+        )
+
+    return _autonomous_engine
+
+
+async def warm_up_engine(connections: int) -> None:
+    """Заранее открывает подключения пула, чтобы их не ждали первые запросы"""
+
+    engine = get_engine()
+
+    async def _connect() -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(_connect() for _ in range(connections)))
+
+
+async def dispose_engine() -> None:
+    """Закрывает пулы подключений"""
+
+    global _engine, _session_maker, _autonomous_engine
+
+    if _engine is not None:
+        await _engine.dispose()
+        _engine, _session_maker = None, None
+
+    if _autonomous_engine is not None:
+        await _autonomous_engine.dispose()
+        _autonomous_engine = None
+
+
+def is_unique_violation(error: IntegrityError) -> bool:
+    """
+        Возвращает вызвано ли исключение нарушением уникального индекса
+
+        Остальные нарушения целостности (NOT NULL, внешние ключи)
+            означают ошибку в коде, а не конфликт имен
+    """
+
+    return getattr(error.orig, "sqlstate", None) == UNIQUE_VIOLATION
+
+
+def is_foreign_key_violation(error: IntegrityError) -> bool:
+    """Возвращает вызвано ли исключение нарушением внешнего ключа"""
+
+    return getattr(error.orig, "sqlstate", None) == FOREIGN_KEY_VIOLATION
+
 
 def session_factory() -> AsyncSession:
-    return sessionmaker(
-        bind=engine,
-        class_=AsyncSession
-    )()
+    get_engine()
+
+    return _session_maker()
 
 
 async def get_db() -> AsyncIterator[AsyncSession]:
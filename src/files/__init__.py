@@ -1,4 +1,7 @@
-from config import Config
+from config import Config, VolumeConfig
 
 if not Config.BASE_DIRECTORY.exists():
     Config.BASE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+
+for root, _ in VolumeConfig.ROOTS.values():
+    root.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import threading
+
+from pathlib import Path
+from mimetypes import guess_type
+from collections import OrderedDict
+from urllib.parse import quote
+
+from fastapi.responses import Response
+
+from config import FileCacheConfig
+
+from .schemas import FileSchema
+from .volumes import VolumeService, VolumeFileResponse
+from ..profiling import traced_io
+from ..metrics import Counter, Gauge
+
+
+cache_requests = Counter(
+    "file_cache_requests_total",
+    "Обращения к кэшу содержимого файлов"
+)
+cache_bytes = Gauge("file_cache_bytes", "Объем содержимого файлов в кэше")
+
+
+@traced_io("read")
+def _read_file(path: Path) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class FileContentCache:
+    """
+        Кэш содержимого небольших файлов в памяти процесса
+
+        Файлы не больше MAX_FILE_SIZE хранятся вместе с ETag, а общий объем
+            ограничен MAX_BYTES с вытеснением давно не запрашивавшихся.
+            Запись хранит номер версии файла, поэтому загрузка новой версии
+            в другом процессе делает ее недействительной без сброса. Кэш
+            сбрасывается при изменении и удалении файла
+    """
+
+    _cache: OrderedDict[int, tuple[int, bytes, str]] = OrderedDict()
+    _size = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get(cls, file_id: int, version: int) -> tuple[bytes, str] | None:
+        with cls._lock:
+            entry = cls._cache.get(file_id)
+
+            if entry is None or entry[0] != version:
+                return None
+
+            cls._cache.move_to_end(file_id)
+
+            return entry[1], entry[2]
+
+    @classmethod
+    def _put(cls, file_id: int, version: int, content: bytes, etag: str) -> None:
+        with cls._lock:
+            previous = cls._cache.pop(file_id, None)
+
+            if previous is not None:
+                cls._size -= len(previous[1])
+
+            cls._cache[file_id] = (version, content, etag)
+            cls._size += len(content)
+
+            while cls._size > FileCacheConfig.MAX_BYTES:
+                _, (_, evicted, _) = cls._cache.popitem(last=False)
+                cls._size -= len(evicted)
+
+            cache_bytes.set(cls._size)
+
+    @classmethod
+    def invalidate(cls, file_id: int) -> None:
+        """Убирает файл из кэша, вызывается при его изменении и удалении"""
+
+        with cls._lock:
+            entry = cls._cache.pop(file_id, None)
+
+            if entry is not None:
+                cls._size -= len(entry[1])
+                cache_bytes.set(cls._size)
+
+    @staticmethod
+    def _content_disposition(filename: str) -> str:
+        quoted = quote(filename)
+
+        if quoted != filename:
+            return f"attachment; filename*=utf-8''{quoted}"
+
+        return f'attachment; filename="{filename}"'
+
+    @classmethod
+    async def response(
+            cls,
+            file_data: FileSchema,
+            headers: dict | None = None,
+            path: Path | None = None,
+            volume: str | None = None
+    ) -> Response:
+        """
+            Отдает небольшой файл из памяти, а остальные с диска
+
+            path и volume - копия файла, с которой его читать, по умолчанию
+                основная. Прочитанное с диска кэшируется, только если совпало
+                с размером и хэшем в базе, иначе файл мог смениться после
+                чтения записи
+        """
+
+        if path is None:
+            path, volume = file_data.full_path, file_data.volume
+
+        if (
+            not FileCacheConfig.MAX_BYTES or
+            file_data.size > FileCacheConfig.MAX_FILE_SIZE
+        ):
+            return VolumeFileResponse(
+                path=path,
+                filename=file_data.full_name,
+                headers=headers,
+                volume=volume
+            )
+
+        cached = cls._get(file_data.id, file_data.version)
+
+        if cached is not None:
+            cache_requests.inc(result="hit")
+            content, etag = cached
+
+        else:
+            cache_requests.inc(result="miss")
+            with VolumeService.io(volume):
+                content = await asyncio.to_thread(_read_file, path)
+            sha256 = hashlib.sha256(content).hexdigest()
+            etag = f'"{sha256}"'
+
+            if (
+                len(content) == file_data.size and
+                file_data.checksum in (None, sha256)
+            ):
+                cls._put(file_data.id, file_data.version, content, etag)
+
+        return Response(
+            content=content,
+            media_type=guess_type(file_data.full_name)[0] or "text/plain",
+            headers={
+                **(headers or {}),
+                "ETag": etag,
+                "Content-Disposition":
+                    cls._content_disposition(file_data.full_name)
+            }
+        )
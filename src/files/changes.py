@@ -0,0 +1,208 @@
+import asyncio
+import traceback
+
+from datetime import timedelta
+
+from sqlalchemy import insert, update, select, delete
+from sqlalchemy.sql import func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import FileChangesConfig
+
+from .models import FilesORM, FileChangesORM
+from .schemas import FileSchema, FileChangesSchema
+from .events import FileEventsService
+from ..users.models import UsersORM
+from ..databases.sqlalchemy import session_factory
+
+
+class FileChangesService:
+    """
+        Версия списка файлов пользователя и журнал изменений для синхронизации
+
+        Изменения старше FileChangesConfig.RETENTION_DAYS удаляет ведущий
+            экземпляр, запоминая у пользователя версию, до которой журнал
+            очищен. На более раннюю версию /files/changes отвечает reset
+    """
+
+    @staticmethod
+    async def get_listing_version(
+            user_id: int,
+            db: AsyncSession
+    ) -> int:
+        """Возвращает версию списка файлов пользователя"""
+
+        version = await db.scalar(
+            select(UsersORM.files_version)
+            .where(UsersORM.id == user_id)
+        )
+
+        return version or 0
+
+    @staticmethod
+    async def bump_listing_version(
+            owner_id: int,
+            db: AsyncSession
+    ) -> int:
+        """Увеличивает версию списка файлов пользователя и возвращает ее"""
+
+        return await db.scalar(
+            update(UsersORM)
+            .where(UsersORM.id == owner_id)
+            .values(files_version=UsersORM.files_version + 1)
+            .returning(UsersORM.files_version)
+        )
+
+    @classmethod
+    async def register_change(
+            cls,
+            owner_id: int,
+            file_id: int,
+            action: str,
+            db: AsyncSession
+    ) -> int:
+        """
+            Увеличивает версию списка файлов пользователя,
+                записывает изменение и возвращает новую версию.
+                После фиксации транзакции изменение уходит в ленту событий
+
+            action: created, updated или deleted
+        """
+
+        version = await cls.bump_listing_version(owner_id, db)
+
+        await db.execute(
+            insert(FileChangesORM)
+            .values(
+                owner_id=owner_id,
+                version=version,
+                file_id=file_id,
+                action=action
+            )
+        )
+        FileEventsService.queue_event(owner_id, file_id, action, version, db)
+
+        return version
+
+    @classmethod
+    async def get_changes(
+            cls,
+            user_id: int,
+            since: int,
+            db: AsyncSession
+    ) -> FileChangesSchema:
+        """Возвращает файлы, измененные после указанной версии списка"""
+
+        versions = await db.execute(
+            select(UsersORM.files_version, UsersORM.files_changes_pruned)
+            .where(UsersORM.id == user_id)
+        )
+        version, pruned = versions.first() or (0, 0)
+
+        if since < pruned:
+            return FileChangesSchema(
+                version=version, updated=[], deleted=[], reset=True
+            )
+
+        changed_ids = await db.scalars(
+            select(FileChangesORM.file_id)
+            .where(
+                (FileChangesORM.owner_id == user_id)
+                & (FileChangesORM.version > since)
+            )
+            .distinct()
+        )
+        changed_ids = changed_ids.all()
+
+        files = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.owner_id == user_id)
+                & (FilesORM.id.in_(changed_ids))
+                & FilesORM.deleted_at.is_(None)
+            )
+        )
+        files = files.all()
+
+        existing_ids = {x.id for x in files}
+
+        return FileChangesSchema(
+            version=version,
+            updated=[FileSchema.model_validate(x) for x in files],
+            deleted=[x for x in changed_ids if x not in existing_ids]
+        )
+
+    @staticmethod
+    async def prune_batch() -> int:
+        """
+            Удаляет очередную пачку изменений старше срока хранения
+                и возвращает ее размер
+
+            Изменения пользователя получают версии под блокировкой его
+                строки, поэтому идут по id в порядке версий, и удаление
+                с начала оставляет журнал без пропусков
+        """
+
+        db = session_factory()
+
+        try:
+            expired = (
+                select(FileChangesORM.id)
+                .where(
+                    FileChangesORM.created_at <
+                    func.now() - timedelta(days=FileChangesConfig.RETENTION_DAYS)
+                )
+                .order_by(FileChangesORM.id)
+                .limit(FileChangesConfig.BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            pruned = await db.execute(
+                delete(FileChangesORM)
+                .where(FileChangesORM.id.in_(expired))
+                .returning(FileChangesORM.owner_id, FileChangesORM.version)
+            )
+            pruned = pruned.tuples().all()
+
+            owners = {}
+
+            for owner_id, version in pruned:
+                owners[owner_id] = max(owners.get(owner_id, 0), version)
+
+            for owner_id, version in owners.items():
+                await db.execute(
+                    update(UsersORM)
+                    .where(
+                        (UsersORM.id == owner_id)
+                        & (UsersORM.files_changes_pruned < version)
+                    )
+                    .values(files_changes_pruned=version)
+                )
+
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        return len(pruned)
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Очищает устаревший журнал изменений
+
+            Запускается только на ведущем экземпляре
+        """
+
+        while True:
+            try:
+                pruned = await cls.prune_batch()
+
+            except Exception:
+                traceback.print_exc()
+                pruned = 0
+
+            await asyncio.sleep(0 if pruned else FileChangesConfig.INTERVAL)
@@ -0,0 +1,343 @@
+import os
+import stat
+import zlib
+import uuid
+import asyncio
+import hashlib
+
+from typing import BinaryIO
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import UploadFile, HTTPException
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import DeltaSyncConfig
+
+from .models import FilesORM
+from .schemas import FileSignaturesSchema, BlockSignatureSchema, \
+    FileDeltaForm, DeltaOperation
+from .services import FileService
+from .changes import FileChangesService
+from .journal import OperationJournal
+from .versions import VersionService
+from .signing import SignedUrlService
+from .cache import FileContentCache
+from .thumbnails import ThumbnailService
+from ..coordination import PathLock
+from ..profiling import trace_io, traced_io
+from ..base_response import ResponseOK
+
+
+COPY_CHUNK_SIZE = 1024 * 1024  # Размер куска при копировании данных
+
+
+def compute_signatures(
+        path: str,
+        block_size: int
+) -> list[tuple[int, str]]:
+    """
+        Считает слабую и сильную сигнатуры каждого блока файла
+
+        Выполняется в отдельном процессе, поэтому функция
+            должна оставаться на уровне модуля
+    """
+
+    signatures = []
+
+    with open(path, "rb") as file:
+        while block := file.read(block_size):
+            signatures.append(
+                (zlib.adler32(block), hashlib.md5(block).hexdigest())
+            )
+
+    return signatures
+
+
+def _copy_range(
+        source: BinaryIO,
+        target: BinaryIO,
+        offset: int,
+        length: int,
+        checksums: tuple["hashlib._Hash", ...]
+) -> int:
+    """
+        Копирует диапазон из source в target, обновляя хэши,
+            и возвращает число байт
+    """
+
+    source.seek(offset)
+    copied = 0
+
+    while copied < length:
+        chunk = source.read(min(COPY_CHUNK_SIZE, length - copied))
+
+        if not chunk:
+            break
+
+        target.write(chunk)
+
+        for checksum in checksums:
+            checksum.update(chunk)
+        copied += len(chunk)
+
+    return copied
+
+
+@traced_io("build")
+def build_file(
+        source: Path,
+        temp_path: Path,
+        literal: BinaryIO,
+        operations: list[DeltaOperation],
+        block_size: int
+) -> tuple[int, str, str]:
+    """
+        Собирает новую версию файла во временном файле temp_path
+
+        Возвращает размер нового файла, его md5 и sha256
+    """
+
+    checksums = (hashlib.md5(), hashlib.sha256())
+    size = 0
+    new_file = open(temp_path, "xb")
+
+    try:
+        with open(source, "rb") as old_file, new_file:
+            for operation in operations:
+                if operation.block is not None:
+                    copied = _copy_range(
+                        old_file, new_file,
+                        operation.block * block_size, block_size, checksums
+                    )
+
+                    if copied == 0:
+                        raise ValueError(
+                            f"block {operation.block} is out of range"
+                        )
+
+                else:
+                    copied = _copy_range(
+                        literal, new_file,
+                        operation.offset, operation.length, checksums
+                    )
+
+                    if copied != operation.length:
+                        raise ValueError(
+                            f"range {operation.offset}:{operation.length} "
+                            f"is out of the uploaded data"
+                        )
+
+                size += copied
+
+            new_file.flush()
+            os.fsync(new_file.fileno())
+
+        os.chmod(temp_path, stat.S_IMODE(source.stat().st_mode))
+
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    return size, checksums[0].hexdigest(), checksums[1].hexdigest()
+
+
+class DeltaSyncService:
+    """Обновление файлов по блокам в стиле rsync"""
+
+    _pool: ProcessPoolExecutor | None = None
+    _signatures_cache: OrderedDict[tuple, list[tuple[int, str]]] = OrderedDict()
+
+    @classmethod
+    def _get_pool(cls) -> ProcessPoolExecutor:
+        """Возвращает пул процессов, создавая его при первом обращении"""
+
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(
+                max_workers=DeltaSyncConfig.WORKERS
+            )
+
+        return cls._pool
+
+    @staticmethod
+    def get_version(path: Path) -> str:
+        """Возвращает версию содержимого файла по времени изменения и размеру"""
+
+        file_stat = path.stat()
+
+        return f"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"
+
+    @staticmethod
+    def _validate_block_size(block_size: int) -> None:
+        """Проверяет что размер блока в допустимых пределах"""
+
+        if not (
+            DeltaSyncConfig.MIN_BLOCK_SIZE
+            <= block_size
+            <= DeltaSyncConfig.MAX_BLOCK_SIZE
+        ):
+            raise HTTPException(
+                status_code=422,
+                detail=f"block size must be between "
+                       f"{DeltaSyncConfig.MIN_BLOCK_SIZE} and "
+                       f"{DeltaSyncConfig.MAX_BLOCK_SIZE}"
+            )
+
+    @classmethod
+    async def _get_signatures(
+            cls,
+            file_id: int,
+            path: Path,
+            version: str,
+            block_size: int
+    ) -> list[tuple[int, str]]:
+        """Возвращает сигнатуры из кэша или считает их в пуле процессов"""
+
+        key = (file_id, version, block_size)
+
+        if key in cls._signatures_cache:
+            cls._signatures_cache.move_to_end(key)
+            return cls._signatures_cache[key]
+
+        signatures = await asyncio.get_running_loop().run_in_executor(
+            cls._get_pool(), compute_signatures, str(path), block_size
+        )
+
+        cls._signatures_cache[key] = signatures
+
+        while len(cls._signatures_cache) > DeltaSyncConfig.CACHE_SIZE:
+            cls._signatures_cache.popitem(last=False)
+
+        return signatures
+
+    @classmethod
+    async def get_signatures(
+            cls,
+            user_id: int,
+            file_id: int,
+            block_size: int,
+            db: AsyncSession
+    ) -> FileSignaturesSchema:
+        """Возвращает сигнатуры блоков текущей версии файла"""
+
+        cls._validate_block_size(block_size)
+
+        file_data = await FileService.get_file_data(user_id, file_id, db)
+        full_path = file_data.full_path
+
+        try:
+            version = cls.get_version(full_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=409, detail="file not found on storage")
+
+        signatures = await cls._get_signatures(
+            file_id, full_path, version, block_size
+        )
+
+        return FileSignaturesSchema(
+            file_id=file_id,
+            version=version,
+            size=full_path.stat().st_size,
+            block_size=block_size,
+            blocks=[
+                BlockSignatureSchema(index=index, weak=weak, strong=strong)
+                for index, (weak, strong) in enumerate(signatures)
+            ]
+        )
+
+    @classmethod
+    async def apply_delta(
+            cls,
+            user_id: int,
+            file_id: int,
+            delta: FileDeltaForm,
+            data: UploadFile,
+            db: AsyncSession
+    ) -> ResponseOK:
+        """
+            Собирает новую версию файла из блоков старой и присланных данных
+                и атомарно подменяет ею текущую
+        """
+
+        cls._validate_block_size(delta.block_size)
+
+        file_data = await FileService.get_file_data(user_id, file_id, db)
+        full_path = file_data.full_path
+        temp_path = full_path.with_name(
+            f".{full_path.name}.{uuid.uuid4().hex}.delta"
+        )
+
+        async with PathLock(str(full_path)) as lock:
+            try:
+                if cls.get_version(full_path) != delta.version:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="file was changed, request new signatures"
+                    )
+
+            except FileNotFoundError:
+                raise HTTPException(status_code=409, detail="file not found on storage")
+
+            # Временный файл создается уже внутри операции журнала,
+            # поэтому после сбоя восстановление его удалит
+            async with OperationJournal.operation(
+                "replace",
+                {"file_id": file_id, "path": str(full_path), "temp": str(temp_path)},
+                db
+            ):
+                try:
+                    size, md5, sha256 = await asyncio.to_thread(
+                        build_file,
+                        full_path, temp_path,
+                        data.file, delta.operations, delta.block_size
+                    )
+
+                except FileNotFoundError:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="file not found on storage"
+                    )
+
+                except ValueError as ex:
+                    raise HTTPException(status_code=422, detail=str(ex))
+
+                if (
+                    (delta.checksum and delta.checksum != md5) or
+                    size > FileService.MAX_FILE_SIZE
+                ):
+                    raise HTTPException(
+                        status_code=422,
+                        detail="delta result is invalid"
+                    )
+
+                await VersionService.archive(file_data, db)
+
+                with trace_io("replace", full_path):
+                    os.replace(temp_path, full_path)
+
+                await db.execute(
+                    update(FilesORM)
+                    .where(FilesORM.id == file_id)
+                    .values(
+                        size=size,
+                        checksum=sha256,
+                        version=FilesORM.version + 1
+                    )
+                )
+                await VersionService.apply_retention(file_id, db)
+                await FileChangesService.register_change(
+                    user_id, file_id, "updated", db
+                )
+
+            await lock.commit(db)
+
+        SignedUrlService.invalidate(file_id)
+        FileContentCache.invalidate(file_id)
+        ThumbnailService.enqueue(file_data.model_copy(update={
+            "size": size, "checksum": sha256, "version": file_data.version + 1
+        }))
+
+        return ResponseOK()
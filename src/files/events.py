@@ -0,0 +1,314 @@
+import re
+import asyncio
+import contextvars
+import traceback
+
+from typing import AsyncIterator
+from dataclasses import dataclass, field
+
+import orjson
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import FileEventsConfig
+
+from ..databases.aioredis import get_redis_client
+from ..metrics import Counter, Gauge
+
+
+PENDING_KEY = "file_events"  # Ключ неопубликованных событий в Session.info
+STREAM_ID = re.compile(r"(\d+)-(\d+)")
+
+published_events = Counter("file_events_published_total", "Опубликовано событий изменений файлов")
+open_streams = Gauge("file_events_streams", "Открытых подключений к ленте изменений")
+
+
+def _stream_key(user_id: int) -> str:
+    return f"files_events:{user_id}"
+
+
+def _parse_id(stream_id: str) -> tuple[int, int]:
+    milliseconds, sequence = STREAM_ID.fullmatch(stream_id).groups()
+
+    return int(milliseconds), int(sequence)
+
+
+@dataclass(eq=False)
+class Subscriber:
+    """Подключение к ленте и события, еще не отправленные ему"""
+
+    last_id: str | None
+    queue: asyncio.Queue = field(
+        default_factory=lambda: asyncio.Queue(FileEventsConfig.QUEUE_SIZE)
+    )
+    closed: bool = False
+
+
+class FileEventsService:
+    """
+        Лента изменений файлов через Server-Sent Events
+
+        register_change копит события в сессии, а после фиксации транзакции
+            они добавляются в поток redis files_events:{user_id}. Откаченные
+            изменения не публикуются
+
+        Процесс читает потоки всех своих подписчиков одним XREAD и раздает
+            события по очередям, поэтому простаивающее подключение стоит
+            одну очередь и таймер. Клиент, не успевающий забирать события,
+            отключается и при переподключении с Last-Event-ID дочитывает
+            пропущенное из потока
+    """
+
+    _subscribers: dict[int, set[Subscriber]] = {}
+    _last_ids: dict[int, str] = {}  # Последнее прочитанное событие потока
+    _reader: asyncio.Task | None = None
+    _wakeup: asyncio.Event | None = None
+    _tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def queue_event(
+            owner_id: int,
+            file_id: int,
+            action: str,
+            version: int,
+            db: AsyncSession
+    ) -> None:
+        """Откладывает событие до фиксации транзакции"""
+
+        db.info.setdefault(PENDING_KEY, []).append(
+            (owner_id, file_id, action, version)
+        )
+
+    @staticmethod
+    async def publish(events: list[tuple[int, int, str, int]]) -> None:
+        """Добавляет события в потоки пользователей"""
+
+        async with get_redis_client().pipeline(transaction=False) as pipe:
+            for owner_id, file_id, action, version in events:
+                key = _stream_key(owner_id)
+
+                pipe.xadd(
+                    key,
+                    {"file_id": file_id, "action": action, "version": version},
+                    maxlen=FileEventsConfig.STREAM_MAXLEN,
+                    approximate=True
+                )
+                pipe.expire(key, FileEventsConfig.STREAM_TTL)
+
+            await pipe.execute()
+
+        published_events.inc(len(events))
+
+    @classmethod
+    async def _publish_safely(cls, events: list[tuple[int, int, str, int]]) -> None:
+        try:
+            await cls.publish(events)
+
+        except Exception:
+            traceback.print_exc()
+
+    @classmethod
+    def _after_commit(cls, session: Session) -> None:
+        events = session.info.pop(PENDING_KEY, None)
+
+        if not events:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+
+        except RuntimeError:
+            return  # Синхронный код вне приложения, подписчиков нет
+
+        task = loop.create_task(cls._publish_safely(events))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @staticmethod
+    def _after_rollback(session: Session) -> None:
+        session.info.pop(PENDING_KEY, None)
+
+    @classmethod
+    async def _subscribe(cls, user_id: int, subscriber: Subscriber) -> None:
+        if user_id not in cls._last_ids:
+            last = await get_redis_client().xrevrange(_stream_key(user_id), count=1)
+            cls._last_ids.setdefault(user_id, last[0][0] if last else "0-0")
+
+        cls._subscribers.setdefault(user_id, set()).add(subscriber)
+        open_streams.set(sum(len(x) for x in cls._subscribers.values()))
+
+        if cls._reader is None or cls._reader.done():
+            cls._wakeup = asyncio.Event()
+            # Пустой контекст: иначе чтение унаследует трассировку первого
+            # запроса и будет дописывать в нее каждый XREAD
+            cls._reader = asyncio.create_task(
+                cls._read_streams(), context=contextvars.Context()
+            )
+
+        cls._wakeup.set()
+
+    @classmethod
+    def _unsubscribe(cls, user_id: int, subscriber: Subscriber) -> None:
+        subscribers = cls._subscribers.get(user_id)
+
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+
+            if not subscribers:
+                del cls._subscribers[user_id]
+                cls._last_ids.pop(user_id, None)
+
+        open_streams.set(sum(len(x) for x in cls._subscribers.values()))
+
+    @classmethod
+    def _dispatch(cls, user_id: int, entries: list) -> None:
+        for subscriber in list(cls._subscribers.get(user_id, ())):
+            try:
+                for entry in entries:
+                    subscriber.queue.put_nowait(entry)
+
+            except asyncio.QueueFull:
+                subscriber.closed = True
+                cls._unsubscribe(user_id, subscriber)
+
+    @classmethod
+    async def _read_streams(cls) -> None:
+        """Читает потоки всех подписчиков процесса одним XREAD"""
+
+        redis = get_redis_client()
+
+        while True:
+            if not cls._last_ids:
+                cls._wakeup.clear()
+                await cls._wakeup.wait()
+                continue
+
+            try:
+                streams = await redis.xread(
+                    {_stream_key(x): y for x, y in cls._last_ids.items()},
+                    count=FileEventsConfig.READ_COUNT,
+                    block=FileEventsConfig.BLOCK_MS
+                )
+
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(1)
+                continue
+
+            for key, entries in streams or []:
+                user_id = int(key.rpartition(":")[2])
+
+                if user_id in cls._last_ids:
+                    cls._last_ids[user_id] = entries[-1][0]
+                    cls._dispatch(user_id, entries)
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Останавливает чтение потоков, вызывается при остановке процесса"""
+
+        if cls._reader is not None:
+            cls._reader.cancel()
+            await asyncio.gather(cls._reader, return_exceptions=True)
+            cls._reader = None
+
+    @staticmethod
+    def _format(stream_id: str, fields: dict) -> bytes:
+        data = orjson.dumps({
+            "file_id": int(fields["file_id"]),
+            "action": fields["action"],
+            "version": int(fields["version"])
+        })
+
+        return (
+            f"id: {stream_id}\nevent: {fields['action']}\ndata: ".encode()
+            + data + b"\n\n"
+        )
+
+    @classmethod
+    async def _backfill(cls, user_id: int, last_id: str) -> tuple[list, bool]:
+        """
+            Возвращает события после last_id и признак того, что часть
+                пропущенных уже вытеснена из потока
+        """
+
+        redis = get_redis_client()
+        key = _stream_key(user_id)
+        milliseconds, sequence = _parse_id(last_id)
+
+        first = await redis.xrange(key, count=1)
+
+        if not first or _parse_id(first[0][0]) > (milliseconds, sequence):
+            return [], True
+
+        entries = await redis.xrange(key, min=f"{milliseconds}-{sequence + 1}")
+
+        return entries, False
+
+    @classmethod
+    async def _stream(
+            cls,
+            user_id: int,
+            subscriber: Subscriber
+    ) -> AsyncIterator[bytes]:
+        # Подписка до дочитывания, чтобы не потерять события между ними
+        await cls._subscribe(user_id, subscriber)
+
+        try:
+            if subscriber.last_id is not None:
+                entries, truncated = await cls._backfill(user_id, subscriber.last_id)
+
+                if truncated:
+                    # Клиенту нужно пересинхронизироваться через /files/changes
+                    yield b"event: reset\ndata: {}\n\n"
+
+                for stream_id, fields in entries:
+                    subscriber.last_id = stream_id
+                    yield cls._format(stream_id, fields)
+
+            while not (subscriber.closed and subscriber.queue.empty()):
+                try:
+                    stream_id, fields = await asyncio.wait_for(
+                        subscriber.queue.get(), FileEventsConfig.HEARTBEAT
+                    )
+
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+
+                if (
+                    subscriber.last_id is not None and
+                    _parse_id(stream_id) <= _parse_id(subscriber.last_id)
+                ):
+                    continue  # Уже отправлено при дочитывании
+
+                subscriber.last_id = stream_id
+                yield cls._format(stream_id, fields)
+
+        finally:
+            cls._unsubscribe(user_id, subscriber)
+
+    @classmethod
+    async def open_stream(
+            cls,
+            user_id: int,
+            last_event_id: str | None
+    ) -> StreamingResponse:
+        """Подписывает на изменения файлов пользователя"""
+
+        if last_event_id is not None and not STREAM_ID.fullmatch(last_event_id):
+            raise HTTPException(status_code=422, detail="invalid Last-Event-ID")
+
+        return StreamingResponse(
+            cls._stream(user_id, Subscriber(last_event_id)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+
+event.listen(Session, "after_commit", FileEventsService._after_commit)
+event.listen(Session, "after_rollback", FileEventsService._after_rollback)
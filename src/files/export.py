@@ -0,0 +1,148 @@
+import io
+import csv
+import zlib
+
+from typing import AsyncIterator, Iterable, Optional
+
+import orjson
+
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import select
+
+from config import ExportConfig
+
+from .models import FilesORM
+from .services import FileService
+from ..databases.sqlalchemy import session_factory
+
+
+class FileExportService:
+    """Потоковая выгрузка каталога файлов пользователя"""
+
+    MEDIA_TYPES = {
+        "ndjson": "application/x-ndjson",
+        "csv": "text/csv"
+    }
+
+    @staticmethod
+    async def _iter_batches(
+            user_id: int,
+            after_id: int
+    ) -> AsyncIterator[tuple[tuple[str, ...], Iterable[tuple]]]:
+        """
+            Читает файлы пользователя серверным курсором в порядке id
+
+            Сессия открывается здесь, а не через get_db,
+                так как ответ отдается уже после выхода из обработчика
+        """
+
+        db = session_factory()
+
+        try:
+            result = await db.stream(
+                select(*FileService.LISTING_COLUMNS)
+                .where(
+                    (FilesORM.owner_id == user_id)
+                    & (FilesORM.id > after_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+                .order_by(FilesORM.id)
+                .execution_options(yield_per=ExportConfig.BATCH_SIZE)
+            )
+            keys = tuple(result.keys())
+
+            async for rows in result.partitions():
+                yield keys, rows
+
+        finally:
+            await db.close()
+
+    @staticmethod
+    def _to_ndjson(
+            keys: tuple[str, ...],
+            rows: Iterable[tuple]
+    ) -> bytes:
+        """Сериализует строки в NDJSON"""
+
+        return b"".join(
+            orjson.dumps(dict(zip(keys, row))) + b"\n"
+            for row in rows
+        )
+
+    @staticmethod
+    def _to_csv(
+            keys: tuple[str, ...],
+            rows: Iterable[tuple]
+    ) -> bytes:
+        """Сериализует строки в CSV"""
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+
+        return buffer.getvalue().encode()
+
+    @classmethod
+    async def _iter_content(
+            cls,
+            user_id: int,
+            export_format: str,
+            compress: bool,
+            after_id: int
+    ) -> AsyncIterator[bytes]:
+        """Отдает выгрузку кусками, при необходимости сжимая на лету"""
+
+        serializer = cls._to_csv if export_format == "csv" else cls._to_ndjson
+        compressor = zlib.compressobj(
+            ExportConfig.COMPRESS_LEVEL,
+            zlib.DEFLATED,
+            zlib.MAX_WBITS | 16  # gzip контейнер
+        ) if compress else None
+
+        if export_format == "csv":
+            header = [tuple(x.key for x in FileService.LISTING_COLUMNS)]
+            yield cls._compress(compressor, serializer((), header))
+
+        async for keys, rows in cls._iter_batches(user_id, after_id):
+            chunk = cls._compress(compressor, serializer(keys, rows))
+
+            if chunk:
+                yield chunk
+
+        if compressor is not None:
+            yield compressor.flush()
+
+    @staticmethod
+    def _compress(
+            compressor: Optional["zlib._Compress"],
+            chunk: bytes
+    ) -> bytes:
+        """Сжимает кусок выгрузки, если сжатие включено"""
+
+        return compressor.compress(chunk) if compressor is not None else chunk
+
+    @classmethod
+    def export_files(
+            cls,
+            user_id: int,
+            export_format: str,
+            compress: bool,
+            after_id: int
+    ) -> StreamingResponse:
+        """
+            Возвращает потоковую выгрузку метаданных файлов пользователя
+
+            Строки идут по возрастанию id, для продолжения прерванной
+                выгрузки передается последний полученный id в after_id
+        """
+
+        filename = f"files.{export_format}" + (".gz" if compress else "")
+
+        return StreamingResponse(
+            cls._iter_content(user_id, export_format, compress, after_id),
+            media_type="application/gzip" if compress
+            else cls.MEDIA_TYPES[export_format],
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"'
+            }
+        )
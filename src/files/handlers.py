@@ -1,12 +1,27 @@
-from typing import Optional
+from typing import Optional, Literal
 
 from fastapi import APIRouter, UploadFile, Depends, Query, Body, \
-    Path, File
-from fastapi.responses import FileResponse
+    Path, File, Form, Header, HTTPException
+from fastapi.responses import FileResponse, Response, ORJSONResponse, \
+    StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .schemas import FileSchema, FileUpdateForm
+from config import DeltaSyncConfig, SignedUrlConfig
+from .schemas import FileSchema, FileUpdateForm, FileCopyForm, \
+    FileChangesSchema, FileSignaturesSchema, FileDeltaForm, \
+    FileIntegrityIssueSchema, SignedUrlSchema, TrashedFileSchema, \
+    FileVersionSchema
 from .services import FileService
+from .changes import FileChangesService
+from .events import FileEventsService
+from .delta import DeltaSyncService
+from .export import FileExportService
+from .scrubber import FileScrubber
+from .signing import SignedUrlService
+from .trash import TrashService
+from .versions import VersionService
+from .thumbnails import ThumbnailService
 from ..auth.services import get_user_id
 from ..databases.sqlalchemy import get_db
 from ..base_response import ResponseOK
@@ -15,27 +30,142 @@ from ..base_response import ResponseOK
 files_router = APIRouter()
 
 
-@files_router.get("/my", response_model=list[Optional[FileSchema]])
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    """Проверяет совпадение ETag с заголовком If-None-Match (слабое сравнение)"""
+
+    if not if_none_match:
+        return False
+
+    tags = [x.strip().removeprefix("W/") for x in if_none_match.split(",")]
+
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@files_router.get(
+    "/my",
+    response_model=list[Optional[FileSchema]],
+    response_class=ORJSONResponse
+)
 async def get_my_files(
+        user_id: int = Depends(get_user_id),
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_db)
+) -> Response:
+    """
+        Возвращает файлы текущего пользователя
+
+        Если список не менялся с версии из If-None-Match, отвечает 304
+
+        Ответ собирается напрямую через orjson,
+            response_model остается только для документации
+    """
+
+    version = await FileChangesService.get_listing_version(user_id, db)
+    etag = f'W/"{user_id}-{version}"'
+
+    if _etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return ORJSONResponse(
+        await FileService.get_my_files(user_id, db),
+        headers={"ETag": etag}
+    )
+
+
+@files_router.get("/changes", response_model=FileChangesSchema)
+async def get_files_changes(
+        user_id: int = Depends(get_user_id),
+        since: int = Query(..., ge=0, description="Версия списка файлов"),
+        db: AsyncSession = Depends(get_db)
+) -> FileChangesSchema:
+    """
+        Возвращает изменения в файлах пользователя после указанной версии
+
+        Если журнал изменений после since уже очищен, отвечает reset,
+            и список файлов нужно запросить заново через /files/my
+    """
+
+    return await FileChangesService.get_changes(user_id, since, db)
+
+
+@files_router.get("/events", response_class=StreamingResponse)
+async def get_files_events(
+        user_id: int = Depends(get_user_id),
+        last_event_id: Optional[str] = Header(None)
+) -> StreamingResponse:
+    """
+        Лента изменений файлов текущего пользователя (Server-Sent Events)
+
+        Событие created, updated или deleted содержит file_id и версию
+            списка файлов. С Last-Event-ID отдаются пропущенные события,
+            а если они уже вытеснены - событие reset, после которого
+            нужно запросить /files/changes
+    """
+
+    return await FileEventsService.open_stream(user_id, last_event_id)
+
+
+@files_router.get("/export", response_class=StreamingResponse)
+async def export_files(
+        user_id: int = Depends(get_user_id),
+        export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+        compress: bool = Query(False, description="Сжимать выгрузку gzip"),
+        after_id: int = Query(0, ge=0, description="Продолжить после этого id")
+) -> StreamingResponse:
+    """Выгружает метаданные всех файлов пользователя потоком"""
+
+    return FileExportService.export_files(
+        user_id, export_format, compress, after_id
+    )
+
+
+@files_router.get("/integrity", response_model=list[FileIntegrityIssueSchema])
+async def get_integrity_issues(
         user_id: int = Depends(get_user_id),
         db: AsyncSession = Depends(get_db)
-) -> list[Optional[FileSchema]]:
-    """Возвращает файлы текущего пользователя"""
+) -> list[FileIntegrityIssueSchema]:
+    """Возвращает поврежденные и пропавшие файлы пользователя"""
 
-    return await FileService.get_my_files(user_id, db)
+    return await FileScrubber.get_issues(user_id, db)
 
 
-@files_router.get("/download", response_class=FileResponse)
+@files_router.get("/download", response_class=Response)
 async def download_file(
         user_id: int = Depends(get_user_id),
         file_id: int = Query(...),
         db: AsyncSession = Depends(get_db)
-) -> FileResponse:
+) -> Response:
     """Возвращает файл для скачивания"""
 
     return await FileService.download_file(user_id, file_id, db)
 
 
+@files_router.get("/trash", response_model=list[TrashedFileSchema])
+async def get_trash(
+        user_id: int = Depends(get_user_id),
+        db: AsyncSession = Depends(get_db)
+) -> list[TrashedFileSchema]:
+    """Возвращает файлы текущего пользователя в корзине"""
+
+    return await TrashService.get_trash(user_id, db)
+
+
+@files_router.get("/signed/{file_id}", response_class=Response)
+async def download_signed_file(
+        file_id: int = Path(...),
+        expires: int = Query(...),
+        kid: str = Query(...),
+        signature: str = Query(...)
+) -> Response:
+    """
+        Возвращает файл по подписанной ссылке без токена доступа
+
+        Ссылку выдает POST /files/{file_id}/signed-url
+    """
+
+    return await SignedUrlService.download(file_id, expires, kid, signature)
+
+
 @files_router.get("/{file_id}", response_model=Optional[FileSchema])
 async def get_file(
         user_id: int = Depends(get_user_id),
@@ -59,13 +189,102 @@ async def update_file_data(
     return await FileService.update_file_data(user_id, file_id, file, db)
 
 
+@files_router.post("/{file_id}/restore", response_model=FileSchema)
+async def restore_file(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        db: AsyncSession = Depends(get_db)
+) -> FileSchema:
+    """Возвращает файл из корзины"""
+
+    return await FileService.restore_file(user_id, file_id, db)
+
+
+@files_router.post("/{file_id}/signed-url", response_model=SignedUrlSchema)
+async def create_signed_url(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        ttl: Optional[int] = Query(
+            None,
+            ge=1,
+            le=SignedUrlConfig.MAX_TTL,
+            description="Срок жизни ссылки в секундах"
+        ),
+        db: AsyncSession = Depends(get_db)
+) -> SignedUrlSchema:
+    """Выдает подписанную ссылку на скачивание файла"""
+
+    file_data = await FileService.get_file_data(user_id, file_id, db)
+
+    return SignedUrlService.create_url(file_data, ttl)
+
+
+@files_router.get("/{file_id}/thumbnail", response_class=FileResponse)
+async def get_file_thumbnail(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        kind: Literal["thumbnail", "preview"] = Query("thumbnail"),
+        if_none_match: Optional[str] = Header(None),
+        db: AsyncSession = Depends(get_db)
+) -> Response:
+    """
+        Возвращает миниатюру или превью изображения или PDF в JPEG
+
+        Производная привязана к версии файла, поэтому клиент может
+            кэшировать ее и получать 304 по If-None-Match
+    """
+
+    file_data = await FileService.get_file_data(user_id, file_id, db)
+    etag = ThumbnailService.get_etag(file_data, kind)
+
+    if _etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return await ThumbnailService.get_thumbnail(file_data, kind)
+
+
+@files_router.get("/{file_id}/versions", response_model=list[FileVersionSchema])
+async def get_file_versions(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        db: AsyncSession = Depends(get_db)
+) -> list[FileVersionSchema]:
+    """Возвращает сохраненные прежние версии файла"""
+
+    return await VersionService.get_versions(user_id, file_id, db)
+
+
+@files_router.get("/{file_id}/versions/{version}", response_class=StreamingResponse)
+async def download_file_version(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        version: int = Path(..., ge=1),
+        db: AsyncSession = Depends(get_db)
+) -> StreamingResponse:
+    """Скачивает сохраненную версию файла"""
+
+    return await VersionService.download_version(user_id, file_id, version, db)
+
+
+@files_router.post("/{file_id}/copy", response_model=FileSchema)
+async def copy_file(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        data: FileCopyForm = Body(FileCopyForm()),
+        db: AsyncSession = Depends(get_db)
+) -> FileSchema:
+    """Копирует файл на сервере"""
+
+    return await FileService.copy_file(user_id, file_id, data, db)
+
+
 @files_router.delete("/{file_id}", response_model=ResponseOK)
 async def delete_file(
         user_id: int = Depends(get_user_id),
         file_id: int = Path(...),
         db: AsyncSession = Depends(get_db)
 ) -> ResponseOK:
-    """Удаляет файл"""
+    """Перемещает файл в корзину"""
 
     return await FileService.delete_file(user_id, file_id, db)
 
@@ -74,8 +293,41 @@ async def delete_file(
 async def upload_file(
         user_id: int = Depends(get_user_id),
         file: UploadFile = File(...),
+        folder_id: Optional[int] = Query(None, description="Папка для файла"),
         db: AsyncSession = Depends(get_db)
 ) -> ResponseOK:
     """Загружает файл"""
 
-    return await FileService.upload_file(user_id, file, db)
+    return await FileService.upload_file(user_id, file, folder_id, db)
+
+
+@files_router.get("/{file_id}/signatures", response_model=FileSignaturesSchema)
+async def get_file_signatures(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        block_size: int = Query(DeltaSyncConfig.BLOCK_SIZE),
+        db: AsyncSession = Depends(get_db)
+) -> FileSignaturesSchema:
+    """Возвращает сигнатуры блоков файла для дельта-синхронизации"""
+
+    return await DeltaSyncService.get_signatures(user_id, file_id, block_size, db)
+
+
+@files_router.put("/{file_id}/delta", response_model=ResponseOK)
+async def update_file_by_delta(
+        user_id: int = Depends(get_user_id),
+        file_id: int = Path(...),
+        delta: str = Form(..., description="FileDeltaForm в формате JSON"),
+        data: UploadFile = File(..., description="Измененные блоки подряд"),
+        db: AsyncSession = Depends(get_db)
+) -> ResponseOK:
+    """Обновляет содержимое файла, принимая только измененные блоки"""
+
+    try:
+        delta_form = FileDeltaForm.model_validate_json(delta)
+    except ValidationError as ex:
+        raise HTTPException(status_code=422, detail=ex.errors())
+
+    return await DeltaSyncService.apply_delta(
+        user_id, file_id, delta_form, data, db
+    )
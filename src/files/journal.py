@@ -0,0 +1,363 @@
+import asyncio
+import traceback
+
+from typing import AsyncIterator
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from sqlalchemy import insert, update, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import FilesORM, FileOperationsORM
+from .changes import FileChangesService
+from .storage import move_file, hash_file
+from ..coordination import PathLock
+from ..databases.sqlalchemy import session_factory, get_autonomous_engine
+
+
+class OperationJournal:
+    """
+        Журнал намерений для согласованных изменений файлов и базы данных
+
+        Намерение записывается и фиксируется отдельным подключением до
+            изменений на диске, а запрос блокирует эту запись в своей
+            транзакции, не фиксируя ее. Запись удаляется в той же транзакции,
+            что и изменения в базе, поэтому оставшаяся в журнале
+            незаблокированная запись означает незавершенную операцию, и база
+            в ней еще в исходном состоянии. Восстановление приводит диск к
+            состоянию базы, а для необратимой подмены содержимого доводит
+            базу до состояния диска
+
+        Операция выполняется под PathLock своих путей, и восстановление
+            берет те же блокировки, поэтому не тронет операцию работающего
+            запроса и между фиксацией намерения и блокировкой записи
+
+        Операции и их payload:
+            upload - path, checksum: записанный файл и его sha256
+            copy - target, checksum: созданная копия и sha256 источника
+            move - source, target: старый и новый путь (и возврат из корзины),
+                checksum: sha256 файла, если копия ставится рядом с исходным
+            replace - file_id, path, temp: файл и его новая версия
+            delete - path, trash: файл и его место в корзине
+    """
+
+    _tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _get_paths(payload: dict) -> list[str]:
+        """Пути, которые операция блокирует через PathLock"""
+
+        return [payload[x] for x in ("path", "source", "target") if x in payload]
+
+    @staticmethod
+    async def _begin(
+            kind: str,
+            payload: dict,
+            db: AsyncSession
+    ) -> int:
+        """
+            Фиксирует намерение через пул автономных записей и блокирует
+                его в транзакции запроса. Сама транзакция запроса не
+                фиксируется, поэтому ее изменения и блокировки строк,
+                взятые до операции, сохраняются
+        """
+
+        async with get_autonomous_engine().begin() as connection:
+            operation_id = await connection.scalar(
+                insert(FileOperationsORM)
+                .values(kind=kind, payload=payload)
+                .returning(FileOperationsORM.id)
+            )
+
+        await db.execute(
+            select(FileOperationsORM.id)
+            .where(FileOperationsORM.id == operation_id)
+            .with_for_update()
+        )
+
+        return operation_id
+
+    @classmethod
+    @asynccontextmanager
+    async def operation(
+            cls,
+            kind: str,
+            payload: dict,
+            db: AsyncSession
+    ) -> AsyncIterator[None]:
+        """
+            Оборачивает шаги операции
+
+            При ошибке восстановление запускается в фоне и дождется
+                отката транзакции запроса, так как та держит блокировку записи
+        """
+
+        operation_id = await cls._begin(kind, payload, db)
+
+        try:
+            yield
+
+        except BaseException:
+            task = asyncio.create_task(cls.recover_operation(operation_id))
+            cls._tasks.add(task)
+            task.add_done_callback(cls._tasks.discard)
+            raise
+
+        await db.execute(
+            delete(FileOperationsORM)
+            .where(FileOperationsORM.id == operation_id)
+        )
+
+    @staticmethod
+    async def _is_referenced(path: Path, db: AsyncSession) -> bool:
+        """
+            Возвращает принадлежит ли путь другому файлу в базе,
+                такой файл операция не создавала и трогать его нельзя
+        """
+
+        file_id = await db.scalar(
+            select(FilesORM.id)
+            .where(
+                (FilesORM.path == str(path.parent))
+                & (FilesORM.name + "." + FilesORM.extension == path.name)
+                & FilesORM.deleted_at.is_(None)
+            )
+            .limit(1)
+        )
+
+        return file_id is not None
+
+    @staticmethod
+    async def _is_written(path: Path, payload: dict) -> bool:
+        """
+            Проверяет, что файл по пути записан этой операцией
+
+            Создание файла не перезаписывает существующий, поэтому при
+                конфликте по пути может лежать чужой файл без записи в базе
+        """
+
+        if payload.get("checksum") is None:
+            return True
+
+        try:
+            _, checksum = await asyncio.to_thread(hash_file, path)
+
+        except FileNotFoundError:
+            return False
+
+        return checksum == payload["checksum"]
+
+    @classmethod
+    async def _recover_upload(cls, payload: dict, db: AsyncSession) -> None:
+        """Запись в базе не создана, удаляет записанный файл"""
+
+        path = Path(payload["path"])
+
+        if (
+            not await cls._is_referenced(path, db) and
+            await cls._is_written(path, payload)
+        ):
+            await asyncio.to_thread(path.unlink, missing_ok=True)
+
+    @classmethod
+    async def _recover_copy(cls, payload: dict, db: AsyncSession) -> None:
+        """Запись в базе не создана, удаляет копию"""
+
+        target = Path(payload["target"])
+
+        if (
+            not await cls._is_referenced(target, db) and
+            await cls._is_written(target, payload)
+        ):
+            await asyncio.to_thread(target.unlink, missing_ok=True)
+
+    @classmethod
+    async def _recover_move(cls, payload: dict, db: AsyncSession) -> None:
+        """
+            В базе остался старый путь, возвращает файл на место. Если
+                остались оба, копия на новом месте удаляется, когда ее
+                содержимое совпадает с checksum операции
+        """
+
+        source, target = Path(payload["source"]), Path(payload["target"])
+
+        if not target.exists() or await cls._is_referenced(target, db):
+            return
+
+        if not source.exists():
+            await asyncio.to_thread(move_file, target, source)
+
+        elif (
+            payload.get("checksum") is not None and
+            await cls._is_written(target, payload)
+        ):
+            await asyncio.to_thread(target.unlink, missing_ok=True)
+
+    @staticmethod
+    async def _recover_replace(payload: dict, db: AsyncSession) -> None:
+        """
+            Если временный файл на месте, подмены не было и достаточно
+                удалить его. Иначе старое содержимое уже могло быть подменено,
+                поэтому размер и хэш в базе берутся с диска, а версия
+                увеличивается, чтобы копии, кэши и миниатюры прежнего
+                содержимого перестали считаться актуальными
+        """
+
+        path, temp = Path(payload["path"]), Path(payload["temp"])
+
+        try:
+            await asyncio.to_thread(temp.unlink)
+            return
+
+        except FileNotFoundError:
+            pass
+
+        if not path.exists():
+            return
+
+        size, checksum = await asyncio.to_thread(hash_file, path)
+
+        owner_id = await db.scalar(
+            update(FilesORM)
+            .where(FilesORM.id == payload["file_id"])
+            .values(
+                size=size,
+                checksum=checksum,
+                version=FilesORM.version + 1
+            )
+            .returning(FilesORM.owner_id)
+        )
+
+        if owner_id is not None:
+            await FileChangesService.register_change(
+                owner_id, payload["file_id"], "updated", db
+            )
+
+    @staticmethod
+    def _invalidate(payload: dict) -> None:
+        """
+            Сбрасывает кэши процесса для файла, содержимое которого
+                восстановление зафиксировало в базе
+        """
+
+        if "file_id" not in payload:
+            return
+
+        # cache и signing через volumes импортируют журнал
+        from .cache import FileContentCache
+        from .signing import SignedUrlService
+
+        FileContentCache.invalidate(payload["file_id"])
+        SignedUrlService.invalidate(payload["file_id"])
+
+    @staticmethod
+    async def _recover_delete(payload: dict, db: AsyncSession) -> None:
+        """Запись в базе не помечена удаленной, возвращает файл из корзины"""
+
+        path, trash = Path(payload["path"]), Path(payload["trash"])
+
+        if trash.exists() and not path.exists():
+            await asyncio.to_thread(move_file, trash, path)
+
+    @classmethod
+    async def _replay(
+            cls,
+            operation: FileOperationsORM,
+            db: AsyncSession
+    ) -> None:
+        """Восстанавливает операцию и удаляет ее из журнала"""
+
+        recover = getattr(cls, f"_recover_{operation.kind}")
+        await recover(operation.payload, db)
+
+        await db.execute(
+            delete(FileOperationsORM)
+            .where(FileOperationsORM.id == operation.id)
+        )
+
+    @classmethod
+    async def recover_operation(cls, operation_id: int) -> None:
+        """Восстанавливает одну операцию после отката запроса"""
+
+        db = session_factory()
+
+        try:
+            operation = await db.scalars(
+                select(FileOperationsORM)
+                .where(FileOperationsORM.id == operation_id)
+                .with_for_update()
+            )
+            operation = operation.first()
+
+            if operation is not None:
+                async with PathLock(*cls._get_paths(operation.payload)) as lock:
+                    await cls._replay(operation, db)
+                    await lock.commit(db)
+
+                cls._invalidate(operation.payload)
+
+        except Exception:
+            await db.rollback()
+            traceback.print_exc()
+
+        finally:
+            await db.close()
+
+    @classmethod
+    async def recover(cls) -> int:
+        """
+            Восстанавливает все незавершенные операции
+
+            Операции работающих запросов заблокированы в базе или по путям
+                и пропускаются, поэтому запуск безопасен при нескольких
+                процессах. Возвращает количество восстановленных операций
+        """
+
+        recovered = 0
+        last_id = 0
+
+        while True:
+            db = session_factory()
+            operation = None
+
+            try:
+                operation = await db.scalars(
+                    select(FileOperationsORM)
+                    .where(FileOperationsORM.id > last_id)
+                    .order_by(FileOperationsORM.id)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+                operation = operation.first()
+
+                if operation is None:
+                    break
+
+                last_id = operation.id
+
+                async with PathLock(
+                    *cls._get_paths(operation.payload), timeout=0
+                ) as lock:
+                    await cls._replay(operation, db)
+                    await lock.commit(db)
+
+                cls._invalidate(operation.payload)
+                recovered += 1
+
+            except HTTPException:
+                await db.rollback()  # Пути заняты работающим запросом
+
+            except Exception:
+                await db.rollback()
+
+                if operation is None:
+                    raise
+
+                traceback.print_exc()
+
+            finally:
+                await db.close()
+
+        return recovered
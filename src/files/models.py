@@ -1,6 +1,7 @@
 from sqlalchemy import Column, BigInteger, Integer, String, Text, TIMESTAMP, \
-    ForeignKey
+    ForeignKey, Index
 from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB
 
 from ..databases.sqlalchemy import Base
 
@@ -14,6 +15,7 @@ class FilesORM(Base):
     extension = Column(String(10), nullable=False)
     size = Column(Integer, nullable=False)
     path = Column(String, nullable=False)
+    folder_id = Column(BigInteger, ForeignKey("folders.id"), nullable=True)
     created_at = Column(
         TIMESTAMP(timezone=True),
         server_default=func.now(),
@@ -25,3 +27,156 @@ class FilesORM(Base):
         onupdate=func.now()
     )
     comment = Column(String, nullable=True)
+    checksum = Column(String(64), nullable=True)
+    verified_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    deleted_at = Column(TIMESTAMP(timezone=True), nullable=True)  # В корзине с этого момента
+    version = Column(Integer, nullable=False, server_default="1")  # Номер текущей версии
+    volume = Column(String(32), nullable=True)  # Том, в корне которого размещен файл
+
+    __table_args__ = (
+        Index("ix_files_folder_id", folder_id, postgresql_include=["size"]),
+        Index(
+            "uq_files_path_name_extension",
+            path, name, extension,
+            unique=True,
+            postgresql_where=deleted_at.is_(None)
+        ),
+        Index(
+            "uq_files_volume_name_extension",
+            name, extension,
+            unique=True,
+            postgresql_where=deleted_at.is_(None) & volume.isnot(None)
+        ),
+        Index(
+            "ix_files_volume_size_live",
+            volume, size,
+            postgresql_where=deleted_at.is_(None) & volume.isnot(None)
+        ),
+        Index(
+            "ix_files_owner_id_live",
+            owner_id,
+            postgresql_where=deleted_at.is_(None)
+        ),
+        Index(
+            "ix_files_deleted_at",
+            deleted_at,
+            postgresql_where=deleted_at.isnot(None)
+        ),
+    )
+
+
+class FileReplicasORM(Base):
+    __tablename__ = "file_replicas"
+
+    file_id = Column(
+        BigInteger,
+        ForeignKey("files.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    volume = Column(String(32), primary_key=True)  # Том с копией
+    version = Column(Integer, nullable=False)  # Версия файла в копии
+    replicated_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+
+class FileChangesORM(Base):
+    __tablename__ = "file_changes"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    owner_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    version = Column(BigInteger, nullable=False)
+    file_id = Column(BigInteger, nullable=False)
+    action = Column(String(10), nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_file_changes_owner_id_version", owner_id, version),
+    )
+
+
+class FileIntegrityIssuesORM(Base):
+    __tablename__ = "file_integrity_issues"
+
+    file_id = Column(
+        BigInteger,
+        ForeignKey("files.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    kind = Column(String(10), nullable=False)
+    detected_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+
+class FileOperationsORM(Base):
+    __tablename__ = "file_operations"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+
+class FileVersionsORM(Base):
+    __tablename__ = "file_versions"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    file_id = Column(
+        BigInteger,
+        ForeignKey("files.id", ondelete="CASCADE"),
+        nullable=False
+    )
+    version = Column(Integer, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    checksum = Column(String(64), nullable=True)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    __table_args__ = (
+        Index("uq_file_versions_file_id_version", file_id, version, unique=True),
+        Index("ix_file_versions_created_at", created_at),
+    )
+
+
+class FileChunksORM(Base):
+    __tablename__ = "file_chunks"
+
+    hash = Column(String(64), primary_key=True)  # sha256 содержимого куска
+    size = Column(Integer, nullable=False)
+    refcount = Column(BigInteger, nullable=False)  # Сколько раз кусок входит в версии
+
+    __table_args__ = (
+        Index("ix_file_chunks_unused", hash, postgresql_where=refcount <= 0),
+    )
+
+
+class FileVersionChunksORM(Base):
+    __tablename__ = "file_version_chunks"
+
+    version_id = Column(
+        BigInteger,
+        ForeignKey("file_versions.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    position = Column(Integer, primary_key=True)
+    chunk_hash = Column(
+        String(64),
+        ForeignKey("file_chunks.hash"),
+        nullable=False
+    )
@@ -0,0 +1,470 @@
+import os
+import uuid
+import random
+import asyncio
+import traceback
+
+from pathlib import Path
+from collections import defaultdict
+
+from fastapi import HTTPException
+
+from sqlalchemy import select, delete, tuple_
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ReplicationConfig, VolumeConfig
+
+from .models import FilesORM, FileReplicasORM
+from .schemas import FileSchema
+from .storage import RateLimiter, copy_file
+from .volumes import VolumeService, MB
+from ..coordination import PathLock
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter
+
+
+replicated_files = Counter("replication_copied_files_total", "Сделано копий файлов")
+replicated_bytes = Counter("replication_copied_bytes_total", "Скопировано байт на другие тома")
+dropped_replicas = Counter("replication_dropped_replicas_total", "Удалено недоступных или лишних копий")
+restored_files = Counter("replication_restored_files_total", "Восстановлено пропавших файлов с копий")
+
+
+class ReplicationService:
+    """
+        Копии файлов на других томах
+
+        Файл хранится в REPLICATION_FACTOR экземплярах: основной и копии
+            в <корень тома>/.replicas/{id} на других томах, по одной на том.
+            file_replicas хранит версию файла в каждой копии, поэтому копия
+            устаревшей версии не отдается и перезаписывается
+
+        Ведущий экземпляр по кругу обходит файлы с недостающими копиями
+            текущей версии и досоздает их с ограничением скорости, а также
+            проверяет наличие копий на диске, удаляя записи о пропавших,
+            чтобы следующий обход сделал их заново. Пропавший основной файл
+            восстанавливается с копии текущей версии
+    """
+
+    _limiter: RateLimiter | None = None
+    _files_cursor = 0  # Последний обойденный файл
+    _replicas_cursor: tuple[int, str] = (0, "")  # Последняя проверенная копия
+
+    @staticmethod
+    def get_replica_path(file_id: int, volume: str) -> Path:
+        return VolumeService.get_volume(volume).root / ".replicas" / str(file_id)
+
+    @staticmethod
+    def get_primary(file_data: FileSchema) -> str | None:
+        """Том основного файла"""
+
+        return file_data.volume or VolumeService.find_volume(file_data.full_path)
+
+    @staticmethod
+    def _get_factor() -> int:
+        return min(ReplicationConfig.FACTOR, len(VolumeService.get_volumes()))
+
+    @classmethod
+    async def choose_copy(
+            cls,
+            file_data: FileSchema,
+            db: AsyncSession
+    ) -> tuple[Path, str | None]:
+        """
+            Выбирает для чтения наименее загруженную исправную копию файла
+                текущей версии. Возвращает путь и том
+        """
+
+        primary = cls.get_primary(file_data)
+
+        if cls._get_factor() < 2:
+            return file_data.full_path, primary
+
+        volumes = await db.scalars(
+            select(FileReplicasORM.volume)
+            .where(
+                (FileReplicasORM.file_id == file_data.id)
+                & (FileReplicasORM.version == file_data.version)
+            )
+        )
+
+        copies = [(file_data.full_path, primary)] + [
+            (cls.get_replica_path(file_data.id, x), x)
+            for x in volumes.all()
+            if VolumeService.get_volume(x) is not None
+        ]
+        healthy = [
+            x for x in copies
+            if VolumeService.is_healthy(x[1]) and x[0].exists()
+        ]
+
+        return min(
+            healthy or copies[:1],
+            key=lambda x: (VolumeService.get_inflight(x[1]), random.random())
+        )
+
+    @staticmethod
+    def _copy(source: Path, target: Path, limiter: RateLimiter | None = None) -> None:
+        """Копирует файл во временный рядом с target и ставит его на место"""
+
+        temp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}")
+
+        try:
+            copy_file(source, temp_path, limiter)
+            os.replace(temp_path, target)
+
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    async def has_replicas(file_id: int, db: AsyncSession) -> bool:
+        """Есть ли у файла записи о копиях любой версии"""
+
+        replica = await db.scalar(
+            select(FileReplicasORM.volume)
+            .where(FileReplicasORM.file_id == file_id)
+            .limit(1)
+        )
+
+        return replica is not None
+
+    @classmethod
+    async def restore_primary(
+            cls,
+            file_data: FileSchema,
+            db: AsyncSession
+    ) -> bool:
+        """
+            Восстанавливает пропавший основной файл с исправной копии
+                текущей версии. Путь уже заблокирован вызывающим.
+                Возвращает, удалось ли
+        """
+
+        volumes = await db.scalars(
+            select(FileReplicasORM.volume)
+            .where(
+                (FileReplicasORM.file_id == file_data.id)
+                & (FileReplicasORM.version == file_data.version)
+            )
+        )
+        primary = cls.get_primary(file_data)
+
+        for volume in volumes.all():
+            if (
+                VolumeService.get_volume(volume) is None or
+                not VolumeService.is_healthy(volume)
+            ):
+                continue
+
+            try:
+                with VolumeService.io(volume), VolumeService.io(primary):
+                    await asyncio.to_thread(
+                        cls._copy,
+                        cls.get_replica_path(file_data.id, volume),
+                        file_data.full_path
+                    )
+
+            except OSError:
+                traceback.print_exc()
+                continue
+
+            restored_files.inc()
+            return True
+
+        return False
+
+    @classmethod
+    async def _repair_primary(cls, file_data: FileSchema, db: AsyncSession) -> None:
+        """Восстанавливает основной файл, если его по-прежнему нет"""
+
+        try:
+            async with PathLock(str(file_data.full_path)) as lock:
+                # Пока проверяли, файл могли изменить, переместить или удалить
+                unchanged = await db.scalar(
+                    select(FilesORM.id)
+                    .where(
+                        (FilesORM.id == file_data.id)
+                        & (FilesORM.path == file_data.path)
+                        & (FilesORM.name == file_data.name)
+                        & (FilesORM.extension == file_data.extension)
+                        & (FilesORM.version == file_data.version)
+                        & FilesORM.deleted_at.is_(None)
+                    )
+                    .with_for_update()
+                )
+
+                if (
+                    unchanged is not None and
+                    not await asyncio.to_thread(file_data.full_path.exists)
+                ):
+                    await cls.restore_primary(file_data, db)
+
+                await lock.commit(db)
+
+        except HTTPException:
+            await db.rollback()  # Путь занят запросом, файл проверит следующий обход
+
+    @classmethod
+    async def _drop(
+            cls,
+            file_id: int,
+            volume: str,
+            db: AsyncSession
+    ) -> None:
+        if VolumeService.get_volume(volume) is not None:
+            await asyncio.to_thread(
+                cls.get_replica_path(file_id, volume).unlink, missing_ok=True
+            )
+
+        await db.execute(
+            delete(FileReplicasORM)
+            .where(
+                (FileReplicasORM.file_id == file_id)
+                & (FileReplicasORM.volume == volume)
+            )
+        )
+        dropped_replicas.inc()
+
+    @classmethod
+    async def release_files(
+            cls,
+            file_ids: list[int],
+            db: AsyncSession
+    ) -> None:
+        """Удаляет копии файлов перед удалением их записей"""
+
+        replicas = await db.execute(
+            select(FileReplicasORM.file_id, FileReplicasORM.volume)
+            .where(FileReplicasORM.file_id.in_(file_ids))
+        )
+
+        for file_id, volume in replicas.tuples().all():
+            await cls._drop(file_id, volume, db)
+
+    @classmethod
+    async def _replicate(
+            cls,
+            file_data: FileSchema,
+            replicas: dict[str, int],
+            db: AsyncSession
+    ) -> None:
+        """Досоздает недостающие копии файла, replicas - том и версия копий"""
+
+        primary = cls.get_primary(file_data)
+
+        if primary in replicas:
+            # Файл перенесли на том с его копией
+            await cls._drop(file_data.id, primary, db)
+            del replicas[primary]
+
+        valid = {x for x, y in replicas.items() if y == file_data.version}
+        needed = cls._get_factor() - 1 - len(valid)
+
+        # Сначала перезаписываются устаревшие копии, затем самые свободные тома
+        targets = sorted(
+            (
+                x for x in VolumeService.get_volumes()
+                if x.name != primary and x.name not in valid and x.healthy and
+                x.free - file_data.size >= VolumeConfig.MIN_FREE_MB * MB
+            ),
+            key=lambda x: (x.name not in replicas, -x.free)
+        )
+
+        for volume in targets[:max(needed, 0)]:
+            target = cls.get_replica_path(file_data.id, volume.name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            with VolumeService.io(primary), VolumeService.io(volume.name):
+                await asyncio.to_thread(
+                    cls._copy, file_data.full_path, target, cls._limiter
+                )
+
+            statement = insert(FileReplicasORM).values(
+                file_id=file_data.id,
+                volume=volume.name,
+                version=file_data.version
+            )
+            await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[FileReplicasORM.file_id, FileReplicasORM.volume],
+                    set_={
+                        "version": statement.excluded.version,
+                        "replicated_at": func.now()
+                    }
+                )
+            )
+            # Фиксация после каждой копии, чтобы сбой не откатил сделанные
+            await db.commit()
+
+            volume.free -= file_data.size
+            replicated_files.inc()
+            replicated_bytes.inc(file_data.size)
+
+    @classmethod
+    async def replicate_batch(cls) -> bool:
+        """
+            Досоздает копии очередной пачки файлов, у которых их меньше
+                REPLICATION_FACTOR. Возвращает, остались ли еще такие файлы
+        """
+
+        await asyncio.to_thread(VolumeService._measure)
+
+        valid_replicas = (
+            select(func.count())
+            .where(
+                (FileReplicasORM.file_id == FilesORM.id)
+                & (FileReplicasORM.version == FilesORM.version)
+            )
+            .scalar_subquery()
+        )
+
+        db = session_factory()
+
+        try:
+            files = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id > cls._files_cursor)
+                    & FilesORM.deleted_at.is_(None)
+                    & (valid_replicas < cls._get_factor() - 1)
+                )
+                .order_by(FilesORM.id)
+                .limit(ReplicationConfig.BATCH_SIZE)
+            )
+            files = [FileSchema.model_validate(x) for x in files.all()]
+
+            if not files:
+                cls._files_cursor = 0
+                return False
+
+            cls._files_cursor = files[-1].id
+
+            replicas = await db.execute(
+                select(
+                    FileReplicasORM.file_id,
+                    FileReplicasORM.volume,
+                    FileReplicasORM.version
+                )
+                .where(FileReplicasORM.file_id.in_([x.id for x in files]))
+            )
+            by_file = defaultdict(dict)
+
+            for file_id, volume, version in replicas.tuples().all():
+                by_file[file_id][volume] = version
+
+            await db.commit()
+
+            for file_data in files:
+                try:
+                    await cls._replicate(file_data, by_file[file_data.id], db)
+
+                except FileNotFoundError:
+                    await db.rollback()  # Файл удален или перемещен, догонит следующий обход
+
+                except Exception:
+                    traceback.print_exc()
+                    await db.rollback()
+
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        return True
+
+    @classmethod
+    async def repair_batch(cls) -> bool:
+        """
+            Проверяет очередную пачку копий и удаляет записи о копиях,
+                пропавших с диска или с убранных из настроек томов, чтобы их сделали
+                заново. Основные файлы этих копий, пропавшие с исправного тома,
+                восстанавливаются. Возвращает, остались ли непроверенные копии
+        """
+
+        db = session_factory()
+
+        try:
+            replicas = await db.execute(
+                select(FileReplicasORM.file_id, FileReplicasORM.volume)
+                .where(
+                    tuple_(FileReplicasORM.file_id, FileReplicasORM.volume)
+                    > tuple_(*cls._replicas_cursor)
+                )
+                .order_by(FileReplicasORM.file_id, FileReplicasORM.volume)
+                .limit(ReplicationConfig.BATCH_SIZE)
+            )
+            replicas = replicas.tuples().all()
+
+            if not replicas:
+                cls._replicas_cursor = (0, "")
+                return False
+
+            cls._replicas_cursor = replicas[-1]
+
+            for file_id, volume in replicas:
+                if not VolumeService.is_healthy(volume):
+                    continue  # Том временно недоступен, копии с него не читаются
+
+                if (
+                    VolumeService.get_volume(volume) is None or
+                    not await asyncio.to_thread(
+                        cls.get_replica_path(file_id, volume).exists
+                    )
+                ):
+                    await cls._drop(file_id, volume, db)
+
+            await db.commit()
+
+            files = await db.scalars(
+                select(FilesORM)
+                .where(
+                    FilesORM.id.in_({x for x, _ in replicas})
+                    & FilesORM.deleted_at.is_(None)
+                )
+            )
+            files = [FileSchema.model_validate(x) for x in files.all()]
+            await db.commit()
+
+            for file_data in files:
+                if (
+                    VolumeService.is_healthy(cls.get_primary(file_data)) and
+                    not await asyncio.to_thread(file_data.full_path.exists)
+                ):
+                    await cls._repair_primary(file_data, db)
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        return True
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Досоздает и проверяет копии файлов с ограничением скорости
+                REPLICATION_RATE_MB
+
+            Запускается только на ведущем экземпляре
+        """
+
+        cls._limiter = RateLimiter(ReplicationConfig.RATE_MB * MB)
+
+        while True:
+            try:
+                has_more = await cls.replicate_batch()
+                has_more = await cls.repair_batch() or has_more
+
+            except Exception:
+                traceback.print_exc()
+                has_more = False
+
+            await asyncio.sleep(0 if has_more else ReplicationConfig.INTERVAL)
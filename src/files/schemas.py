@@ -13,9 +13,13 @@ class FileSchema(BaseModel):
     extension: str  # Расширение файла
     size: int  # Размер файда в байтах
     path: str  # Путь к файлу
+    folder_id: int | None = None  # Папка в которой лежит файл
     created_at: datetime = Field(datetime.now().isoformat())  # Дата создания файла
     updated_at: datetime | None = None  # Дата обновления файла
     comment: str | None = Field(None, max_length=255)  # Коментарий к файлу
+    checksum: str | None = None  # sha256 содержимого файла
+    version: int = 1  # Номер текущей версии
+    volume: str | None = None  # Том, в корне которого размещен файл
 
     class Config:
         from_attributes = True
@@ -51,6 +55,15 @@ class FileSchema(BaseModel):
         return self.get_full_path(self.directory, self.full_name)
 
 
+class FileChangesSchema(BaseModel):
+    """Изменения в файлах пользователя начиная с версии"""
+
+    version: int  # Текущая версия списка файлов
+    updated: list[FileSchema]  # Созданные и измененные файлы
+    deleted: list[int]  # Идентификаторы удаленных файлов
+    reset: bool = False  # Изменения после since уже удалены, список нужно запросить заново через /files/my
+
+
 class FileCreateSchema(BaseModel):
     """Схема создания файла"""
 
@@ -58,6 +71,9 @@ class FileCreateSchema(BaseModel):
     extension: str = Field(..., max_length=10)
     size: int = Field(..., ge=0,  le=2147483647)
     path: str = Field(..., max_length=255)
+    folder_id: Optional[int] = None
+    checksum: Optional[str] = Field(None, max_length=64)
+    volume: Optional[str] = Field(None, max_length=32)
 
 
 class FileUpdateForm(BaseModel):
@@ -65,14 +81,20 @@ class FileUpdateForm(BaseModel):
 
     name: Optional[str] = Field(
         None,
+        min_length=1,
         max_length=265,
         description="Имя файла"
     )
     path: Optional[str] = Field(
         None,
+        min_length=1,
         max_length=255,
         description="Путь к файлу"
     )
+    folder_id: Optional[int] = Field(
+        None,
+        description="Папка в которую переносится файл"
+    )
     comment: Optional[str] = Field(
         None,
         max_length=255,
@@ -81,14 +103,127 @@ class FileUpdateForm(BaseModel):
 
     @model_validator(mode="after")
     def validate_params(self):
-        """Проверяет что форма не пустая"""
+        """Проверяет что форма не пустая и не обнуляет обязательные поля"""
 
-        if not any(self.model_dump().values()):
+        if not self.model_fields_set:
             raise ValueError("an empty request")
 
+        for field in ("name", "path"):
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"{field} can't be null")
+
         return self
 
 
+class FileCopyForm(BaseModel):
+    """Схема для копирования файла"""
+
+    name: Optional[str] = Field(
+        None,
+        max_length=255,
+        description="Имя копии, по умолчанию имя исходного файла с суффиксом _copy"
+    )
+    path: Optional[str] = Field(
+        None,
+        max_length=255,
+        description="Директория копии внутри хранилища, по умолчанию директория исходного файла"
+    )
+    folder_id: Optional[int] = Field(
+        None,
+        description="Папка копии, по умолчанию папка исходного файла, null - без папки"
+    )
+
+
+class BlockSignatureSchema(BaseModel):
+    """Сигнатура блока файла"""
+
+    index: int  # Порядковый номер блока
+    weak: int  # Слабая скользящая сумма (adler32)
+    strong: str  # Сильная сумма блока (md5)
+
+
+class FileSignaturesSchema(BaseModel):
+    """Сигнатуры блоков хранимой версии файла"""
+
+    file_id: int  # Идентификатор файла
+    version: str  # Версия содержимого, к которой относятся сигнатуры
+    size: int  # Размер файла в байтах
+    block_size: int  # Размер блока в байтах
+    blocks: list[BlockSignatureSchema]  # Сигнатуры блоков
+
+
+class DeltaOperation(BaseModel):
+    """
+        Операция сборки новой версии файла:
+            либо блок старой версии, либо диапазон присланных данных
+    """
+
+    block: Optional[int] = Field(None, ge=0)  # Номер блока старой версии
+    offset: Optional[int] = Field(None, ge=0)  # Смещение в присланных данных
+    length: Optional[int] = Field(None, gt=0)  # Длина диапазона присланных данных
+
+    @model_validator(mode="after")
+    def validate_operation(self):
+        """Проверяет что задан ровно один источник данных"""
+
+        is_block = self.block is not None
+        is_literal = self.offset is not None and self.length is not None
+
+        if is_block == is_literal:
+            raise ValueError("expected either block or offset and length")
+
+        return self
+
+
+class FileDeltaForm(BaseModel):
+    """Схема для обновления файла по дельте"""
+
+    version: str = Field(..., description="Версия файла, от которой строилась дельта")
+    block_size: int = Field(..., gt=0, description="Размер блока сигнатур")
+    operations: list[DeltaOperation] = Field(..., description="Операции сборки")
+    checksum: Optional[str] = Field(
+        None,
+        max_length=32,
+        description="md5 итогового файла для проверки"
+    )
+
+
+class FileIntegrityIssueSchema(BaseModel):
+    """Найденная проблема целостности файла"""
+
+    file_id: int  # Идентификатор файла
+    kind: str  # missing - файла нет в хранилище, mismatch - не совпал хэш
+    detected_at: datetime  # Когда проблема была обнаружена
+
+    class Config:
+        from_attributes = True
+
+
+class TrashedFileSchema(FileSchema):
+    """Файл в корзине"""
+
+    deleted_at: datetime  # Когда файл был удален
+
+
+class FileVersionSchema(BaseModel):
+    """Сохраненная предыдущая версия файла"""
+
+    version: int  # Номер версии
+    size: int  # Размер в байтах
+    checksum: str | None  # sha256 содержимого
+    created_at: datetime  # Когда версия была заменена новой
+
+    class Config:
+        from_attributes = True
+
+
+class SignedUrlSchema(BaseModel):
+    """Подписанная ссылка на скачивание файла"""
+
+    url: str  # Относительная ссылка, не требующая токена доступа
+    expires_at: datetime  # До какого момента ссылка действительна
+
+
 class FailFilesInitialization(Exception):
     """Исключение которое пробрасывается при неудачной инициализации файлов"""
     pass
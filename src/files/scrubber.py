@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import traceback
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ScrubberConfig
+
+from .models import FilesORM, FileIntegrityIssuesORM
+from .schemas import FileSchema, FileIntegrityIssueSchema
+from .changes import FileChangesService
+from .storage import RateLimiter
+from ..databases.aioredis import get_redis_client
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter, Gauge
+
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Размер куска при чтении файла
+
+scrubbed_files = Counter("scrubber_files_total", "Проверено файлов")
+scrubbed_bytes = Counter("scrubber_bytes_total", "Прочитано байт при проверке")
+scrub_issues = Counter("scrubber_issues_total", "Найдено проблем целостности")
+scrub_cursor = Gauge("scrubber_cursor", "Последний проверенный идентификатор файла")
+
+
+class FileScrubber:
+    """
+        Фоновая проверка целостности файлов
+
+        Обходит таблицу files по возрастанию id, пересчитывает sha256
+            с ограничением скорости чтения и сверяет с сохраненным.
+            Позиция обхода хранится в redis, поэтому после перезапуска
+            проверка продолжается с того же места
+    """
+
+    CURSOR_KEY = "scrubber:last_id"
+
+    _pool: ThreadPoolExecutor | None = None
+    _limiter: RateLimiter | None = None
+
+    @classmethod
+    def _hash_file(cls, path: Path) -> str | None:
+        """Считает sha256 файла, возвращает None если файла нет"""
+
+        checksum = hashlib.sha256()
+
+        try:
+            with open(path, "rb") as file:
+                while chunk := file.read(HASH_CHUNK_SIZE):
+                    cls._limiter.consume(len(chunk))
+                    checksum.update(chunk)
+                    scrubbed_bytes.inc(len(chunk))
+
+        except FileNotFoundError:
+            return None
+
+        return checksum.hexdigest()
+
+    @staticmethod
+    async def save_issues(
+            issues: dict[int, str],
+            db: AsyncSession
+    ) -> None:
+        """Записывает найденные проблемы"""
+
+        if not issues:
+            return
+
+        statement = insert(FileIntegrityIssuesORM).values(
+            [{"file_id": x, "kind": kind} for x, kind in issues.items()]
+        )
+
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[FileIntegrityIssuesORM.file_id],
+                set_={
+                    "kind": statement.excluded.kind,
+                    "detected_at": func.now()
+                }
+            )
+        )
+
+        for kind in issues.values():
+            scrub_issues.inc(kind=kind)
+
+    @classmethod
+    async def scrub_batch(cls) -> bool:
+        """
+            Проверяет очередную пачку файлов
+
+            Возвращает False когда проход по всем файлам завершен
+        """
+
+        redis = get_redis_client()
+        last_id = int(await redis.get(cls.CURSOR_KEY) or 0)
+
+        db = session_factory()
+
+        try:
+            files = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id > last_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+                .order_by(FilesORM.id)
+                .limit(ScrubberConfig.BATCH_SIZE)
+            )
+            files = [FileSchema.model_validate(x) for x in files.all()]
+
+        finally:
+            await db.close()
+
+        if not files:
+            await redis.delete(cls.CURSOR_KEY)
+            return False
+
+        # Хэширование с ограничением скорости может идти долго,
+        # поэтому подключение к базе на это время не удерживается
+        loop = asyncio.get_running_loop()
+        checksums = await asyncio.gather(*(
+            loop.run_in_executor(cls._pool, cls._hash_file, x.full_path)
+            for x in files
+        ))
+
+        db = session_factory()
+
+        try:
+            scanned = {x.id: x for x in files}
+            verified, backfill, suspects, issues = [], {}, {}, {}
+
+            for file, checksum in zip(files, checksums):
+                if checksum is not None and file.checksum is None:
+                    backfill[file.id] = (checksum, file.version)
+                elif checksum is not None and file.checksum == checksum:
+                    verified.append(file.id)
+                else:
+                    suspects[file.id] = checksum
+
+            if suspects:
+                # Файл мог быть изменен или перемещен во время чтения
+                current = await db.scalars(
+                    select(FilesORM)
+                    .where(
+                        FilesORM.id.in_(suspects)
+                        & FilesORM.deleted_at.is_(None)
+                    )
+                )
+
+                for file in [FileSchema.model_validate(x) for x in current.all()]:
+                    checksum = suspects[file.id]
+                    before = scanned[file.id]
+
+                    if (
+                        file.version != before.version or
+                        file.full_path != before.full_path
+                    ):
+                        continue  # Читалось прежнее содержимое, файл проверит следующий проход
+
+                    if checksum is None and file.full_path.exists():
+                        continue
+
+                    if checksum is not None and checksum == file.checksum:
+                        verified.append(file.id)
+                        continue
+
+                    issues[file.id] = "missing" if checksum is None else "mismatch"
+
+            for file_id, (checksum, version) in backfill.items():
+                # checksum входит в список файлов, поэтому версия списка растет
+                owner_id = await db.scalar(
+                    update(FilesORM)
+                    .where(
+                        (FilesORM.id == file_id)
+                        & (FilesORM.version == version)
+                        & FilesORM.checksum.is_(None)
+                    )
+                    .values(checksum=checksum, verified_at=func.now())
+                    .returning(FilesORM.owner_id)
+                )
+
+                if owner_id is not None:
+                    await FileChangesService.register_change(
+                        owner_id, file_id, "updated", db
+                    )
+
+            if verified:
+                await db.execute(
+                    update(FilesORM)
+                    .where(FilesORM.id.in_(verified))
+                    .values(verified_at=func.now())
+                )
+                await db.execute(
+                    delete(FileIntegrityIssuesORM)
+                    .where(FileIntegrityIssuesORM.file_id.in_(verified))
+                )
+
+            await cls.save_issues(issues, db)
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        scrubbed_files.inc(len(files))
+        scrub_cursor.set(files[-1].id)
+        await redis.set(cls.CURSOR_KEY, files[-1].id)
+
+        return True
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Бесконечно проверяет файлы, делая паузу после каждого прохода
+
+            Запускается только на ведущем экземпляре
+        """
+
+        cls._pool = ThreadPoolExecutor(
+            max_workers=ScrubberConfig.WORKERS,
+            thread_name_prefix="scrubber"
+        )
+        cls._limiter = RateLimiter(ScrubberConfig.RATE_MB * 1024 * 1024)
+
+        try:
+            while True:
+                try:
+                    has_more = await cls.scrub_batch()
+
+                except Exception:
+                    traceback.print_exc()
+                    has_more = False
+
+                await asyncio.sleep(0 if has_more else ScrubberConfig.INTERVAL)
+
+        finally:
+            cls._pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    async def get_issues(
+            user_id: int,
+            db: AsyncSession
+    ) -> list[FileIntegrityIssueSchema]:
+        """Возвращает проблемы целостности файлов пользователя"""
+
+        issues = await db.scalars(
+            select(FileIntegrityIssuesORM)
+            .join(FilesORM, FilesORM.id == FileIntegrityIssuesORM.file_id)
+            .where(
+                (FilesORM.owner_id == user_id)
+                & FilesORM.deleted_at.is_(None)
+            )
+            .order_by(FileIntegrityIssuesORM.file_id)
+        )
+
+        return [FileIntegrityIssueSchema.model_validate(x) for x in issues.all()]
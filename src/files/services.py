@@ -1,43 +1,88 @@
-import shutil
+import asyncio
+import hashlib
 import aiofiles
 import traceback
 
-from typing import Optional
 from pathlib import Path
+from contextlib import nullcontext
 
 from fastapi import UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 
 from pydantic import ValidationError
 
-from sqlalchemy import insert, update, delete, select
+from sqlalchemy import update, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import Config
 
 from .models import FilesORM
 from .schemas import FileSchema, FileCreateSchema, FileUpdateForm, \
-    FailFilesInitialization
-from ..databases.sqlalchemy import session_factory
+    FileCopyForm, FailFilesInitialization
+from .changes import FileChangesService
+from .journal import OperationJournal
+from .storage import copy_file, move_file
+from .signing import SignedUrlService
+from .cache import FileContentCache
+from .versions import VersionService
+from .volumes import VolumeService
+from .replication import ReplicationService
+from .scrubber import FileScrubber
+from .thumbnails import ThumbnailService
+from ..coordination import PathLock
+from ..profiling import trace_io
+from ..folders.models import FoldersORM
+from ..databases.sqlalchemy import session_factory, is_unique_violation
 from ..base_response import ResponseOK
 
 
 class FileService:
 
-    @staticmethod
+    MAX_FILE_SIZE = 2147483647  # Ограничение колонки size
+
+    LISTING_COLUMNS = (
+        FilesORM.id,
+        FilesORM.owner_id,
+        FilesORM.name,
+        FilesORM.extension,
+        FilesORM.size,
+        FilesORM.path,
+        FilesORM.folder_id,
+        FilesORM.created_at,
+        FilesORM.updated_at,
+        FilesORM.comment,
+        FilesORM.checksum,
+        FilesORM.version,
+        FilesORM.volume
+    )  # Колонки FileSchema для выборки списков без ORM объектов
+
+    @classmethod
     async def get_my_files(
+            cls,
             user_id: int,
             db: AsyncSession
-    ) -> list[Optional[FileSchema]]:
-        """Возвращает все файлы которые есть в базе данных"""
+    ) -> list[dict]:
+        """
+            Возвращает все файлы пользователя в виде словарей полей FileSchema
 
-        files = await db.scalars(
-            select(FilesORM)
-            .where(FilesORM.owner_id == user_id)
+            Строки выбираются кортежами, без создания ORM объектов
+                и повторной валидации, для сериализации через orjson
+        """
+
+        rows = await db.execute(
+            select(*cls.LISTING_COLUMNS)
+            .where(
+                (FilesORM.owner_id == user_id)
+                & FilesORM.deleted_at.is_(None)
+            )
         )
-        files = files.all()
+        keys = tuple(rows.keys())
 
-        return [FileSchema.model_validate(x) for x in files]
+        return [dict(zip(keys, row)) for row in rows.tuples()]
 
     @staticmethod
     async def get_file_data(
@@ -49,7 +94,10 @@ class FileService:
 
         file = await db.scalars(
             select(FilesORM)
-            .where(FilesORM.id == file_id)
+            .where(
+                (FilesORM.id == file_id)
+                & FilesORM.deleted_at.is_(None)
+            )
         )
         file = file.first()
 
@@ -68,13 +116,35 @@ class FileService:
         return FileSchema.model_validate(file)
 
     @staticmethod
-    def _file_exist_on_storage(
-            full_name: str,
-            path: Path
-    ) -> bool:
-        """Возвращает есть ли файл в хранилище"""
+    async def _validate_folder(
+            user_id: int,
+            folder_id: int | None,
+            db: AsyncSession
+    ) -> None:
+        """
+            Проверяет что папка существует и принадлежит пользователю
+
+            Папка блокируется от удаления до конца транзакции, поэтому
+                удаление папки дождется переноса файла в нее и увидит его
+        """
+
+        if folder_id is None:
+            return
+
+        owner_id = await db.scalar(
+            select(FoldersORM.owner_id)
+            .where(FoldersORM.id == folder_id)
+            .with_for_update(key_share=True)
+        )
+
+        if owner_id is None:
+            raise HTTPException(status_code=404, detail="folder not found")
 
-        return Path(path, full_name).exists()
+        if owner_id != user_id:
+            raise HTTPException(
+                status_code=403,
+                detail="folder does not belong to the user"
+            )
 
     @staticmethod
     async def _file_exist_on_database(
@@ -91,25 +161,52 @@ class FileService:
                 (FilesORM.name == name)
                 & (FilesORM.extension == extension)
                 & (FilesORM.path == str(path))
+                & FilesORM.deleted_at.is_(None)
             )
         )
 
         return bool(search_file.first())
 
+    @staticmethod
+    async def _get_volume_file(
+            name: str,
+            extension: str,
+            db: AsyncSession
+    ) -> FileSchema | None:
+        """Возвращает файл с таким именем из корня любого тома"""
+
+        file = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.name == name)
+                & (FilesORM.extension == extension)
+                & FilesORM.volume.isnot(None)
+                & FilesORM.deleted_at.is_(None)
+            )
+        )
+        file = file.first()
+
+        return FileSchema.model_validate(file) if file else None
+
     @staticmethod
     def _validate_new_file(
             *,
             name: str,
             extension: str,
             size: int,
-            path: str
+            path: str,
+            folder_id: int | None = None,
+            checksum: str | None = None,
+            volume: str | None = None
     ) -> FileCreateSchema:
         """Возвращает FileCreateSchema для создания и валидирует данные"""
 
         try:
             return FileCreateSchema(
                 name=name, extension=extension,
-                size=size, path=path
+                size=size, path=path,
+                folder_id=folder_id, checksum=checksum,
+                volume=volume
             )
 
         except ValidationError as ex:
@@ -120,22 +217,25 @@ class FileService:
             owner_id: int,
             file_data: FileCreateSchema,
             db: AsyncSession
-    ) -> int:
+    ) -> FileSchema | None:
         """
-            Добавляет данные о файле в базу данных
-                и возвращает идентификатор файла
+            Добавляет данные о файле в базу данных и возвращает их
+
+            Проверка на дубликат и вставка выполняются одним запросом
+                по уникальным индексам (path, name, extension) и
+                (name, extension) файлов в корнях томов,
+                при конфликте возвращается None
         """
 
-        new_file = await db.execute(
+        new_file = await db.scalars(
             insert(FilesORM)
-            .values(
-                owner_id=owner_id,
-                **file_data.model_dump()
-            )
-            .returning(FilesORM.id)
+            .values(owner_id=owner_id, **file_data.model_dump())
+            .on_conflict_do_nothing()
+            .returning(FilesORM)
         )
+        new_file = new_file.first()
 
-        return new_file.scalar()
+        return FileSchema.model_validate(new_file) if new_file else None
 
     @staticmethod
     def _split_file_name(
@@ -147,48 +247,93 @@ class FileService:
 
         return path.name.split(".")[0], "".join(path.suffixes)[1:]
 
+    @staticmethod
+    def hash_content(content: bytes) -> str:
+        """Возвращает sha256 содержимого файла"""
+
+        return hashlib.sha256(content).hexdigest()
+
     @classmethod
     async def upload_file(
             cls,
             user_id: int,
             file: UploadFile,
+            folder_id: int | None,
             db: AsyncSession
     ) -> ResponseOK:
-        """Обрабатывает загрузку файлов"""
+        """
+            Обрабатывает загрузку файлов
+
+            Загрузка в имя существующего файла владельца создает его новую
+                версию, а прежнее содержимое сохраняется в истории версий.
+                Новый файл кладется в корень тома, выбранного VolumeService
+        """
 
         full_name = file.filename
         name, extension = cls._split_file_name(full_name)
 
-        if (
-            cls._file_exist_on_storage(
-                full_name, Config.BASE_DIRECTORY
-            ) or
-            await cls._file_exist_on_database(
-                name, extension, Config.BASE_DIRECTORY, db
+        await cls._validate_folder(user_id, folder_id, db)
+
+        file_content = await file.read()
+        existing = await cls._get_volume_file(name, extension, db)
+
+        if existing is not None:
+            full_path, volume = existing.full_path, existing.volume
+        else:
+            volume = (await VolumeService.place(len(file_content))).name
+            full_path = FileSchema.get_full_path(
+                directory=VolumeService.get_volume(volume).root,
+                full_name=FileSchema.get_full_name(name, extension)
             )
-        ):
-            raise HTTPException(status_code=409, detail="file exists")
-
-        file_id = await cls._add_file_data(
-            owner_id=user_id,
-            file_data=cls._validate_new_file(
-                name=name,
-                extension=extension,
-                size=file.size,
-                path=str(Config.BASE_DIRECTORY)
-            ),
-            db=db
-        )
-        file_data = await cls.get_file_data(user_id, file_id, db)
 
-        try:
-            async with aiofiles.open(file_data.full_path, "wb") as open_file:
-                file_content = await file.read()
-                await open_file.write(file_content)
+        checksum = await asyncio.to_thread(cls.hash_content, file_content)
 
-        except:
-            await cls.delete_file(user_id, file_id, db)
-            raise HTTPException(status_code=501, detail="file not saved")
+        async with PathLock(str(full_path)) as lock:
+            async with OperationJournal.operation(
+                "upload",
+                {"path": str(full_path), "checksum": checksum},
+                db
+            ):
+                new_file = await cls._add_file_data(
+                    owner_id=user_id,
+                    file_data=cls._validate_new_file(
+                        name=name,
+                        extension=extension,
+                        size=file.size,
+                        path=str(full_path.parent),
+                        folder_id=folder_id,
+                        checksum=checksum,
+                        volume=volume
+                    ),
+                    db=db
+                )
+
+                if new_file is not None:
+                    try:
+                        # "x" - O_CREAT | O_EXCL, чужой файл не будет перезаписан
+                        with trace_io("write", full_path), VolumeService.io(volume):
+                            async with aiofiles.open(full_path, "xb") as open_file:
+                                await open_file.write(file_content)
+
+                    except FileExistsError:
+                        raise HTTPException(status_code=409, detail="file exists")
+
+                    except OSError:
+                        raise HTTPException(status_code=501, detail="file not saved")
+
+                    await FileChangesService.register_change(
+                        user_id, new_file.id, "created", db
+                    )
+
+            if new_file is None:
+                new_file = await VersionService.replace_content(
+                    user_id, name, extension, full_path,
+                    file_content, checksum, db
+                )
+
+            await lock.commit(db)
+
+        ThumbnailService.enqueue(new_file)
 
         return ResponseOK()
 
@@ -199,6 +344,8 @@ class FileService:
     ) -> None:
         """Удаляет данные о файле в базе данных"""
 
+        await VersionService.release_files([file_id], db)
+        await ReplicationService.release_files([file_id], db)
         await db.execute(
             delete(FilesORM)
             .where(FilesORM.id == file_id)
@@ -214,13 +361,19 @@ class FileService:
 
         if (
             str(path) != anchor and
-            path != Config.BASE_DIRECTORY and
+            not VolumeService.is_root(path) and
             path.exists() and
             not any(path.iterdir())
         ):
             path.rmdir()
             cls._delete_directorys(path.parent, anchor)
 
+    @staticmethod
+    def get_trash_path(file_id: int, volume: str | None = None) -> Path:
+        """Расположение удаленного файла в корзине"""
+
+        return VolumeService.get_trash_directory(volume) / str(file_id)
+
     @classmethod
     async def delete_file(
             cls,
@@ -228,19 +381,117 @@ class FileService:
             file_id: int,
             db: AsyncSession
     ) -> ResponseOK:
-        """Удаляет все данные о файле вместе с файлом"""
+        """
+            Перемещает файл в корзину
+
+            Файл переименовывается в корзину, а запись помечается удаленной.
+                Окончательно их удаляет TrashService по истечении срока хранения
+        """
 
         file_data = await cls.get_file_data(user_id, file_id, db)
         full_path = file_data.full_path
+        trash_path = cls.get_trash_path(file_id, file_data.volume)
+
+        async with PathLock(str(full_path)) as lock:
+            async with OperationJournal.operation(
+                "delete",
+                {"path": str(full_path), "trash": str(trash_path)},
+                db
+            ):
+                await db.execute(
+                    update(FilesORM)
+                    .where(FilesORM.id == file_id)
+                    .values(deleted_at=func.now())
+                )
+                await FileChangesService.register_change(
+                    user_id, file_id, "deleted", db
+                )
 
-        if cls._file_exist_on_storage(file_data.full_name, file_data.directory):
-            full_path.unlink()
+                try:
+                    await asyncio.to_thread(move_file, full_path, trash_path)
 
-        cls._delete_directorys(full_path.parent, full_path.anchor)
-        await cls._drop_file_data(file_id, db)
+                except FileNotFoundError:
+                    pass  # Файла уже нет в хранилище, удаляется только запись
+
+            await lock.commit(db)
+
+        SignedUrlService.invalidate(file_id)
+        FileContentCache.invalidate(file_id)
+        await asyncio.to_thread(ThumbnailService.remove, file_id)
 
         return ResponseOK()
 
+    @classmethod
+    async def restore_file(
+            cls,
+            user_id: int,
+            file_id: int,
+            db: AsyncSession
+    ) -> FileSchema:
+        """Возвращает файл из корзины на прежнее место"""
+
+        file = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.id == file_id)
+                & FilesORM.deleted_at.isnot(None)
+            )
+            .with_for_update()
+        )
+        file = file.first()
+
+        if file is None:
+            raise HTTPException(status_code=404, detail="file not found in trash")
+
+        if file.owner_id != user_id:
+            raise HTTPException(
+                status_code=403,
+                detail="file does not belong to the user"
+            )
+
+        file_data = FileSchema.model_validate(file)
+        full_path = file_data.full_path
+        trash_path = cls.get_trash_path(file_id, file_data.volume)
+
+        async with PathLock(str(full_path)) as lock:
+            if (
+                full_path.exists() or
+                await cls._file_exist_on_database(
+                    file_data.name, file_data.extension, file_data.directory, db
+                ) or
+                file_data.volume is not None and await cls._get_volume_file(
+                    file_data.name, file_data.extension, db
+                )
+            ):
+                raise HTTPException(status_code=409, detail="file exists")
+
+            async with OperationJournal.operation(
+                "move",
+                {"source": str(trash_path), "target": str(full_path)},
+                db
+            ):
+                try:
+                    await asyncio.to_thread(move_file, trash_path, full_path)
+
+                except FileNotFoundError:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="file was already purged from trash"
+                    )
+
+                await db.execute(
+                    update(FilesORM)
+                    .where(FilesORM.id == file_id)
+                    .values(deleted_at=None)
+                )
+                await FileChangesService.register_change(
+                    user_id, file_id, "created", db
+                )
+
+            await lock.commit(db)
+
+        return await cls.get_file_data(user_id, file_id, db)
+
     @staticmethod
     def _validate_old_and_new_path(
             old_path: Path,
@@ -270,11 +521,7 @@ class FileService:
 
         cls._validate_old_and_new_path(old_path, new_path)
 
-        new_directory = new_path.parent
-        new_directory.mkdir(parents=True, exist_ok=True)
-
-        shutil.copy2(old_path, new_path)
-        old_path.unlink()
+        move_file(old_path, new_path)
 
     @classmethod
     def _rename_file(
@@ -285,7 +532,9 @@ class FileService:
         """Переименовывает файл"""
 
         cls._validate_old_and_new_path(old_path, new_path)
-        old_path.rename(new_path)
+
+        with trace_io("rename", old_path):
+            old_path.rename(new_path)
 
     @classmethod
     async def update_file_data(
@@ -300,6 +549,8 @@ class FileService:
         file_data = await cls.get_file_data(user_id, file_id, db)
         full_path = file_data.full_path
 
+        await cls._validate_folder(user_id, data.folder_id, db)
+
         new_name = data.name or file_data.name
         new_path = Path(data.path) if data.path else file_data.path
         new_full_path = FileSchema.get_full_path(
@@ -307,92 +558,379 @@ class FileService:
             full_name=FileSchema.get_full_name(new_name, file_data.extension)
         )
 
-        try:
-            flag_name = file_data.name != new_name
-            flag_directory = full_path.parent != new_full_path.parent
+        flag_name = file_data.name != new_name
+        flag_directory = full_path.parent != new_full_path.parent
 
-            if flag_directory:
-                cls._move_file(full_path, new_full_path)
+        journal = OperationJournal.operation(
+            "move",
+            {"source": str(full_path), "target": str(new_full_path)},
+            db
+        ) if flag_name or flag_directory else nullcontext()
 
-            if flag_name and not flag_directory:
-                cls._rename_file(full_path, new_full_path)
+        async with PathLock(str(full_path), str(new_full_path)) as lock:
+            async with journal:
+                try:
+                    if flag_directory:
+                        cls._move_file(full_path, new_full_path)
 
-        except (FileNotFoundError, FileExistsError) as ex:
-            raise HTTPException(status_code=501, detail=str(ex))
+                    if flag_name and not flag_directory:
+                        cls._rename_file(full_path, new_full_path)
 
-        except (OSError, PermissionError):
-            raise HTTPException(status_code=501, detail="Couldn't move the file")
+                except (FileNotFoundError, FileExistsError) as ex:
+                    raise HTTPException(status_code=501, detail=str(ex))
 
-        except Exception:
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail="Something went wrong")
+                except (OSError, PermissionError):
+                    raise HTTPException(
+                        status_code=501,
+                        detail="Couldn't move the file"
+                    )
 
-        else:
-            await db.execute(
-                update(FilesORM)
-                .where(FilesORM.id == file_id)
-                .values(**data.model_dump(exclude_unset=True))
-            )
+                except HTTPException:
+                    raise
+
+                except Exception:
+                    traceback.print_exc()
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Something went wrong"
+                    )
+
+                values = data.model_dump(exclude_unset=True)
+
+                if flag_directory:
+                    values["volume"] = None  # Папку выбрал пользователь, том не переносит
+
+                try:
+                    await db.execute(
+                        update(FilesORM)
+                        .where(FilesORM.id == file_id)
+                        .values(**values)
+                    )
+
+                except IntegrityError as ex:
+                    if not is_unique_violation(ex):
+                        raise
+
+                    raise HTTPException(status_code=409, detail="file exists")
+
+                await FileChangesService.register_change(
+                    user_id, file_id, "updated", db
+                )
+
+            await lock.commit(db)
+
+        SignedUrlService.invalidate(file_id)
+        FileContentCache.invalidate(file_id)
 
         return ResponseOK()
 
+    @staticmethod
+    def _validate_copy_directory(directory: str) -> Path:
+        """
+            Проверяет директорию копии из запроса и возвращает ее
+
+            Директория должна лежать внутри корня одного из томов или
+                BASE_DIRECTORY, а служебные папки хранилища (.trash,
+                .thumbnails и другие скрытые) недоступны
+        """
+
+        path = Path(directory)
+
+        if path.is_absolute():
+            path = path.resolve()
+
+            for root in [Config.BASE_DIRECTORY, *(
+                x.root for x in VolumeService.get_volumes()
+            )]:
+                root = root.resolve()
+
+                if path.is_relative_to(root) and not any(
+                    x.startswith(".") for x in path.relative_to(root).parts
+                ):
+                    return path
+
+        raise HTTPException(
+            status_code=403,
+            detail="path is outside the storage"
+        )
+
+    @classmethod
+    async def copy_file(
+            cls,
+            user_id: int,
+            file_id: int,
+            data: FileCopyForm,
+            db: AsyncSession
+    ) -> FileSchema:
+        """
+            Создает копию файла на сервере, не передавая данные клиенту
+
+            Исходный файл блокируется вместе с копией и перечитывается
+                под блокировкой, поэтому размер и хэш копии в базе
+                соответствуют скопированному содержимому
+        """
+
+        file_data = await cls.get_file_data(user_id, file_id, db)
+
+        await cls._validate_folder(user_id, data.folder_id, db)
+
+        new_name = data.name or f"{file_data.name}_copy"
+        new_directory = cls._validate_copy_directory(data.path) \
+            if data.path else file_data.directory
+        new_full_path = FileSchema.get_full_path(
+            directory=new_directory,
+            full_name=FileSchema.get_full_name(new_name, file_data.extension)
+        )
+
+        async with PathLock(str(file_data.full_path), str(new_full_path)) as lock:
+            source = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id == file_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+                .execution_options(populate_existing=True)
+            )
+            source = source.first()
+
+            if source is None:
+                raise HTTPException(status_code=404, detail="file not found")
+
+            source = FileSchema.model_validate(source)
+
+            if source.full_path != file_data.full_path:
+                raise HTTPException(status_code=409, detail="file was changed")
+
+            file_data = source
+
+            async with OperationJournal.operation(
+                "copy",
+                {"target": str(new_full_path), "checksum": file_data.checksum},
+                db
+            ):
+                new_file = await cls._add_file_data(
+                    owner_id=user_id,
+                    file_data=cls._validate_new_file(
+                        name=new_name,
+                        extension=file_data.extension,
+                        size=file_data.size,
+                        path=str(new_directory),
+                        folder_id=data.folder_id
+                        if "folder_id" in data.model_fields_set
+                        else file_data.folder_id,
+                        checksum=file_data.checksum,
+                        volume=file_data.volume
+                        if new_directory == file_data.directory else None
+                    ),
+                    db=db
+                )
+
+                if new_file is None:
+                    raise HTTPException(status_code=409, detail="file exists")
+
+                try:
+                    await asyncio.to_thread(
+                        copy_file, file_data.full_path, new_full_path
+                    )
+
+                except FileExistsError:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="The file space is occupied"
+                    )
+
+                except FileNotFoundError:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="The file to be copied was not found"
+                    )
+
+                except OSError:
+                    raise HTTPException(
+                        status_code=501,
+                        detail="Couldn't copy the file"
+                    )
+
+                await FileChangesService.register_change(
+                    user_id, new_file.id, "created", db
+                )
+
+            await lock.commit(db)
+
+        ThumbnailService.enqueue(new_file)
+
+        return new_file
+
     @classmethod
     async def download_file(
             cls,
             user_id: int,
             file_id: int,
             db: AsyncSession
-    ) -> FileResponse:
-        """Возвращает файл для скачивания"""
+    ) -> Response:
+        """
+            Возвращает файл для скачивания, небольшие - из кэша в памяти.
+                Читается наименее загруженная копия файла
+        """
 
         file_data = await cls.get_file_data(user_id, file_id, db)
+        path, volume = await ReplicationService.choose_copy(file_data, db)
+
+        return await FileContentCache.response(file_data, path=path, volume=volume)
+
+    @staticmethod
+    async def get_files_data(db: AsyncSession) -> list[FileSchema]:
+        """Возвращает все файлы из базы данных, кроме удаленных в корзину"""
 
-        return FileResponse(
-            path=file_data.full_path,
-            filename=file_data.full_name
+        files = await db.scalars(
+            select(FilesORM)
+            .where(FilesORM.deleted_at.is_(None))
         )
 
+        return [FileSchema.model_validate(x) for x in files.all()]
+
     @classmethod
     async def files_initialization(cls) -> None:
-        """Инициализация файлов и дб"""
+        """
+            Инициализация файлов и дб
+
+            Сверяются корни всех томов. Файлы, найденные в хранилище без
+                записи в базе, записываются за пользователем
+                Config.ORPHANS_OWNER_ID, если он задан. Записям о файлах в корне
+                тома, сделанным до его подключения, проставляется том
+
+            Сверка идет параллельно с запросами, поэтому каждый файл
+                перепроверяется под PathLock, а запись удаляется, только если
+                она не менялась с начала сверки и файла по-прежнему нет.
+                Файлы недоступных томов не сверяются. Пропавший файл
+                восстанавливается с копии на другом томе, а если копии есть,
+                но недоступны, запись и копии остаются и файл отмечается
+                пропавшим в проблемах целостности
+        """
+
+        await asyncio.to_thread(VolumeService._measure, True)
 
         db = session_factory()
 
         try:
-            storage_files = list(Config.BASE_DIRECTORY.glob("*.*"))
-            db_files = [
-                {"file_id": x.id, "path": x.full_path}
-                for x in await cls.get_files_data(db)
-            ]
-            db_files_path = [x["path"] for x in db_files]
+            for volume in VolumeService.get_volumes():
+                duplicate = aliased(FilesORM)
+
+                await db.execute(
+                    update(FilesORM)
+                    .where(
+                        (FilesORM.path == str(volume.root))
+                        & FilesORM.volume.is_(None)
+                        & FilesORM.deleted_at.is_(None)
+                        & ~(
+                            select(duplicate.id)
+                            .where(
+                                (duplicate.name == FilesORM.name)
+                                & (duplicate.extension == FilesORM.extension)
+                                & duplicate.volume.isnot(None)
+                                & duplicate.deleted_at.is_(None)
+                            )
+                            .exists()
+                        )
+                    )
+                    .values(volume=volume.name)
+                )
+
+            await db.commit()
+
+            storage_files = {
+                x: volume.name
+                for volume in VolumeService.get_volumes()
+                for x in volume.root.glob("*.*")
+                if x.is_file() and not x.name.startswith(".")
+            }
+            db_files = await cls.get_files_data(db)
+            db_files_path = {x.full_path for x in db_files}
+            await db.commit()
 
             found_files = [x for x in storage_files if x not in db_files_path]
             # Файлы которые появились в хранилище
 
             for file_path in found_files:
-
-                name, extension = cls._split_file_name(file_path)
-                await cls._add_file_data(
-                    file_data=cls._validate_new_file(
-                        name=name,
-                        extension=extension,
-                        size=file_path.stat().st_size,
-                        path=str(Config.BASE_DIRECTORY)
-                    ),
-                    db=db
-                )
+                if Config.ORPHANS_OWNER_ID is None:
+                    break
+
+                try:
+                    async with PathLock(str(file_path)) as lock:
+                        if await asyncio.to_thread(file_path.is_file):
+                            name, extension = cls._split_file_name(file_path)
+                            new_file = await cls._add_file_data(
+                                owner_id=Config.ORPHANS_OWNER_ID,
+                                file_data=cls._validate_new_file(
+                                    name=name,
+                                    extension=extension,
+                                    size=file_path.stat().st_size,
+                                    path=str(file_path.parent),
+                                    volume=storage_files[file_path]
+                                ),
+                                db=db
+                            )
+
+                            if new_file is not None:
+                                await FileChangesService.register_change(
+                                    Config.ORPHANS_OWNER_ID, new_file.id, "created", db
+                                )
+
+                        await lock.commit(db)
+
+                except HTTPException:
+                    await db.rollback()  # Путь занят запросом, файл сверится в следующий раз
 
             files_not_found = [
-                x["file_id"]
+                x
                 for x in db_files
-                if not x["path"].exists()
+                if VolumeService.is_healthy(ReplicationService.get_primary(x)) and
+                not x.full_path.exists()
             ]
             # Файлы которые были удалены из хранилище
 
-            for file_id in files_not_found:
-                await cls._drop_file_data(file_id, db)
-
-            await db.commit()
+            for file in files_not_found:
+                try:
+                    async with PathLock(str(file.full_path)) as lock:
+                        # Пока шла сверка, файл могли переименовать, удалить или перенести
+                        unchanged = await db.scalar(
+                            select(FilesORM.id)
+                            .where(
+                                (FilesORM.id == file.id)
+                                & (FilesORM.path == file.path)
+                                & (FilesORM.name == file.name)
+                                & (FilesORM.extension == file.extension)
+                                & FilesORM.volume.is_not_distinct_from(file.volume)
+                                & FilesORM.deleted_at.is_(None)
+                            )
+                            .with_for_update()
+                        )
+
+                        missing = (
+                            unchanged is not None and
+                            not await asyncio.to_thread(file.full_path.exists)
+                        )
+
+                        if (
+                            missing and
+                            not await ReplicationService.restore_primary(file, db)
+                        ):
+                            if await ReplicationService.has_replicas(file.id, db):
+                                # Копии на недоступных томах еще могут вернуться
+                                await FileScrubber.save_issues(
+                                    {file.id: "missing"}, db
+                                )
+
+                            else:
+                                await cls._drop_file_data(file.id, db)
+                                await FileChangesService.register_change(
+                                    file.owner_id, file.id, "deleted", db
+                                )
+
+                        await lock.commit(db)
+
+                except HTTPException:
+                    await db.rollback()  # Путь занят запросом, файл сверится в следующий раз
 
         except:
             await db.rollback()
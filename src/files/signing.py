@@ -0,0 +1,218 @@
+import hmac
+import time
+import base64
+import hashlib
+import threading
+
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from sqlalchemy import select
+
+from config import SignedUrlConfig
+
+from .models import FilesORM
+from .schemas import FileSchema, SignedUrlSchema
+from .cache import FileContentCache
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter
+
+
+cache_requests = Counter(
+    "signed_url_cache_requests_total",
+    "Обращения к кэшу путей подписанных ссылок"
+)
+
+
+class SignedUrlService:
+    """
+        Подписанные ссылки на скачивание
+
+        Ссылка содержит идентификатор файла, срок действия, идентификатор
+            ключа (kid) и HMAC-SHA256 подпись, поэтому при скачивании не нужны
+            ни токен доступа, ни redis. Данные файла берутся из кэша процесса,
+            а база данных читается только при промахе. Кэш сбрасывается при
+            изменении и удалении файла, а в других процессах запись устаревает
+            через CACHE_TTL или когда файл по закэшированному пути уже не тот:
+            вместе с данными хранятся inode, размер и mtime файла, и при
+            расхождении, например когда путь занял файл другого пользователя,
+            данные читаются из базы заново
+    """
+
+    _cache: OrderedDict[
+        int, tuple[float, FileSchema, tuple[int, int, int]]
+    ] = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _sign(kid: str, file_id: int, expires: int) -> str:
+        key = SignedUrlConfig.KEYS[kid].encode()
+        digest = hmac.new(
+            key, f"{kid}.{file_id}.{expires}".encode(), hashlib.sha256
+        ).digest()
+
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    @classmethod
+    def create_url(
+            cls,
+            file_data: FileSchema,
+            ttl: int | None
+    ) -> SignedUrlSchema:
+        """Выдает подписанную ссылку на файл, владелец уже проверен"""
+
+        kid = SignedUrlConfig.CURRENT_KID
+
+        if kid is None:
+            raise HTTPException(
+                status_code=503,
+                detail="signed urls are not configured"
+            )
+
+        expires = int(time.time()) + min(
+            ttl or SignedUrlConfig.TTL, SignedUrlConfig.MAX_TTL
+        )
+        signature = cls._sign(kid, file_data.id, expires)
+
+        cls._remember(file_data)
+
+        return SignedUrlSchema(
+            url=f"/files/signed/{file_data.id}"
+                f"?expires={expires}&kid={kid}&signature={signature}",
+            expires_at=datetime.fromtimestamp(expires, timezone.utc)
+        )
+
+    @classmethod
+    def verify(
+            cls,
+            file_id: int,
+            expires: int,
+            kid: str,
+            signature: str
+    ) -> None:
+        """Проверяет подпись и срок действия ссылки"""
+
+        if kid not in SignedUrlConfig.KEYS or not hmac.compare_digest(
+            cls._sign(kid, file_id, expires), signature
+        ):
+            raise HTTPException(status_code=403, detail="invalid signature")
+
+        if expires < time.time():
+            raise HTTPException(status_code=410, detail="link expired")
+
+    @staticmethod
+    def _stat(file_data: FileSchema) -> tuple[int, int, int] | None:
+        """Возвращает inode, размер и mtime файла или None, если его нет"""
+
+        try:
+            stat = file_data.full_path.stat()
+
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def _remember(cls, file_data: FileSchema) -> None:
+        stat = cls._stat(file_data)
+
+        if stat is None:
+            return
+
+        with cls._lock:
+            cls._cache[file_data.id] = (time.monotonic(), file_data, stat)
+            cls._cache.move_to_end(file_data.id)
+
+            while len(cls._cache) > SignedUrlConfig.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, file_id: int) -> None:
+        """Убирает файл из кэша, вызывается при его изменении и удалении"""
+
+        with cls._lock:
+            cls._cache.pop(file_id, None)
+
+    @classmethod
+    def _cached(cls, file_id: int) -> FileSchema | None:
+        with cls._lock:
+            entry = cls._cache.get(file_id)
+
+            if entry is None:
+                return None
+
+            cached_at, file_data, stat = entry
+
+            if time.monotonic() - cached_at > SignedUrlConfig.CACHE_TTL:
+                del cls._cache[file_id]
+                return None
+
+            cls._cache.move_to_end(file_id)
+
+        if cls._stat(file_data) != stat:
+            cls.invalidate(file_id)
+            return None
+
+        return file_data
+
+    @classmethod
+    async def _resolve(cls, file_id: int) -> FileSchema:
+        """
+            Возвращает данные файла, при промахе кэша или если файл
+                по закэшированному пути изменился читает базу
+        """
+
+        cached = cls._cached(file_id)
+
+        if cached is not None:
+            cache_requests.inc(result="hit")
+            return cached
+
+        cache_requests.inc(result="miss")
+        db = session_factory()
+
+        try:
+            file = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id == file_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+            )
+            file = file.first()
+
+        finally:
+            await db.close()
+
+        if file is None:
+            cls.invalidate(file_id)
+            raise HTTPException(status_code=404, detail="file not found")
+
+        file_data = FileSchema.model_validate(file)
+        cls._remember(file_data)
+
+        return file_data
+
+    @classmethod
+    async def download(
+            cls,
+            file_id: int,
+            expires: int,
+            kid: str,
+            signature: str
+    ) -> Response:
+        """Отдает файл по подписанной ссылке"""
+
+        cls.verify(file_id, expires, kid, signature)
+        file_data = await cls._resolve(file_id)
+
+        return await FileContentCache.response(
+            file_data,
+            headers={
+                "Cache-Control":
+                    f"public, max-age={max(expires - int(time.time()), 0)}"
+            }
+        )
@@ -0,0 +1,197 @@
+import os
+import time
+import errno
+import hashlib
+import shutil
+import threading
+
+from pathlib import Path
+
+from ..profiling import traced_io
+
+try:
+    import fcntl
+except ImportError:  # не unix
+    fcntl = None
+
+
+FICLONE = 0x40049409  # ioctl для reflink копирования (btrfs, XFS)
+CHUNK_SIZE = 1024 * 1024  # Размер куска при обычном копировании
+
+
+class RateLimiter:
+    """
+        Ограничитель скорости ввода-вывода в байтах в секунду
+
+        Потокобезопасный: общий лимит делится между всеми потоками,
+            вызывающими consume
+    """
+
+    def __init__(self, bytes_per_second: float) -> None:
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        """Резервирует amount байт, при необходимости засыпая"""
+
+        if self.bytes_per_second <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_time, now)
+            self._next_time = start + amount / self.bytes_per_second
+
+        if start > now:
+            time.sleep(start - now)
+
+
+def _reflink(source_fd: int, target_fd: int) -> bool:
+    """Пытается сделать reflink копию, возвращает удалось ли"""
+
+    if fcntl is None:
+        return False
+
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+    except OSError:
+        return False
+
+    return True
+
+
+def _copy_file_range(
+        source_fd: int,
+        target_fd: int,
+        size: int,
+        limiter: RateLimiter | None = None
+) -> bool:
+    """Копирует данные внутри ядра, возвращает удалось ли"""
+
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    copied = 0
+
+    try:
+        while copied < size:
+            count = size - copied
+
+            if limiter is not None:
+                # Кусками, чтобы ограничение действовало на само чтение и запись
+                count = min(count, CHUNK_SIZE)
+                limiter.consume(count)
+
+            count = os.copy_file_range(source_fd, target_fd, count)
+
+            if count == 0:
+                break
+
+            copied += count
+
+    except OSError as ex:
+        if copied or ex.errno not in (
+            errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+            errno.EOPNOTSUPP, errno.EBADF
+        ):
+            raise
+
+        return False
+
+    return True
+
+
+def _copy_chunks(
+        source_fd: int,
+        target_fd: int,
+        limiter: RateLimiter | None = None
+) -> None:
+    """Копирует данные кусками через пользовательское пространство"""
+
+    while chunk := os.read(source_fd, CHUNK_SIZE):
+        if limiter is not None:
+            limiter.consume(len(chunk))
+
+        view = memoryview(chunk)
+
+        while view:
+            view = view[os.write(target_fd, view):]
+
+
+@traced_io("copy")
+def copy_file(
+        source: Path,
+        target: Path,
+        limiter: RateLimiter | None = None
+) -> None:
+    """
+        Копирует файл самым быстрым доступным способом:
+            reflink, copy_file_range, затем обычное копирование кусками
+
+        Целевой файл не должен существовать, иначе FileExistsError.
+            limiter ограничивает скорость по мере копирования кусков
+    """
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    source_fd = os.open(source, os.O_RDONLY)
+
+    try:
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+
+        try:
+            if not (
+                _reflink(source_fd, target_fd) or
+                _copy_file_range(
+                    source_fd, target_fd, os.fstat(source_fd).st_size, limiter
+                )
+            ):
+                _copy_chunks(source_fd, target_fd, limiter)
+
+        except BaseException:
+            os.close(target_fd)
+            target.unlink(missing_ok=True)
+            raise
+
+        os.close(target_fd)
+
+    finally:
+        os.close(source_fd)
+
+    shutil.copystat(source, target)
+
+
+@traced_io("hash")
+def hash_file(path: Path) -> tuple[int, str]:
+    """Возвращает размер и sha256 файла"""
+
+    checksum = hashlib.sha256()
+    size = 0
+
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            checksum.update(chunk)
+            size += len(chunk)
+
+    return size, checksum.hexdigest()
+
+
+@traced_io("move")
+def move_file(source: Path, target: Path) -> None:
+    """
+        Перемещает файл: переименованием в пределах одной файловой системы,
+            иначе быстрым копированием с удалением исходного файла
+    """
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        source.rename(target)
+
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+
+        copy_file(source, target)
+        source.unlink()
@@ -0,0 +1,244 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import traceback
+import subprocess
+
+from pathlib import Path
+from importlib.util import find_spec
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+
+from sqlalchemy import select
+
+from config import Config, ThumbnailConfig
+
+from .models import FilesORM
+from .schemas import FileSchema
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter
+
+THUMBNAILS_DIRECTORY = Config.BASE_DIRECTORY / ".thumbnails"
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "webp", "bmp", "tif", "tiff"}
+PDFTOPPM = shutil.which("pdftoppm")
+PILLOW = find_spec("PIL") is not None  # Без Pillow миниатюры изображений не делаются
+KINDS = {
+    "thumbnail": ThumbnailConfig.THUMBNAIL_SIZE,
+    "preview": ThumbnailConfig.PREVIEW_SIZE
+}  # Производные файла и наибольшая сторона каждой
+
+generated_files = Counter("thumbnails_generated_total", "Сгенерировано производных файлов")
+
+
+def _render_image(source: str, target: str, size: int) -> None:
+    # Pillow нужен только процессам пула, процесс приложения его не загружает
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image.draft("RGB", (size, size))  # JPEG сразу декодируется уменьшенным
+        image.thumbnail((size, size))
+        ImageOps.exif_transpose(image).convert("RGB").save(
+            target, "JPEG", quality=ThumbnailConfig.QUALITY, optimize=True
+        )
+
+
+def _render_pdf(source: str, target: str, size: int) -> None:
+    subprocess.run(
+        [
+            PDFTOPPM, "-jpeg", "-jpegopt", f"quality={ThumbnailConfig.QUALITY}",
+            "-f", "1", "-l", "1", "-singlefile", "-scale-to", str(size),
+            source, target.removesuffix(".jpg")
+        ],
+        check=True,
+        capture_output=True,
+        timeout=60
+    )
+
+
+def render(source: str, directory: str, version: int, extension: str) -> None:
+    """
+        Делает производные версии файла и удаляет производные прежних версий
+
+        Выполняется в пуле процессов
+    """
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    for kind, size in KINDS.items():
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".jpg")
+        os.close(fd)
+
+        try:
+            if extension == "pdf":
+                _render_pdf(source, temp_name, size)
+            else:
+                _render_image(source, temp_name, size)
+
+            os.replace(temp_name, directory / f"{version}-{kind}.jpg")
+
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+
+    for path in directory.iterdir():
+        prefix = path.name.split("-", 1)[0]
+
+        if prefix.isdigit() and int(prefix) < version:
+            path.unlink(missing_ok=True)
+
+
+class ThumbnailService:
+    """
+        Миниатюры и превью файлов
+
+        После фиксации загрузки или изменения файла генерация ставится
+            в фоновую очередь и выполняется в пуле процессов, одновременно
+            не больше WORKERS файлов. Производные лежат в
+            BASE_DIRECTORY/.thumbnails/{id}/{version}-{kind}.jpg, поэтому
+            новая версия файла получает новые, а не отданные из кэша клиента.
+            Если файла нет в очереди или она была переполнена, производные
+            делаются при первом запросе
+    """
+
+    _pool: ProcessPoolExecutor | None = None
+    _semaphore: asyncio.Semaphore | None = None
+    _tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def is_supported(file_data: FileSchema) -> bool:
+        """Можно ли сделать миниатюру файла"""
+
+        extension = file_data.extension.lower()
+
+        return file_data.size <= ThumbnailConfig.MAX_SOURCE_SIZE and (
+            (PILLOW and extension in IMAGE_EXTENSIONS) or
+            (PDFTOPPM is not None and extension == "pdf")
+        )
+
+    @staticmethod
+    def get_directory(file_id: int) -> Path:
+        return THUMBNAILS_DIRECTORY / str(file_id)
+
+    @classmethod
+    def get_path(cls, file_data: FileSchema, kind: str) -> Path:
+        return cls.get_directory(file_data.id) / f"{file_data.version}-{kind}.jpg"
+
+    @staticmethod
+    def get_etag(file_data: FileSchema, kind: str) -> str:
+        return f'"{file_data.id}-{file_data.version}-{kind}"'
+
+    @classmethod
+    async def generate(cls, file_data: FileSchema) -> None:
+        """Делает производные текущей версии файла в пуле процессов"""
+
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(max_workers=ThumbnailConfig.WORKERS)
+            cls._semaphore = asyncio.Semaphore(ThumbnailConfig.WORKERS)
+
+        async with cls._semaphore:
+            await asyncio.get_running_loop().run_in_executor(
+                cls._pool,
+                render,
+                str(file_data.full_path),
+                str(cls.get_directory(file_data.id)),
+                file_data.version,
+                file_data.extension.lower()
+            )
+
+        generated_files.inc(len(KINDS))
+
+    @classmethod
+    async def _generate_current(cls, file_id: int) -> None:
+        db = session_factory()
+
+        try:
+            file = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id == file_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+            )
+            file = file.first()
+
+        finally:
+            await db.close()
+
+        if file is None:
+            return
+
+        file_data = FileSchema.model_validate(file)
+
+        if not cls.get_path(file_data, "thumbnail").exists():
+            await cls.generate(file_data)
+
+    @classmethod
+    async def _run_queued(cls, file_id: int) -> None:
+        try:
+            await cls._generate_current(file_id)
+
+        except Exception:
+            traceback.print_exc()
+
+    @classmethod
+    def enqueue(cls, file_data: FileSchema) -> None:
+        """Ставит генерацию в очередь, вызывается после фиксации изменения файла"""
+
+        if (
+            not cls.is_supported(file_data) or
+            len(cls._tasks) >= ThumbnailConfig.QUEUE_SIZE
+        ):
+            return
+
+        task = asyncio.create_task(cls._run_queued(file_data.id))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    def remove(cls, file_id: int) -> None:
+        """Удаляет производные файла"""
+
+        shutil.rmtree(cls.get_directory(file_id), ignore_errors=True)
+
+    @classmethod
+    async def get_thumbnail(
+            cls,
+            file_data: FileSchema,
+            kind: str
+    ) -> FileResponse:
+        """Отдает производную файла, при необходимости делая ее"""
+
+        if not cls.is_supported(file_data):
+            raise HTTPException(
+                status_code=404,
+                detail="thumbnails are not available for this file"
+            )
+
+        path = cls.get_path(file_data, kind)
+
+        if not path.exists():
+            try:
+                await cls.generate(file_data)
+
+            except FileNotFoundError:
+                raise HTTPException(status_code=409, detail="file not found on storage")
+
+            except Exception:
+                traceback.print_exc()
+                raise HTTPException(
+                    status_code=422,
+                    detail="could not make a thumbnail of the file"
+                )
+
+        return FileResponse(
+            path=path,
+            media_type="image/jpeg",
+            headers={
+                "ETag": cls.get_etag(file_data, kind),
+                "Cache-Control": f"private, max-age={ThumbnailConfig.MAX_AGE}"
+            }
+        )
@@ -0,0 +1,130 @@
+import asyncio
+import traceback
+
+from pathlib import Path
+from datetime import timedelta
+
+from sqlalchemy import select, delete
+from sqlalchemy.sql import func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import TrashConfig
+
+from .models import FilesORM
+from .schemas import TrashedFileSchema
+from .services import FileService
+from .versions import VersionService
+from .replication import ReplicationService
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter
+
+
+purged_files = Counter("trash_purged_files_total", "Окончательно удалено файлов")
+
+
+class TrashService:
+    """
+        Корзина удаленных файлов
+
+        Удаленный файл лежит в .trash/{id} корня своего тома, а его запись
+            помечена deleted_at. По истечении срока хранения ведущий
+            экземпляр удаляет файлы и записи пачками с ограничением скорости
+    """
+
+    @staticmethod
+    async def get_trash(
+            user_id: int,
+            db: AsyncSession
+    ) -> list[TrashedFileSchema]:
+        """Возвращает файлы пользователя в корзине, начиная с последних"""
+
+        files = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.owner_id == user_id)
+                & FilesORM.deleted_at.isnot(None)
+            )
+            .order_by(FilesORM.deleted_at.desc())
+        )
+
+        return [TrashedFileSchema.model_validate(x) for x in files.all()]
+
+    @staticmethod
+    def _purge_files(files: list[tuple[int, str, str | None]]) -> None:
+        """Удаляет файлы из корзины и опустевшие папки, где они лежали"""
+
+        for file_id, path, volume in files:
+            FileService.get_trash_path(file_id, volume).unlink(missing_ok=True)
+
+            directory = Path(path)
+            FileService._delete_directorys(directory, directory.anchor)
+
+    @classmethod
+    async def purge_batch(cls) -> int:
+        """
+            Окончательно удаляет очередную пачку просроченных файлов
+
+            Файлы удаляются до записей, поэтому прерванная очистка
+                повторится на следующем шаге. Возвращает размер пачки
+        """
+
+        db = session_factory()
+
+        try:
+            files = await db.execute(
+                select(FilesORM.id, FilesORM.path, FilesORM.volume)
+                .where(
+                    FilesORM.deleted_at <
+                    func.now() - timedelta(days=TrashConfig.RETENTION_DAYS)
+                )
+                .order_by(FilesORM.deleted_at)
+                .limit(TrashConfig.PURGE_BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            files = files.tuples().all()
+
+            if not files:
+                return 0
+
+            await asyncio.to_thread(cls._purge_files, files)
+
+            await VersionService.release_files([x[0] for x in files], db)
+            await ReplicationService.release_files([x[0] for x in files], db)
+            await db.execute(
+                delete(FilesORM)
+                .where(FilesORM.id.in_([x[0] for x in files]))
+            )
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        purged_files.inc(len(files))
+
+        return len(files)
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Очищает корзину, выдерживая TrashConfig.PURGE_RATE удалений
+                в секунду, и делает паузу, когда просроченных файлов нет
+
+            Запускается только на ведущем экземпляре
+        """
+
+        while True:
+            try:
+                purged = await cls.purge_batch()
+
+            except Exception:
+                traceback.print_exc()
+                purged = 0
+
+            if purged:
+                await asyncio.sleep(purged / TrashConfig.PURGE_RATE)
+            else:
+                await asyncio.sleep(TrashConfig.PURGE_INTERVAL)
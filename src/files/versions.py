@@ -0,0 +1,583 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import tempfile
+import traceback
+import time
+
+from typing import AsyncIterator
+from pathlib import Path
+from datetime import timedelta
+from collections import Counter as CountMap
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config, VersioningConfig
+
+from .models import FilesORM, FileVersionsORM, FileChunksORM, \
+    FileVersionChunksORM
+from .schemas import FileSchema, FileVersionSchema
+from .changes import FileChangesService
+from .journal import OperationJournal
+from .signing import SignedUrlService
+from .cache import FileContentCache
+from ..databases.sqlalchemy import session_factory
+from ..profiling import traced_io, trace_io
+from ..metrics import Counter
+
+
+CHUNKS_DIRECTORY = Config.BASE_DIRECTORY / ".chunks"
+
+SWEEP_DIRECTORIES = 16  # Папок .chunks, проверяемых за один шаг очистки
+
+stored_chunks = Counter("version_chunks_total", "Куски версий по результату записи")
+
+
+def chunk_path(chunk_hash: str) -> Path:
+    """Расположение куска в хранилище"""
+
+    return CHUNKS_DIRECTORY / chunk_hash[:2] / chunk_hash
+
+
+def _write_chunk(chunk_hash: str, data: bytes) -> None:
+    """Атомарно записывает кусок, если его еще нет"""
+
+    path = chunk_path(chunk_hash)
+
+    if path.exists():
+        stored_chunks.inc(result="reused")
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix=".chunk")
+
+    with os.fdopen(fd, "wb") as temp_file:
+        temp_file.write(data)
+
+    os.replace(temp_name, path)
+    stored_chunks.inc(result="written")
+
+
+@traced_io("chunk")
+def store_chunks(path: Path) -> list[tuple[str, int]]:
+    """
+        Делит файл на куски фиксированного размера и записывает
+            отсутствующие в хранилище. Возвращает хэши и размеры кусков
+    """
+
+    chunks = []
+
+    with open(path, "rb") as file:
+        while data := file.read(VersioningConfig.CHUNK_SIZE):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            _write_chunk(chunk_hash, data)
+            chunks.append((chunk_hash, len(data)))
+
+    return chunks
+
+
+@traced_io("chunk")
+def ensure_chunks(path: Path, chunks: list[tuple[str, int]]) -> None:
+    """
+        Дописывает куски, удаленные очисткой между записью и фиксацией
+            ссылок на них в базе
+    """
+
+    with open(path, "rb") as file:
+        for position, (chunk_hash, size) in enumerate(chunks):
+            if not chunk_path(chunk_hash).exists():
+                file.seek(position * VersioningConfig.CHUNK_SIZE)
+                _write_chunk(chunk_hash, file.read(size))
+
+
+def list_unreferenced(directory: Path) -> tuple[dict[str, int], list[Path]]:
+    """
+        Возвращает куски папки хранилища старше CHUNK_GRACE с их размерами
+            и оставшиеся от прерванной записи временные файлы
+    """
+
+    deadline = time.time() - VersioningConfig.CHUNK_GRACE
+    chunks, temp_files = {}, []
+
+    try:
+        entries = list(os.scandir(directory))
+
+    except FileNotFoundError:
+        return chunks, temp_files
+
+    for entry in entries:
+        stat = entry.stat()
+
+        if stat.st_mtime > deadline:
+            continue
+
+        if entry.name.endswith(".chunk"):
+            temp_files.append(Path(entry.path))
+        else:
+            chunks[entry.name] = stat.st_size
+
+    return chunks, temp_files
+
+
+class VersionService:
+    """
+        Версии файлов
+
+        Текущая версия лежит в хранилище обычным файлом, а предыдущие
+            хранятся кусками фиксированного размера в BASE_DIRECTORY/.chunks,
+            адресуемыми по sha256. Одинаковые куски разных версий и файлов
+            хранятся один раз, file_chunks.refcount считает ссылки на них,
+            а куски без ссылок удаляет фоновая очистка. Куски, записанные
+            архивацией, чья транзакция откатилась, не имеют строки в базе:
+            очистка по кругу обходит папки .chunks и заводит для таких
+            кусков старше CHUNK_GRACE строку с нулем ссылок
+
+        Кусок сначала получает ссылку в базе и только потом проверяется
+            его наличие на диске, поэтому очистка, удаляющая кусок под
+            блокировкой строки, не может удалить уже используемый
+    """
+
+    _sweep_position = 0  # Следующая папка .chunks для проверки
+
+    @staticmethod
+    async def _add_chunks(
+            chunks: list[tuple[str, int]],
+            db: AsyncSession
+    ) -> None:
+        """Увеличивает число ссылок на куски, создавая новые"""
+
+        counts = CountMap(x for x, _ in chunks)
+        sizes = dict(chunks)
+
+        # Порядок по хэшу, чтобы встречные транзакции не ждали друг друга
+        statement = insert(FileChunksORM).values([
+            {"hash": x, "size": sizes[x], "refcount": counts[x]}
+            for x in sorted(counts)
+        ])
+
+        await db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[FileChunksORM.hash],
+                set_={
+                    "refcount":
+                        FileChunksORM.refcount + statement.excluded.refcount
+                }
+            )
+        )
+
+    @classmethod
+    async def archive(
+            cls,
+            file_data: FileSchema,
+            db: AsyncSession
+    ) -> None:
+        """
+            Сохраняет текущее содержимое файла как версию file_data.version
+
+            Вызывается перед подменой файла в той же транзакции
+        """
+
+        try:
+            chunks = await asyncio.to_thread(store_chunks, file_data.full_path)
+
+        except FileNotFoundError:
+            raise HTTPException(status_code=409, detail="file not found on storage")
+
+        if chunks:
+            await cls._add_chunks(chunks, db)
+
+        version_id = await db.scalar(
+            insert(FileVersionsORM)
+            .values(
+                file_id=file_data.id,
+                version=file_data.version,
+                size=sum(x for _, x in chunks),
+                checksum=file_data.checksum
+            )
+            .returning(FileVersionsORM.id)
+        )
+
+        if chunks:
+            await db.execute(
+                insert(FileVersionChunksORM),
+                [
+                    {"version_id": version_id, "position": i, "chunk_hash": x}
+                    for i, (x, _) in enumerate(chunks)
+                ]
+            )
+            await asyncio.to_thread(ensure_chunks, file_data.full_path, chunks)
+
+    @staticmethod
+    async def _release(
+            version_ids: list[int],
+            db: AsyncSession
+    ) -> None:
+        """Удаляет версии, уменьшая число ссылок на их куски"""
+
+        if not version_ids:
+            return
+
+        usage = (
+            select(
+                FileVersionChunksORM.chunk_hash,
+                func.count().label("uses")
+            )
+            .where(FileVersionChunksORM.version_id.in_(version_ids))
+            .group_by(FileVersionChunksORM.chunk_hash)
+            .subquery()
+        )
+
+        await db.execute(
+            update(FileChunksORM)
+            .where(FileChunksORM.hash == usage.c.chunk_hash)
+            .values(refcount=FileChunksORM.refcount - usage.c.uses)
+        )
+        await db.execute(
+            delete(FileVersionsORM)
+            .where(FileVersionsORM.id.in_(version_ids))
+        )
+
+    @classmethod
+    async def release_files(
+            cls,
+            file_ids: list[int],
+            db: AsyncSession
+    ) -> None:
+        """Удаляет все версии файлов перед удалением их записей"""
+
+        version_ids = await db.scalars(
+            select(FileVersionsORM.id)
+            .where(FileVersionsORM.file_id.in_(file_ids))
+        )
+
+        await cls._release(version_ids.all(), db)
+
+    @classmethod
+    async def apply_retention(
+            cls,
+            file_id: int,
+            db: AsyncSession
+    ) -> None:
+        """Удаляет версии файла сверх MAX_VERSIONS и старше MAX_AGE_DAYS"""
+
+        condition = FileVersionsORM.id.in_(
+            select(FileVersionsORM.id)
+            .where(FileVersionsORM.file_id == file_id)
+            .order_by(FileVersionsORM.version.desc())
+            .offset(VersioningConfig.MAX_VERSIONS)
+        )
+
+        if VersioningConfig.MAX_AGE_DAYS:
+            condition |= (
+                (FileVersionsORM.file_id == file_id)
+                & (
+                    FileVersionsORM.created_at <
+                    func.now() - timedelta(days=VersioningConfig.MAX_AGE_DAYS)
+                )
+            )
+
+        version_ids = await db.scalars(select(FileVersionsORM.id).where(condition))
+
+        await cls._release(version_ids.all(), db)
+
+    @classmethod
+    async def replace_content(
+            cls,
+            user_id: int,
+            name: str,
+            extension: str,
+            full_path: Path,
+            content: bytes,
+            checksum: str,
+            db: AsyncSession
+    ) -> FileSchema:
+        """
+            Загружает новую версию существующего файла и возвращает его
+
+            Путь уже заблокирован вызывающим. Текущее содержимое
+                сохраняется версией, а файл атомарно подменяется новым
+        """
+
+        file = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.path == str(full_path.parent))
+                & (FilesORM.name == name)
+                & (FilesORM.extension == extension)
+                & FilesORM.deleted_at.is_(None)
+            )
+            .with_for_update()
+        )
+        file = file.first()
+
+        if file is None or file.owner_id != user_id:
+            raise HTTPException(status_code=409, detail="file exists")
+
+        file_data = FileSchema.model_validate(file)
+
+        if file_data.checksum == checksum:
+            return file_data
+
+        temp_path = full_path.with_name(
+            f".{full_path.name}.{uuid.uuid4().hex}.upload"
+        )
+
+        async with OperationJournal.operation(
+            "replace",
+            {"file_id": file_data.id, "path": str(full_path), "temp": str(temp_path)},
+            db
+        ):
+            with trace_io("write", temp_path):
+                await asyncio.to_thread(temp_path.write_bytes, content)
+
+            await cls.archive(file_data, db)
+
+            with trace_io("replace", full_path):
+                os.replace(temp_path, full_path)
+
+            await db.execute(
+                update(FilesORM)
+                .where(FilesORM.id == file_data.id)
+                .values(
+                    size=len(content),
+                    checksum=checksum,
+                    version=FilesORM.version + 1
+                )
+            )
+            await cls.apply_retention(file_data.id, db)
+            await FileChangesService.register_change(
+                user_id, file_data.id, "updated", db
+            )
+
+        SignedUrlService.invalidate(file_data.id)
+        FileContentCache.invalidate(file_data.id)
+
+        return file_data.model_copy(update={
+            "size": len(content),
+            "checksum": checksum,
+            "version": file_data.version + 1
+        })
+
+    @staticmethod
+    async def _get_file(
+            user_id: int,
+            file_id: int,
+            db: AsyncSession
+    ) -> FileSchema:
+        file = await db.scalars(
+            select(FilesORM)
+            .where(
+                (FilesORM.id == file_id)
+                & FilesORM.deleted_at.is_(None)
+            )
+        )
+        file = file.first()
+
+        if file is None:
+            raise HTTPException(status_code=404, detail="file not found")
+
+        if file.owner_id != user_id:
+            raise HTTPException(
+                status_code=403,
+                detail="file does not belong to the user"
+            )
+
+        return FileSchema.model_validate(file)
+
+    @classmethod
+    async def get_versions(
+            cls,
+            user_id: int,
+            file_id: int,
+            db: AsyncSession
+    ) -> list[FileVersionSchema]:
+        """Возвращает сохраненные версии файла, начиная с последней"""
+
+        await cls._get_file(user_id, file_id, db)
+
+        versions = await db.scalars(
+            select(FileVersionsORM)
+            .where(FileVersionsORM.file_id == file_id)
+            .order_by(FileVersionsORM.version.desc())
+        )
+
+        return [FileVersionSchema.model_validate(x) for x in versions.all()]
+
+    @staticmethod
+    async def _iter_chunks(chunk_hashes: list[str]) -> AsyncIterator[bytes]:
+        for chunk_hash in chunk_hashes:
+            yield await asyncio.to_thread(chunk_path(chunk_hash).read_bytes)
+
+    @classmethod
+    async def download_version(
+            cls,
+            user_id: int,
+            file_id: int,
+            version: int,
+            db: AsyncSession
+    ) -> StreamingResponse:
+        """Отдает сохраненную версию файла, собирая ее из кусков"""
+
+        file_data = await cls._get_file(user_id, file_id, db)
+
+        file_version = await db.scalars(
+            select(FileVersionsORM)
+            .where(
+                (FileVersionsORM.file_id == file_id)
+                & (FileVersionsORM.version == version)
+            )
+        )
+        file_version = file_version.first()
+
+        if file_version is None:
+            raise HTTPException(status_code=404, detail="version not found")
+
+        chunk_hashes = await db.scalars(
+            select(FileVersionChunksORM.chunk_hash)
+            .where(FileVersionChunksORM.version_id == file_version.id)
+            .order_by(FileVersionChunksORM.position)
+        )
+
+        return StreamingResponse(
+            cls._iter_chunks(chunk_hashes.all()),
+            media_type="application/octet-stream",
+            headers={
+                "Content-Length": str(file_version.size),
+                "Content-Disposition":
+                    f'attachment; filename="{file_data.name}.v{version}'
+                    f'.{file_data.extension}"'
+            }
+        )
+
+    @classmethod
+    async def cleanup_batch(cls) -> int:
+        """
+            Удаляет пачку версий старше MAX_AGE_DAYS и пачку
+                кусков без ссылок. Возвращает количество удаленного
+        """
+
+        db = session_factory()
+
+        try:
+            version_ids = []
+
+            if VersioningConfig.MAX_AGE_DAYS:
+                version_ids = await db.scalars(
+                    select(FileVersionsORM.id)
+                    .where(
+                        FileVersionsORM.created_at <
+                        func.now() - timedelta(days=VersioningConfig.MAX_AGE_DAYS)
+                    )
+                    .limit(VersioningConfig.BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+                version_ids = version_ids.all()
+
+                await cls._release(version_ids, db)
+                await db.commit()
+
+            chunk_hashes = await db.scalars(
+                select(FileChunksORM.hash)
+                .where(FileChunksORM.refcount <= 0)
+                .limit(VersioningConfig.BATCH_SIZE)
+                .with_for_update(skip_locked=True)
+            )
+            chunk_hashes = chunk_hashes.all()
+
+            for chunk_hash in chunk_hashes:
+                await asyncio.to_thread(
+                    chunk_path(chunk_hash).unlink, missing_ok=True
+                )
+
+            await db.execute(
+                delete(FileChunksORM)
+                .where(FileChunksORM.hash.in_(chunk_hashes))
+            )
+            await db.commit()
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+        return len(version_ids) + len(chunk_hashes)
+
+    @classmethod
+    async def sweep_batch(cls) -> int:
+        """
+            Заводит строки с нулем ссылок для кусков очередных папок
+                хранилища, о которых не знает база, чтобы их удалила
+                обычная очистка. Возвращает количество таких кусков
+
+            Архивация, начавшаяся после этого, увеличит счетчик строки,
+                а если очистка уже удалила кусок, ensure_chunks допишет его
+        """
+
+        found = 0
+
+        for _ in range(SWEEP_DIRECTORIES):
+            directory = CHUNKS_DIRECTORY / f"{cls._sweep_position:02x}"
+            cls._sweep_position = (cls._sweep_position + 1) % 256
+
+            chunks, temp_files = await asyncio.to_thread(
+                list_unreferenced, directory
+            )
+
+            for temp_file in temp_files:
+                await asyncio.to_thread(temp_file.unlink, missing_ok=True)
+
+            hashes = sorted(chunks)
+
+            for start in range(0, len(hashes), VersioningConfig.BATCH_SIZE):
+                batch = hashes[start:start + VersioningConfig.BATCH_SIZE]
+
+                db = session_factory()
+
+                try:
+                    result = await db.execute(
+                        insert(FileChunksORM)
+                        .values([
+                            {"hash": x, "size": chunks[x], "refcount": 0}
+                            for x in batch
+                        ])
+                        .on_conflict_do_nothing()
+                    )
+                    await db.commit()
+
+                except:
+                    await db.rollback()
+                    raise
+
+                finally:
+                    await db.close()
+
+                found += result.rowcount
+
+        return found
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Очищает устаревшие версии и неиспользуемые куски
+
+            Запускается только на ведущем экземпляре
+        """
+
+        while True:
+            try:
+                cleaned = await cls.cleanup_batch() + await cls.sweep_batch()
+
+            except Exception:
+                traceback.print_exc()
+                cleaned = 0
+
+            await asyncio.sleep(0 if cleaned else VersioningConfig.INTERVAL)
@@ -0,0 +1,400 @@
+import time
+import uuid
+import shutil
+import asyncio
+import traceback
+
+from typing import Iterator
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+
+from sqlalchemy import select, update
+
+from config import Config, VolumeConfig
+
+from .models import FilesORM
+from .schemas import FileSchema
+from .changes import FileChangesService
+from .journal import OperationJournal
+from .storage import RateLimiter, copy_file
+from ..coordination import PathLock
+from ..databases.sqlalchemy import session_factory
+from ..metrics import Counter, Gauge
+
+
+MB = 1024 * 1024
+
+volume_free_bytes = Gauge("volume_free_bytes", "Свободное место на томе")
+volume_inflight = Gauge(
+    "volume_inflight_operations",
+    "Выполняемые процессом операции ввода-вывода с томом"
+)
+rebalanced_files = Counter("rebalance_moved_files_total", "Перенесено файлов между томами")
+rebalanced_bytes = Counter("rebalance_moved_bytes_total", "Перенесено байт между томами")
+
+
+@dataclass
+class Volume:
+    """Корень хранилища на отдельном диске"""
+
+    name: str
+    root: Path
+    weight: float
+    free: int = 0  # Свободно байт на последнем замере
+    total: int = 0  # Размер диска
+    checked_at: float = float("-inf")  # Время последнего замера
+    inflight: int = 0  # Операций с томом в процессе
+    healthy: bool = True  # Удался ли последний замер
+
+    @property
+    def used_fraction(self) -> float:
+        """Доля занятого места"""
+
+        return 1 - self.free / self.total if self.total else 1.0
+
+
+class VolumeFileResponse(FileResponse):
+    """FileResponse, учитывающий отдачу файла в очереди тома"""
+
+    def __init__(self, *args, volume: str | None = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.volume = volume
+
+    async def __call__(self, scope, receive, send) -> None:
+        with VolumeService.io(self.volume):
+            await super().__call__(scope, receive, send)
+
+
+class VolumeService:
+    """
+        Размещение файлов по нескольким корням хранилища
+
+        Загружаемый файл кладется в корень тома с наибольшим
+            free * weight / (1 + inflight) среди томов, где после записи
+            останется MIN_FREE_MB. Место замеряется не чаще USAGE_TTL,
+            а inflight - текущая очередь операций процесса с томом
+
+        Ведущий экземпляр переносит файлы с самого заполненного тома
+            на самый свободный, пока их заполненность отличается больше
+            чем на REBALANCE_THRESHOLD. Переносятся только файлы из корней
+            томов, файлы в выбранных пользователем папках не трогаются.
+            Файл сначала копируется в .rebalance на целевом томе, поэтому
+            блокировки держатся только на время переименования
+    """
+
+    _volumes: dict[str, Volume] = {
+        name: Volume(name, root, weight)
+        for name, (root, weight) in VolumeConfig.ROOTS.items()
+    }
+    _limiter: RateLimiter | None = None
+
+    @classmethod
+    def get_volumes(cls) -> list[Volume]:
+        return list(cls._volumes.values())
+
+    @classmethod
+    def get_volume(cls, name: str | None) -> Volume | None:
+        return cls._volumes.get(name) if name else None
+
+    @classmethod
+    def find_volume(cls, path: Path) -> str | None:
+        """Возвращает том, внутри корня которого лежит путь"""
+
+        for volume in cls._volumes.values():
+            if path.is_relative_to(volume.root):
+                return volume.name
+
+        return None
+
+    @classmethod
+    def is_healthy(cls, name: str | None) -> bool:
+        volume = cls.get_volume(name)
+
+        return volume is None or volume.healthy
+
+    @classmethod
+    def get_inflight(cls, name: str | None) -> int:
+        volume = cls.get_volume(name)
+
+        return volume.inflight if volume else 0
+
+    @classmethod
+    def is_root(cls, path: Path) -> bool:
+        """Является ли путь корнем тома или базовой папкой"""
+
+        return path == Config.BASE_DIRECTORY or any(
+            path == x.root for x in cls._volumes.values()
+        )
+
+    @classmethod
+    def get_trash_directory(cls, name: str | None) -> Path:
+        """Корзина на том же диске, что и файл, чтобы удаление было переименованием"""
+
+        volume = cls.get_volume(name)
+
+        return (volume.root if volume else Config.BASE_DIRECTORY) / ".trash"
+
+    @classmethod
+    def _measure(cls, force: bool = False) -> None:
+        now = time.monotonic()
+
+        for volume in cls._volumes.values():
+            if force or now - volume.checked_at > VolumeConfig.USAGE_TTL:
+                try:
+                    usage = shutil.disk_usage(volume.root)
+                    volume.free, volume.total = usage.free, usage.total
+                    volume.healthy = True
+
+                except OSError:
+                    volume.free, volume.total = 0, 0
+                    volume.healthy = False
+
+                volume.checked_at = now
+                volume_free_bytes.set(volume.free, volume=volume.name)
+
+    @classmethod
+    async def place(cls, size: int) -> Volume:
+        """Выбирает том для нового файла размером size"""
+
+        await asyncio.to_thread(cls._measure)
+
+        candidates = [
+            x for x in cls._volumes.values()
+            if x.free - size >= VolumeConfig.MIN_FREE_MB * MB
+        ]
+
+        if not candidates:
+            raise HTTPException(status_code=507, detail="insufficient storage")
+
+        volume = max(candidates, key=lambda x: x.free * x.weight / (1 + x.inflight))
+        volume.free -= size  # До следующего замера учитываем запись сразу
+
+        return volume
+
+    @classmethod
+    @contextmanager
+    def io(cls, name: str | None) -> Iterator[None]:
+        """Учитывает операцию с томом в его очереди"""
+
+        volume = cls.get_volume(name)
+
+        if volume is None:
+            yield
+            return
+
+        volume.inflight += 1
+        volume_inflight.set(volume.inflight, volume=volume.name)
+
+        try:
+            yield
+
+        finally:
+            volume.inflight -= 1
+            volume_inflight.set(volume.inflight, volume=volume.name)
+
+    @classmethod
+    def get_staging_directory(cls, name: str) -> Path:
+        """Папка тома для копий, которые еще переносятся на него"""
+
+        return cls.get_volume(name).root / ".rebalance"
+
+    @staticmethod
+    def _transfer(temp_path: Path, source: Path, target: Path) -> None:
+        """Ставит готовую копию на место файла и удаляет исходный"""
+
+        if target.exists():
+            raise FileExistsError(target)
+
+        temp_path.rename(target)
+        source.unlink()
+
+    @classmethod
+    async def _move(cls, file_id: int, target: Volume) -> bool:
+        """
+            Переносит файл из корня его тома в корень target
+
+            Содержимое копируется во временный файл на target без блокировок
+                и с ограничением скорости, а под PathLock и блокировкой строки
+                остаются только переименование и запись в базу
+        """
+
+        db = session_factory()
+        temp_path = None
+        moved = False
+
+        try:
+            file = await db.scalars(
+                select(FilesORM)
+                .where(
+                    (FilesORM.id == file_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+            )
+            file = file.first()
+
+            if file is None or file.volume is None or file.volume == target.name:
+                return False
+
+            file_data = FileSchema.model_validate(file)
+            source_path = file_data.full_path
+            target_path = target.root / file_data.full_name
+            temp_path = (
+                cls.get_staging_directory(target.name) /
+                f"{file_id}.{uuid.uuid4().hex}"
+            )
+
+            await db.commit()  # Транзакция не держится открытой во время копирования
+
+            try:
+                with cls.io(file_data.volume), cls.io(target.name):
+                    await asyncio.to_thread(
+                        copy_file, source_path, temp_path, cls._limiter
+                    )
+
+            except FileNotFoundError:
+                return False  # Файл удалили или переместили
+
+            async with PathLock(str(source_path), str(target_path)) as lock:
+                async with OperationJournal.operation(
+                    "move",
+                    {
+                        "source": str(source_path),
+                        "target": str(target_path),
+                        "checksum": file_data.checksum
+                    },
+                    db
+                ):
+                    # Пока копировали, файл могли изменить, переместить или удалить
+                    file = await db.scalars(
+                        select(FilesORM.id)
+                        .where(
+                            (FilesORM.id == file_id)
+                            & (FilesORM.path == file_data.path)
+                            & (FilesORM.volume == file_data.volume)
+                            & (FilesORM.version == file_data.version)
+                            & FilesORM.deleted_at.is_(None)
+                        )
+                        .with_for_update()
+                    )
+                    moved = file.first() is not None
+
+                    if moved:
+                        await asyncio.to_thread(
+                            cls._transfer, temp_path, source_path, target_path
+                        )
+                        await db.execute(
+                            update(FilesORM)
+                            .where(FilesORM.id == file_id)
+                            .values(path=str(target.root), volume=target.name)
+                        )
+                        await FileChangesService.register_change(
+                            file_data.owner_id, file_id, "updated", db
+                        )
+
+                await lock.commit(db)
+
+        except:
+            await db.rollback()
+            raise
+
+        finally:
+            await db.close()
+
+            if temp_path is not None:
+                await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+
+        if moved:
+            rebalanced_files.inc()
+            rebalanced_bytes.inc(file_data.size)
+
+        return moved
+
+    @classmethod
+    async def rebalance_batch(cls) -> int:
+        """
+            Переносит пачку файлов с самого заполненного тома на самый
+                свободный. Возвращает количество перенесенных файлов
+        """
+
+        await asyncio.to_thread(cls._measure, True)
+
+        volumes = sorted(cls._volumes.values(), key=lambda x: x.used_fraction)
+
+        if len(volumes) < 2:
+            return 0
+
+        target, source = volumes[0], volumes[-1]
+        gap = source.used_fraction - target.used_fraction
+
+        if gap < VolumeConfig.REBALANCE_THRESHOLD:
+            return 0
+
+        # Файл крупнее половины разницы перевернул бы перекос
+        excess = int(gap / 2 * min(source.total, target.total))
+
+        db = session_factory()
+
+        try:
+            files = await db.execute(
+                select(FilesORM.id, FilesORM.size)
+                .where(
+                    (FilesORM.volume == source.name)
+                    & (FilesORM.size <= excess)
+                    & FilesORM.deleted_at.is_(None)
+                )
+                .order_by(FilesORM.size.desc())
+                .limit(VolumeConfig.REBALANCE_BATCH_SIZE)
+            )
+            files = files.tuples().all()
+
+        finally:
+            await db.close()
+
+        moved = 0
+
+        for file_id, size in files:
+            if size > excess or target.free - size < VolumeConfig.MIN_FREE_MB * MB:
+                continue
+
+            try:
+                if await cls._move(file_id, target):
+                    moved += 1
+                    excess -= size
+                    target.free -= size
+
+            except Exception:
+                traceback.print_exc()
+
+        return moved
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+            Выравнивает заполненность томов с ограничением скорости
+                REBALANCE_RATE_MB
+
+            Запускается только на ведущем экземпляре
+        """
+
+        cls._limiter = RateLimiter(VolumeConfig.REBALANCE_RATE_MB * MB)
+
+        # Копии, недоделанные прежним ведущим
+        for volume in cls._volumes.values():
+            await asyncio.to_thread(
+                shutil.rmtree, cls.get_staging_directory(volume.name),
+                ignore_errors=True
+            )
+
+        while True:
+            try:
+                moved = await cls.rebalance_batch()
+
+            except Exception:
+                traceback.print_exc()
+                moved = 0
+
+            await asyncio.sleep(0 if moved else VolumeConfig.REBALANCE_INTERVAL)
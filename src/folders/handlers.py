@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, Body, Path, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .schemas import FolderSchema, FolderCreateForm, FolderUpdateForm, \
+    FolderSizeSchema
+from .services import FolderService
+from ..auth.services import get_user_id
+from ..databases.sqlalchemy import get_db
+from ..files.schemas import FileSchema
+from ..base_response import ResponseOK
+
+
+folders_router = APIRouter()
+
+
+@folders_router.get("/my", response_model=list[FolderSchema])
+async def get_my_folders(
+        user_id: int = Depends(get_user_id),
+        db: AsyncSession = Depends(get_db)
+) -> list[FolderSchema]:
+    """Возвращает папки текущего пользователя"""
+
+    return await FolderService.get_my_folders(user_id, db)
+
+
+@folders_router.post("/", response_model=FolderSchema)
+async def create_folder(
+        user_id: int = Depends(get_user_id),
+        create_form: FolderCreateForm = Body(...),
+        db: AsyncSession = Depends(get_db)
+) -> FolderSchema:
+    """Создает папку"""
+
+    return await FolderService.create_folder(user_id, create_form, db)
+
+
+@folders_router.get("/{folder_id}", response_model=FolderSchema)
+async def get_folder(
+        user_id: int = Depends(get_user_id),
+        folder_id: int = Path(...),
+        db: AsyncSession = Depends(get_db)
+) -> FolderSchema:
+    """Возвращает папку"""
+
+    return await FolderService.get_folder(user_id, folder_id, db)
+
+
+@folders_router.put("/{folder_id}", response_model=ResponseOK)
+async def update_folder(
+        user_id: int = Depends(get_user_id),
+        folder_id: int = Path(...),
+        update_form: FolderUpdateForm = Body(...),
+        db: AsyncSession = Depends(get_db)
+) -> ResponseOK:
+    """Переименовывает или перемещает папку"""
+
+    return await FolderService.update_folder(user_id, folder_id, update_form, db)
+
+
+@folders_router.delete("/{folder_id}", response_model=ResponseOK)
+async def delete_folder(
+        user_id: int = Depends(get_user_id),
+        folder_id: int = Path(...),
+        db: AsyncSession = Depends(get_db)
+) -> ResponseOK:
+    """Удаляет пустую папку"""
+
+    return await FolderService.delete_folder(user_id, folder_id, db)
+
+
+@folders_router.get(
+    "/{folder_id}/files",
+    response_model=list[FileSchema],
+    response_class=ORJSONResponse
+)
+async def get_folder_files(
+        user_id: int = Depends(get_user_id),
+        folder_id: int = Path(...),
+        recursive: bool = Query(False, description="Включая вложенные папки"),
+        db: AsyncSession = Depends(get_db)
+) -> ORJSONResponse:
+    """Возвращает файлы папки"""
+
+    return ORJSONResponse(
+        await FolderService.get_folder_files(user_id, folder_id, recursive, db)
+    )
+
+
+@folders_router.get("/{folder_id}/size", response_model=FolderSizeSchema)
+async def get_folder_size(
+        user_id: int = Depends(get_user_id),
+        folder_id: int = Path(...),
+        db: AsyncSession = Depends(get_db)
+) -> FolderSizeSchema:
+    """Возвращает объем папки вместе с вложенными"""
+
+    return await FolderService.get_folder_size(user_id, folder_id, db)
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, BigInteger, String, TIMESTAMP, ForeignKey, \
+    Index
+from sqlalchemy.sql import func
+
+from ..databases.sqlalchemy import Base
+
+
+class FoldersORM(Base):
+    __tablename__ = "folders"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    owner_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    parent_id = Column(BigInteger, ForeignKey("folders.id"), nullable=True)
+    name = Column(String(255), nullable=False)
+    path = Column(String(collation="C"), nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    __table_args__ = (
+        Index(
+            "uq_folders_owner_id_parent_id_name",
+            owner_id, func.coalesce(parent_id, 0), name,
+            unique=True
+        ),
+        Index("ix_folders_owner_id_path", owner_id, path),
+    )
@@ -0,0 +1,62 @@
+from typing import Optional
+from datetime import datetime
+from pydantic import BaseModel, Field, model_validator
+
+
+class FolderSchema(BaseModel):
+    """Схема папки"""
+
+    id: int  # Идентификатор
+    owner_id: int  # Пользователь которому принадлежит папка
+    parent_id: int | None  # Родительская папка, None для корня
+    name: str  # Название папки
+    path: str  # Материализованный путь из идентификаторов, например /1/5/
+    created_at: datetime  # Дата создания папки
+
+    class Config:
+        from_attributes = True
+
+
+class FolderCreateForm(BaseModel):
+    """Схема создания папки"""
+
+    name: str = Field(..., min_length=1, max_length=255, pattern=r"^[^/]+$")
+    parent_id: Optional[int] = Field(None, description="Родительская папка")
+
+
+class FolderUpdateForm(BaseModel):
+    """
+        Схема для переименования и перемещения папки
+
+        parent_id: null перемещает папку в корень
+    """
+
+    name: Optional[str] = Field(
+        None,
+        min_length=1,
+        max_length=255,
+        pattern=r"^[^/]+$",
+        description="Название папки"
+    )
+    parent_id: Optional[int] = Field(None, description="Новая родительская папка")
+
+    @model_validator(mode="after")
+    def validate_params(self):
+        """Проверяет что форма не пустая и не обнуляет обязательные поля"""
+
+        if not self.model_fields_set:
+            raise ValueError("an empty request")
+
+        for field in ("name",):
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"{field} can't be null")
+
+        return self
+
+
+class FolderSizeSchema(BaseModel):
+    """Объем папки вместе с вложенными"""
+
+    folder_id: int  # Идентификатор папки
+    files_count: int  # Количество файлов
+    total_size: int  # Суммарный размер файлов в байтах
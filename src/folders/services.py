@@ -0,0 +1,395 @@
+from fastapi import HTTPException
+
+from sqlalchemy import insert, update, delete, select, exists
+from sqlalchemy.sql import func
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import FoldersORM
+from .schemas import FolderSchema, FolderCreateForm, FolderUpdateForm, \
+    FolderSizeSchema
+from ..files.models import FilesORM
+from ..files.services import FileService
+from ..files.changes import FileChangesService
+from ..databases.sqlalchemy import is_unique_violation, \
+    is_foreign_key_violation
+from ..base_response import ResponseOK
+
+
+class FolderService:
+    """
+        Логическая иерархия папок
+
+        Путь папки хранится материализованным из идентификаторов (/1/5/9/),
+            а файлы ссылаются на папку по folder_id. Физическое расположение
+            файла (FilesORM.path) от папки не зависит, поэтому перенос папки
+            меняет только строки folders и не трогает ни файлы, ни диск
+    """
+
+    @staticmethod
+    def _subtree(prefix: str) -> ColumnElement[bool]:
+        """
+            Условие на папку и все вложенные в нее по префиксу пути
+
+            Диапазон вместо LIKE, чтобы btree индекс по path (collation C)
+                использовался и в подготовленных запросах
+        """
+
+        return (FoldersORM.path >= prefix) & (FoldersORM.path < prefix[:-1] + "0")
+
+    @staticmethod
+    async def get_folder(
+            user_id: int,
+            folder_id: int,
+            db: AsyncSession
+    ) -> FolderSchema:
+        """Возвращает папку пользователя"""
+
+        folder = await db.scalars(
+            select(FoldersORM)
+            .where(FoldersORM.id == folder_id)
+        )
+        folder = folder.first()
+
+        if folder is None:
+            raise HTTPException(status_code=404, detail="folder not found")
+
+        if folder.owner_id != user_id:
+            raise HTTPException(
+                status_code=403,
+                detail="folder does not belong to the user"
+            )
+
+        return FolderSchema.model_validate(folder)
+
+    @staticmethod
+    async def _lock_folders(
+            user_id: int,
+            folder_ids: list[int],
+            db: AsyncSession
+    ) -> dict[int, FolderSchema]:
+        """
+            Блокирует папки пользователя до конца транзакции
+                и возвращает их актуальные данные
+
+            Строки блокируются в порядке идентификаторов, поэтому встречные
+                перемещения двух папок друг в друга выполняются по очереди,
+                а не ждут друг друга
+        """
+
+        folders = await db.scalars(
+            select(FoldersORM)
+            .where(FoldersORM.id.in_(folder_ids))
+            .order_by(FoldersORM.id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        folders = {x.id: x for x in folders.all()}
+
+        for folder_id in folder_ids:
+            if folder_id not in folders:
+                raise HTTPException(status_code=404, detail="folder not found")
+
+            if folders[folder_id].owner_id != user_id:
+                raise HTTPException(
+                    status_code=403,
+                    detail="folder does not belong to the user"
+                )
+
+        return {
+            folder_id: FolderSchema.model_validate(folder)
+            for folder_id, folder in folders.items()
+        }
+
+    @staticmethod
+    async def get_my_folders(
+            user_id: int,
+            db: AsyncSession
+    ) -> list[FolderSchema]:
+        """Возвращает все папки пользователя в порядке обхода дерева"""
+
+        folders = await db.scalars(
+            select(FoldersORM)
+            .where(FoldersORM.owner_id == user_id)
+            .order_by(FoldersORM.path)
+        )
+
+        return [FolderSchema.model_validate(x) for x in folders.all()]
+
+    @staticmethod
+    async def _name_exists(
+            user_id: int,
+            parent_id: int | None,
+            name: str,
+            db: AsyncSession
+    ) -> bool:
+        """Возвращает есть ли у родителя папка с таким названием"""
+
+        return await db.scalar(
+            select(
+                exists()
+                .where(
+                    (FoldersORM.owner_id == user_id)
+                    & (func.coalesce(FoldersORM.parent_id, 0) == (parent_id or 0))
+                    & (FoldersORM.name == name)
+                )
+            )
+        )
+
+    @classmethod
+    async def create_folder(
+            cls,
+            user_id: int,
+            create_form: FolderCreateForm,
+            db: AsyncSession
+    ) -> FolderSchema:
+        """
+            Создает папку
+
+            Родитель блокируется, чтобы его не удалили и не перенесли,
+                пока путь новой папки строится из его пути
+        """
+
+        parent_path = "/"
+
+        if create_form.parent_id is not None:
+            folders = await cls._lock_folders(
+                user_id, [create_form.parent_id], db
+            )
+            parent_path = folders[create_form.parent_id].path
+
+        if await cls._name_exists(
+            user_id, create_form.parent_id, create_form.name, db
+        ):
+            raise HTTPException(status_code=409, detail="folder exists")
+
+        try:
+            folder_id = await db.scalar(
+                insert(FoldersORM)
+                .values(
+                    owner_id=user_id,
+                    parent_id=create_form.parent_id,
+                    name=create_form.name,
+                    path=parent_path
+                )
+                .returning(FoldersORM.id)
+            )
+
+        except IntegrityError as ex:
+            if not is_unique_violation(ex):
+                raise
+
+            raise HTTPException(status_code=409, detail="folder exists")
+
+        await db.execute(
+            update(FoldersORM)
+            .where(FoldersORM.id == folder_id)
+            .values(path=f"{parent_path}{folder_id}/")
+        )
+        await FileChangesService.bump_listing_version(user_id, db)
+
+        return await cls.get_folder(user_id, folder_id, db)
+
+    @classmethod
+    async def update_folder(
+            cls,
+            user_id: int,
+            folder_id: int,
+            update_form: FolderUpdateForm,
+            db: AsyncSession
+    ) -> ResponseOK:
+        """
+            Переименовывает и перемещает папку
+
+            Перемещение переписывает пути только у вложенных папок
+                одним запросом, файлы при этом не меняются. Папка и новый
+                родитель блокируются до проверок, поэтому проверка на перенос
+                в саму себя видит путь родителя после встречных перемещений
+        """
+
+        values = update_form.model_dump(exclude_unset=True)
+        folder_ids = [folder_id]
+
+        if values.get("parent_id") is not None:
+            folder_ids.append(values["parent_id"])
+
+        folders = await cls._lock_folders(user_id, folder_ids, db)
+        folder = folders[folder_id]
+
+        new_name = values.get("name", folder.name)
+        new_parent_id = values.get("parent_id", folder.parent_id)
+
+        if (
+            (new_name, new_parent_id) != (folder.name, folder.parent_id) and
+            await cls._name_exists(user_id, new_parent_id, new_name, db)
+        ):
+            raise HTTPException(status_code=409, detail="folder exists")
+
+        if new_parent_id != folder.parent_id:
+            new_parent_path = "/"
+
+            if new_parent_id is not None:
+                new_parent = folders[new_parent_id]
+
+                if new_parent.path.startswith(folder.path):
+                    raise HTTPException(
+                        status_code=409,
+                        detail="folder can't be moved into itself"
+                    )
+
+                new_parent_path = new_parent.path
+
+            new_path = f"{new_parent_path}{folder.id}/"
+
+            await db.execute(
+                update(FoldersORM)
+                .where(
+                    (FoldersORM.owner_id == user_id)
+                    & cls._subtree(folder.path)
+                )
+                .values(
+                    path=new_path + func.substr(
+                        FoldersORM.path, len(folder.path) + 1
+                    )
+                )
+            )
+
+        try:
+            await db.execute(
+                update(FoldersORM)
+                .where(FoldersORM.id == folder_id)
+                .values(**values)
+            )
+
+        except IntegrityError as ex:
+            if not is_unique_violation(ex):
+                raise
+
+            raise HTTPException(status_code=409, detail="folder exists")
+
+        await FileChangesService.bump_listing_version(user_id, db)
+
+        return ResponseOK()
+
+    @classmethod
+    async def delete_folder(
+            cls,
+            user_id: int,
+            folder_id: int,
+            db: AsyncSession
+    ) -> ResponseOK:
+        """
+            Удаляет пустую папку
+
+            Файлы папки, лежащие в корзине, переносятся в корень
+                и будут восстановлены туда. Папка блокируется до проверки,
+                поэтому перенос в нее файла или папки либо завершится до
+                проверки и будет ей виден, либо дождется удаления
+        """
+
+        await cls._lock_folders(user_id, [folder_id], db)
+
+        is_not_empty = await db.scalar(
+            select(
+                exists().where(FoldersORM.parent_id == folder_id) |
+                exists().where(
+                    (FilesORM.folder_id == folder_id)
+                    & FilesORM.deleted_at.is_(None)
+                )
+            )
+        )
+
+        if is_not_empty:
+            raise HTTPException(status_code=409, detail="folder is not empty")
+
+        await db.execute(
+            update(FilesORM)
+            .where(FilesORM.folder_id == folder_id)
+            .values(folder_id=None)
+        )
+
+        try:
+            await db.execute(
+                delete(FoldersORM)
+                .where(FoldersORM.id == folder_id)
+            )
+
+        except IntegrityError as ex:
+            if not is_foreign_key_violation(ex):
+                raise
+
+            raise HTTPException(status_code=409, detail="folder is not empty")
+
+        await FileChangesService.bump_listing_version(user_id, db)
+
+        return ResponseOK()
+
+    @classmethod
+    async def get_folder_files(
+            cls,
+            user_id: int,
+            folder_id: int,
+            recursive: bool,
+            db: AsyncSession
+    ) -> list[dict]:
+        """
+            Возвращает файлы папки, а при recursive и всех вложенных папок,
+                в виде словарей полей FileSchema
+        """
+
+        folder = await cls.get_folder(user_id, folder_id, db)
+
+        query = (
+            select(*FileService.LISTING_COLUMNS)
+            .where(FilesORM.deleted_at.is_(None))
+        )
+
+        if recursive:
+            query = (
+                query
+                .join(FoldersORM, FoldersORM.id == FilesORM.folder_id)
+                .where(
+                    (FoldersORM.owner_id == user_id)
+                    & cls._subtree(folder.path)
+                )
+            )
+
+        else:
+            query = query.where(FilesORM.folder_id == folder_id)
+
+        rows = await db.execute(query)
+        keys = tuple(rows.keys())
+
+        return [dict(zip(keys, row)) for row in rows.tuples()]
+
+    @classmethod
+    async def get_folder_size(
+            cls,
+            user_id: int,
+            folder_id: int,
+            db: AsyncSession
+    ) -> FolderSizeSchema:
+        """Возвращает количество и объем файлов папки вместе с вложенными"""
+
+        folder = await cls.get_folder(user_id, folder_id, db)
+
+        result = await db.execute(
+            select(
+                func.count(FilesORM.id),
+                func.coalesce(func.sum(FilesORM.size), 0)
+            )
+            .join(FoldersORM, FoldersORM.id == FilesORM.folder_id)
+            .where(
+                (FoldersORM.owner_id == user_id)
+                & cls._subtree(folder.path)
+                & FilesORM.deleted_at.is_(None)
+            )
+        )
+        files_count, total_size = result.one()
+
+        return FolderSizeSchema(
+            folder_id=folder_id,
+            files_count=files_count,
+            total_size=total_size
+        )
@@ -0,0 +1,62 @@
+import asyncio
+
+from fastapi import APIRouter, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+
+from config import FastApiConfig
+
+from .databases.aioredis import get_redis_client
+from .databases.sqlalchemy import get_engine
+
+
+health_router = APIRouter()
+
+
+async def _check_database() -> None:
+    async with get_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+async def _check_redis() -> None:
+    await get_redis_client().ping()
+
+
+@health_router.get("/healthz")
+async def healthz() -> ORJSONResponse:
+    """Процесс жив и обрабатывает запросы, зависимости не проверяются"""
+
+    return ORJSONResponse({"status": "ok"})
+
+
+@health_router.get("/readyz")
+async def readyz(request: Request) -> ORJSONResponse:
+    """
+        Процесс готов принимать трафик: запуск завершен,
+            база данных и redis отвечают
+    """
+
+    if not getattr(request.app.state, "ready", False):
+        return ORJSONResponse({"status": "starting"}, status_code=503)
+
+    checks = {"database": _check_database, "redis": _check_redis}
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(x(), FastApiConfig.READINESS_TIMEOUT)
+            for x in checks.values()
+        ),
+        return_exceptions=True
+    )
+    failed = [
+        name
+        for name, result in zip(checks, results)
+        if isinstance(result, BaseException)
+    ]
+
+    if failed:
+        return ORJSONResponse(
+            {"status": "unavailable", "failed": failed},
+            status_code=503
+        )
+
+    return ORJSONResponse({"status": "ok"})
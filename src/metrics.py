@@ -0,0 +1,106 @@
+from typing import Any
+from threading import Lock
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+
+class _Metric:
+    """Базовая метрика в формате prometheus"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._values: dict[tuple, Any] = {}
+        self._lock = Lock()
+
+        REGISTRY.append(self)
+
+    @staticmethod
+    def _labels_key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _format_labels(key: tuple) -> str:
+        if not key:
+            return ""
+
+        return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+    def _samples(self) -> list[tuple[str, tuple, float]]:
+        return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self) -> str:
+        """Возвращает метрику в текстовом формате prometheus"""
+
+        with self._lock:
+            samples = self._samples()
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}"
+        ]
+        lines.extend(
+            f"{name}{self._format_labels(key)} {value}"
+            for name, key, value in samples
+        )
+
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._labels_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._labels_key(labels)] = value
+
+
+class Summary(_Metric):
+    """Количество и сумма наблюдений"""
+
+    kind = "summary"
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._labels_key(labels)
+
+        with self._lock:
+            count, total = self._values.get(key, (0, 0))
+            self._values[key] = (count + 1, total + value)
+
+    def _samples(self) -> list[tuple[str, tuple, float]]:
+        samples = []
+
+        for key, (count, total) in self._values.items():
+            samples.append((f"{self.name}_count", key, count))
+            samples.append((f"{self.name}_sum", key, total))
+
+        return samples
+
+
+REGISTRY: list[_Metric] = []
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    """Возвращает метрики процесса в формате prometheus"""
+
+    return "\n".join(x.render() for x in REGISTRY) + "\n"
@@ -0,0 +1,233 @@
+import time
+import random
+import logging
+import cProfile
+import functools
+import threading
+
+from typing import Callable, Iterator
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import orjson
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import ProfilingConfig
+
+
+logger = logging.getLogger("storage_manager.requests")
+
+
+@dataclass
+class RequestTrace:
+    """Время, потраченное запросом на базу данных, redis и файловую систему"""
+
+    sql: list[tuple[str, float]] = field(default_factory=list)
+    redis: list[tuple[str, float]] = field(default_factory=list)
+    fs: list[tuple[str, str, float]] = field(default_factory=list)
+
+
+_trace: ContextVar[RequestTrace | None] = ContextVar("request_trace", default=None)
+_profiler_lock = threading.Lock()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+
+    if trace is not None and conn.info.get("query_start"):
+        started = conn.info["query_start"].pop()
+        trace.sql.append(
+            (statement[:ProfilingConfig.STATEMENT_LENGTH], time.perf_counter() - started)
+        )
+
+
+def trace_redis(command: str, duration: float) -> None:
+    """Учитывает команду redis в текущем запросе"""
+
+    trace = _trace.get()
+
+    if trace is not None:
+        trace.redis.append((command, duration))
+
+
+@contextmanager
+def trace_io(operation: str, path: Path | str) -> Iterator[None]:
+    """Учитывает обращение к файловой системе в текущем запросе"""
+
+    trace = _trace.get()
+
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        trace.fs.append((operation, str(path), time.perf_counter() - started))
+
+
+def traced_io(operation: str) -> Callable:
+    """Декоратор для функций, первым аргументом принимающих путь"""
+
+    def decorator(function: Callable) -> Callable:
+
+        @functools.wraps(function)
+        def wrapper(path, *args, **kwargs):
+            with trace_io(operation, path):
+                return function(path, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _summary(items: list[tuple], duration_index: int = -1) -> dict:
+    total = sum(x[duration_index] for x in items)
+
+    return {"count": len(items), "ms": round(total * 1000, 2)}
+
+
+class ProfilingMiddleware:
+    """
+        Журнал медленных запросов и профилирование по запросу
+
+        Для каждого запроса собирается время SQL, команд redis и обращений
+            к файловой системе. Запрос дольше SLOW_REQUEST_MS записывается
+            в журнал одной json строкой с разбивкой по ним.
+
+        Запрос с заголовком X-Profile, равным PROFILE_TOKEN, или попавший
+            в выборку PROFILE_SAMPLE_RATE, выполняется под cProfile, а профиль
+            сохраняется в PROFILE_DIRECTORY. Профилировщик один на процесс,
+            поэтому в профиль попадает и работа других запросов в это время
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    @staticmethod
+    def _should_profile(scope: dict) -> bool:
+        if ProfilingConfig.PROFILE_TOKEN:
+            for name, value in scope.get("headers", []):
+                if (
+                    name == b"x-profile" and
+                    value.decode() == ProfilingConfig.PROFILE_TOKEN
+                ):
+                    return True
+
+        return random.random() < ProfilingConfig.PROFILE_SAMPLE_RATE
+
+    @staticmethod
+    def _save_profile(profiler: cProfile.Profile, scope: dict) -> str:
+        directory = Path(ProfilingConfig.PROFILE_DIRECTORY)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        name = scope["path"].strip("/").replace("/", "_") or "root"
+        path = directory / f"{time.time_ns()}-{scope['method']}-{name}.prof"
+        profiler.dump_stats(path)
+
+        return str(path)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        status = {}
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["stream"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+
+            await send(message)
+
+        profiler = None
+
+        if self._should_profile(scope) and _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        started = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+
+        finally:
+            duration = time.perf_counter() - started
+            _trace.reset(token)
+            profile_path = None
+
+            if profiler is not None:
+                profiler.disable()
+                _profiler_lock.release()
+                profile_path = self._save_profile(profiler, scope)
+
+            # Подключение к ленте событий длится долго по определению
+            slow = (
+                duration * 1000 >= ProfilingConfig.SLOW_REQUEST_MS and
+                not status.get("stream")
+            )
+
+            if slow or profile_path:
+                self._log(scope, status.get("code"), duration, trace, profile_path)
+
+    @staticmethod
+    def _log(
+            scope: dict,
+            status: int | None,
+            duration: float,
+            trace: RequestTrace,
+            profile_path: str | None
+    ) -> None:
+        sql, redis, fs = _summary(trace.sql), _summary(trace.redis), _summary(trace.fs)
+        total_ms = round(duration * 1000, 2)
+        slowest = sorted(trace.sql, key=lambda x: x[1], reverse=True)
+
+        logger.warning(orjson.dumps({
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "ms": total_ms,
+            "sql": {
+                **sql,
+                "slowest": [
+                    {"statement": x, "ms": round(y * 1000, 2)}
+                    for x, y in slowest[:ProfilingConfig.SLOWEST_STATEMENTS]
+                ]
+            },
+            "redis": {
+                **redis,
+                "commands": [
+                    {"command": x, "ms": round(y * 1000, 2)}
+                    for x, y in trace.redis
+                ]
+            },
+            "fs": {
+                **fs,
+                "calls": [
+                    {"operation": x, "path": y, "ms": round(z * 1000, 2)}
+                    for x, y, z in trace.fs
+                ]
+            },
+            "other_ms": round(total_ms - sql["ms"] - redis["ms"] - fs["ms"], 2),
+            "profile": profile_path
+        }).decode())
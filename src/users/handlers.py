@@ -5,6 +5,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .schemas import UserSchema, UserCreateForm, UserUpdateForm
 from .services import UserServices
 from ..auth.schemas import AccessTokenResponse
+from ..analytics.schemas import StorageUsageSchema
+from ..analytics.services import StorageAnalyticsService
 from ..auth.services import get_user_id
 from ..databases.aioredis import get_redis_cursor
 from ..databases.sqlalchemy import get_db
@@ -44,3 +46,13 @@ async def update_user_self(
     """Обновляет данные о текущем пользователе"""
 
     return await UserServices.update_user_data(user_id, update_form, db)
+
+
+@users_router.get("/me/storage", response_model=StorageUsageSchema)
+async def get_user_storage(
+        user_id: int = Depends(get_user_id),
+        db: AsyncSession = Depends(get_db)
+) -> StorageUsageSchema:
+    """Возвращает использование хранилища текущим пользователем"""
+
+    return await StorageAnalyticsService.get_user_usage(user_id, db)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, String
+from sqlalchemy import Column, BigInteger, String, Boolean
 
 from ..databases.sqlalchemy import Base
 
@@ -10,3 +10,6 @@ class UsersORM(Base):
     name = Column(String(30), nullable=False)
     email = Column(String(40), nullable=False, unique=True)
     password = Column(String(32), nullable=False)
+    files_version = Column(BigInteger, nullable=False, server_default="0")
+    files_changes_pruned = Column(BigInteger, nullable=False, server_default="0")  # Журнал изменений очищен до этой версии
+    is_admin = Column(Boolean, nullable=False, server_default="false")